@@ -13,19 +13,51 @@
 # /*                                                                                    */
 # /*====================================================================================*/
 
+from uci_startup import StartupReport
+
+# Start of the startup timeline, before any other import
+startup = StartupReport()
+
+from concurrent.futures import CancelledError
 from datetime import datetime
 from threading import Thread, Condition, Event
 
-import matplotlib.pyplot as plt
-import numpy as np
+import asyncio
 import os
 import queue
 import serial
 import signal
 import sys
-import zmq
 import re
 
+from uci_reader import UciFrameReader, uci_payload_length
+from uci_segment import SegmentBuffer, RANGE_DATA_MAX_SIZE, RFRAME_LOG_MAX_SIZE, CIR_LOG_MAX_SIZE
+from uci_dispatch import UciDispatcher, MT_NTF
+from uci_async import AsyncUciDevice
+from uci_transaction import UciTransactions
+from uci_config_cache import UciConfigCache
+from uci_resume import UciSessionResume
+from uci_replay import LogReplay
+from uci_log import OutputLog, RawFrameLog, RAW_RX, RAW_TX, RAW_CACHE
+from uci_capture import FrameCapture
+from uci_timestamp import TimestampClock
+from uci_acquisition import FrameQueue, FRAME_QUEUE_SIZE
+from uci_shm import AcquisitionProcess, AcquisitionPort
+from uci_pipeline import SinkPipeline, Sink, SINK_BLOCK, SINK_DROP_OLDEST
+from uci_coalesce import CoalescedCommand, coalesce_commands
+from uci_tlv import UciImageStore, wire_frame
+from uci_qformat import qformat
+from uci_layout import RangeDecoder
+from uci_stats import RollingStats, LINEAR, CIRCULAR
+
+# Imported by load_modules() only when plots or IPC are enabled
+np = None
+plt = None
+zmq = None
+uci_cir = None
+
+startup.mark("modules imported")
+
 # Arguments: DS-TWR_Unicast.py [i|r] [COM12] [10] [notime] [noplot|nocirplot] [ipc <prefix_file_name> | <bin_path>] [OFFSET=xx]
 #   Role of the Rhodes board ("i" for initiator, "r" for responder)
 #   Communication Port (e.g. "COM12")
@@ -35,6 +67,19 @@ import re
 #   "ipc" to store all output into file which name is controled by IPC (in this case, timestamp and plots are disabled)
 #   or bin_path to store CIR, RFrame and Range Data notifications in binary files (no store if empty)
 #   TX Power offset (e.g. "OFFSET=8")
+#   "legacyread" to read each UCI frame with separate header and payload reads
+#   "async" to run serial transport and session handling on an asyncio event loop instead of threads (POSIX, no plot)
+#   "cache" to skip the bring-up steps already applied to the same device by the previous run (not with "async")
+#   "resume" to keep the ranging session left active or idle by the previous run instead of resetting the device (not with "async")
+#   "REPLAY=<log_file>" to process the frames received in a log instead of the device, at "SPEED=x" times the original timing (0: as fast as possible)
+#   "nocoalesce" to send each configuration command as defined instead of merging consecutive ones
+#   "RAWLOG=<file>" to store the frames sent and received in a binary log instead of their hex lines in the output
+#   or "CAPTURE=<file>" to store them in an indexed capture with monotonic timestamps (read by uci_capture.py, replayed by REPLAY)
+#   "QUEUE=<frames>" to set the number of frames read and not yet processed above which notifications are dropped (default 4096)
+#   "AVG=<n>" to set the number of measurements of the rolling averages and statistics of each controlee (default 10),
+#   and print the averages of the controlee after each measurement ("Avg(n)" lines)
+#   "acqproc" to read the serial port in a child process writing the frames to shared memory, not slowed down by the plots (not with "async"),
+#   the child process owns the serial port and writes the commands of the script (a COMx port is opened by a single process on Windows)
 
 
 # Default role of the Rhodes board (Initiator|Responder)
@@ -70,182 +115,198 @@ channel_ID = [0x09]
 # Power offset
 power_offset = 0
 
+# To drain all available bytes of the serial port at once (header then payload reads if False)
+is_bulk_read = True
+
+# To use the asyncio engine instead of the read and write threads
+is_async = False
+
+# To skip OTP reads, reset and configuration blocks already applied to the device
+is_cache = False
+
+# To merge consecutive CORE_SET_CONFIG and SESSION_SET_APP_CONFIG commands
+is_coalesce = True
+
+# To resume the session kept by the device instead of resetting it
+is_resume = False
+
+# Frames read and not yet processed above which notifications are dropped
+frame_queue_size = FRAME_QUEUE_SIZE
+
+# To read the serial port in a child process instead of the read thread
+is_acq_process = False
+
+# Configuration applied to each device, shared by all working directories
+CONFIG_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uwb_device_cache.json")
+
+# Commands compiled once into framed images (see uci_tlv.py), kept between runs
+images = UciImageStore(os.path.splitext(os.path.abspath(__file__))[0] + "_images.json")
+
 # To read out calibration values from OTP. 2021.11.30
-UWB_EXT_READ_CALIB_DATA_XTAL_CAP = [0x2A, 0x01, 0x00, 0x03, 0x09, 0x01, 0x02]
+UWB_EXT_READ_CALIB_DATA_XTAL_CAP = images.command(0x0A, 0x01, [0x09, 0x01, 0x02])
 UWB_EXT_READ_CALIB_DATA_XTAL_CAP_NTF = bytes([0x6A, 0x01, 0x00, 0x05])
-UWB_EXT_READ_CALIB_DATA_TX_POWER = [0x2A, 0x01, 0x00, 0x03] + channel_ID + [0x01, 0x01]
+UWB_EXT_READ_CALIB_DATA_TX_POWER = images.command(0x0A, 0x01, channel_ID + [0x01, 0x01])
 UWB_EXT_READ_CALIB_DATA_TX_POWER_NTF = bytes([0x6A, 0x01, 0x00, 0x06])
 
 # Initialize the UWBD for specific platform variant
-UWB_SET_BOARD_VARIANT = [0x2E, 0x00, 0x00, 0x02, 0x73, 0x04]
+UWB_SET_BOARD_VARIANT = images.command(0x0E, 0x00, [0x73, 0x04])
 
 # Reset the UWB device
-UWB_RESET_DEVICE = [0x20, 0x00, 0x00, 0x01, 0x00]
+UWB_RESET_DEVICE = images.command(0x00, 0x00, [0x00])
 
 # Configure parameters of the UWB device
-UWB_CORE_SET_CONFIG = [0x20, 0x04, 0x00, 0x1C,
-    0x06,                                             # Number of parameters
-    0x01, 0x01, 0x01,                                 # LOW_POWER_MODE
-    0xE4, 0x02, 0x01, 0x00,                           # DPD_WAKEUP_SRC
-    0xE4, 0x03, 0x01, 0x14,                           # WTX_COUNT_CONFIG
-    0xE4, 0x04, 0x02, 0xF4, 0x01,                     # DPD_ENTRY_TIMEOUT
-    0xE4, 0x28, 0x04, 0x2F, 0x2F, 0x2F, 0x00,         # TX_PULSE_SHAPE_CONFIG
-    0xE4, 0x33, 0x01, 0x01                            # NXP_EXTENDED_NTF_CONFIG
-]
-
-UWB_CORE_SET_ANTENNA_TX_IDX_DEFINE = [0x20, 0x04, 0x00, 0x0F,
-	0x01, 
-	0xE4, 0x61, 0x0B, 0x02,
+UWB_CORE_SET_CONFIG = images.core_set_config([
+    ("LOW_POWER_MODE", 0x01),
+    ("DPD_WAKEUP_SRC", 0x00),
+    ("WTX_COUNT_CONFIG", 0x14),
+    ("DPD_ENTRY_TIMEOUT", 500),
+    ("TX_PULSE_SHAPE_CONFIG", [0x2F, 0x2F, 0x2F, 0x00]),
+    ("NXP_EXTENDED_NTF_CONFIG", 0x01)
+])
+
+UWB_CORE_SET_ANTENNA_TX_IDX_DEFINE = images.core_set_config([
+	("ANTENNA_TX_IDX_DEFINE", [0x02,       # Number of TX antennas
 	0x01, 0x01, 0x00, 0x00, 0x00,   # TX_ANTENNA: 0x01 - MASK selects EF1, EF1 = 0 => Tx-ANT0
-	0x02, 0x01, 0x00, 0x01, 0x00    # TX_ANTENNA: 0x02 - MASK selects EF1, EF1 = 1 => NA
-]
+	0x02, 0x01, 0x00, 0x01, 0x00])  # TX_ANTENNA: 0x02 - MASK selects EF1, EF1 = 1 => NA
+])
 
-UWB_CORE_SET_ANTENNA_RX_IDX_DEFINE = [0x20, 0x04, 0x00, 0x1D,
-	0x01, 
-	0xE4, 0x60, 0x19, 0x04,
+UWB_CORE_SET_ANTENNA_RX_IDX_DEFINE = images.core_set_config([
+	("ANTENNA_RX_IDX_DEFINE", [0x04,       # Number of RX antennas
 	0x01, 0x01, 0x02, 0x00, 0x00, 0x00,   # RX_ANTENNA: 0x01 - Rx1 port – MASK selects EF2, EF2 = 0 => ANT2
 	0x02, 0x01, 0x02, 0x00, 0x02, 0x00,   # RX_ANTENNA: 0x02 - Rx1 port – MASK selects EF2, EF2 = 1 => ANT1
 	0x03, 0x02, 0x01, 0x00, 0x01, 0x00,   # RX_ANTENNA: 0x03 - Rx2 port – MASK selects EF1, EF1 = 1 => ANT0
-	0x04, 0x02, 0x01, 0x00, 0x00, 0x00    # RX_ANTENNA: 0x04 - Rx2 port – MASK selects EF1, EF1 = 0 => NA
-]
+	0x04, 0x02, 0x01, 0x00, 0x00, 0x00])  # RX_ANTENNA: 0x04 - Rx2 port – MASK selects EF1, EF1 = 0 => NA
+])
 
-UWB_CORE_SET_ANTENNAS_RX_PAIR_DEFINE = [0x20, 0x04, 0x00, 0x11,
-	0x01, 
-	0xE4, 0x62, 0x0D, 0x02,
+UWB_CORE_SET_ANTENNAS_RX_PAIR_DEFINE = images.core_set_config([
+	("ANTENNAS_RX_PAIR_DEFINE", [0x02,                     # Number of RX antenna pairs
 	0x01, 0x01, 0x03, 0x00, 0x00, 0x00,                 # RX_ANTENNA_PAIR: 0x01 – ANT2 & ANT0 
-	0x02, 0x02, 0x03, 0x00, 0x00, 0x00                  # RX_ANTENNA_PAIR: 0x02 – ANT1 & ANT0
-]
+	0x02, 0x02, 0x03, 0x00, 0x00, 0x00])                # RX_ANTENNA_PAIR: 0x02 – ANT1 & ANT0
+])
 
 # Session ID
 SESSION_ID = [0x01, 0x00, 0x00, 0x00]
 
 # Create new UWB ranging session
-UWB_SESSION_INIT_RANGING = [0x21, 0x00, 0x00, 0x05] + SESSION_ID + [0x00]
+UWB_SESSION_INIT_RANGING = images.command(0x01, 0x00, SESSION_ID + [0x00])
 
 # Set Application configurations parameters
 # Generic settings
-UWB_SESSION_SET_APP_CONFIG = [0x21, 0x03, 0x00, 0x75] + SESSION_ID + [
-    0x22,                                             # Number of parameters
-#   0x00, 0x01, 0x00,                                 # DEVICE_TYPE
-    0x01, 0x01, 0x02,                                 # RANGING_ROUND_USAGE
-    0x02, 0x01, 0x00,                                 # STS_CONFIG
-    0x03, 0x01, 0x01,                                 # MULTI_NODE_MODE --> multi mode
-    0x04, 0x01] + channel_ID + [                      # CHANNEL_NUMBER
-    0x05, 0x01, 0x08,                                 # NUMBER_OF_CONTROLEES --> 8
-#   0x06, 0x02, 0x00, 0x00,                           # DEVICE_MAC_ADDRESS
-#   0x07, 0x02, 0x00, 0x00,                           # DST_MAC_ADDRESS
-    0x08, 0x02, 0x60, 0x09,                           # SLOT_DURATION (2400 rtsu = 2000us)
-    0x09, 0x04, 0xF4, 0x01, 0x00, 0x00,               # RANGING_DURATION (500ms)
-    0x0A, 0x04, 0x00, 0x00, 0x00, 0x00,               # STS_INDEX
-    0x0B, 0x01, 0x00,                                 # MAC_FCS_TYPE
-    0x0C, 0x01, 0x03,                                 # RANGING_ROUND_CONTROL
-    0x0D, 0x01, 0x01,                                 # AOA_RESULT_REQ
-    0x0E, 0x01, 0x01,                                 # RANGE_DATA_NTF_CONFIG
-    0x0F, 0x02, 0x00, 0x00,                           # RANGE_DATA_NTF_PROXIMITY_NEAR
-    0x10, 0x02, 0x20, 0x4E,                           # RANGE_DATA_NTF_PROXIMITY_FAR
-#   0x11, 0x01, 0x00                                  # DEVICE_ROLE
-    0x12, 0x01, 0x03,                                 # RFRAME_CONFIG
-    0x13, 0x01, 0x00,                                 # RSSI_REPORTING
-    0x14, 0x01, 0x0A,                                 # PREAMBLE_CODE_INDEX
-    0x15, 0x01, 0x02,                                 # SFD_ID
-    0x16, 0x01, 0x00,                                 # PSDU_DATA_RATE
-    0x17, 0x01, 0x01,                                 # PREAMBLE_DURATION
-    0x1A, 0x01, 0x01,                                 # RANGING_TIME_STRUCT
-    0x1B, 0x01, 0x19,                                 # SLOTS_PER_RR
-    0x1C, 0x01, 0x01,                                 # TX_ADAPTIVE_PAYLOAD_POWER #change 03/23 Kato
-    0x1E, 0x01, 0x01,                                 # RESPONDER_SLOT_INDEX
-    0x1F, 0x01, 0x00,                                 # PRF_MODE
-    0x22, 0x01, 0x01,                                 # SCHEDULED_MODE
-    0x23, 0x01, 0x00,                                 # KEY_ROTATION
-    0x24, 0x01, 0x00,                                 # KEY_ROTATION_RATE
-    0x25, 0x01, 0x32,                                 # SESSION_PRIORITY
-    0x26, 0x01, 0x00,                                 # MAC_ADDRESS_MODE
-####0x27, 0x02, 0x00, 0x00,                           # VENDOR_ID
-####0x28, 0x06, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,   # STATIC_STS_IV
-    0x29, 0x01, 0x01,                                 # NUMBER_OF_STS_SEGMENTS
-    0x2A, 0x02, 0x00, 0x00,                           # MAX_RR_RETRY
-####0x2B, 0x04, 0x00, 0x00, 0x00, 0x00,               # UWB_INITIATION_TIME
-    0x2C, 0x01, 0x00,                                 # HOPPING_MODE
-####0x2D, 0x01, 0x00,                                 # BLOCK_STRIDE_LENGTH
-####0x2E, 0x01, 0x00,                                 # RESULT_REPORT_CONFIG
-    0x2F, 0x01, 0x00                                  # IN_BAND_TERMINATION_ATTEMPT_COUNT
-####0x30, 0x04, 0x00, 0x00, 0x00, 0x00,               # SUB_SESSION_ID
-]
+UWB_SESSION_SET_APP_CONFIG = images.app_config(SESSION_ID, [
+#   ("DEVICE_TYPE", 0x00),
+    ("RANGING_ROUND_USAGE", 0x02),
+    ("STS_CONFIG", 0x00),
+    ("MULTI_NODE_MODE", 0x01),                        # --> multi mode
+    ("CHANNEL_NUMBER", channel_ID[0]),
+    ("NUMBER_OF_CONTROLEES", 0x08),                   # --> 8
+#   ("DEVICE_MAC_ADDRESS", 0x0000),
+#   ("DST_MAC_ADDRESS", [0x0000]),
+    ("SLOT_DURATION", 2400),                          # 2400 rtsu = 2000us
+    ("RANGING_DURATION", 500),                        # 500ms
+    ("STS_INDEX", 0),
+    ("MAC_FCS_TYPE", 0x00),
+    ("RANGING_ROUND_CONTROL", 0x03),
+    ("AOA_RESULT_REQ", 0x01),
+    ("RANGE_DATA_NTF_CONFIG", 0x01),
+    ("RANGE_DATA_NTF_PROXIMITY_NEAR", 0),
+    ("RANGE_DATA_NTF_PROXIMITY_FAR", 20000),
+#   ("DEVICE_ROLE", 0x00),
+    ("RFRAME_CONFIG", 0x03),
+    ("RSSI_REPORTING", 0x00),
+    ("PREAMBLE_CODE_INDEX", 0x0A),
+    ("SFD_ID", 0x02),
+    ("PSDU_DATA_RATE", 0x00),
+    ("PREAMBLE_DURATION", 0x01),
+    ("RANGING_TIME_STRUCT", 0x01),
+    ("SLOTS_PER_RR", 0x19),
+    ("TX_ADAPTIVE_PAYLOAD_POWER", 0x01),              # change 03/23 Kato
+    ("RESPONDER_SLOT_INDEX", 0x01),
+    ("PRF_MODE", 0x00),
+    ("SCHEDULED_MODE", 0x01),
+    ("KEY_ROTATION", 0x00),
+    ("KEY_ROTATION_RATE", 0x00),
+    ("SESSION_PRIORITY", 0x32),
+    ("MAC_ADDRESS_MODE", 0x00),
+####("VENDOR_ID", 0x0000),
+####("STATIC_STS_IV", [0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),
+    ("NUMBER_OF_STS_SEGMENTS", 0x01),
+    ("MAX_RR_RETRY", 0),
+####("UWB_INITIATION_TIME", 0),
+    ("HOPPING_MODE", 0x00),
+####("BLOCK_STRIDE_LENGTH", 0x00),
+####("RESULT_REPORT_CONFIG", 0x00),
+    ("IN_BAND_TERMINATION_ATTEMPT_COUNT", 0x00)
+####("SUB_SESSION_ID", 0),
+])
     # Proprietary
-UWB_SESSION_SET_APP_CONFIG_NXP = [0x21, 0x03, 0x00, 0x31] + SESSION_ID + [
-    0x0A,                                             # Number of parameters
-    0xE3, 0x01, 0x01, 0x76,                           # CIR_CAPTURE_MODE
-####0xE3, 0x02, 0x01, 0x01,                           # MAC_PAYLOAD_ENCRYPTION
-####0xE3, 0x03, 0x01, 0x01,                           # RX_ANTENNA_POLARIZATION_OPTION
-    0xE3, 0x05, 0x01, 0x03,                           # SESSION_SYNC_ATTEMPTS
-    0xE3, 0x06, 0x01, 0x03,                           # SESSION_SHED_ATTEMPTS
-    0xE3, 0x07, 0x01, 0x00,                           # SCHED_STATUS_NTF
-    0xE3, 0x08, 0x01, 0x00,                           # TX_POWER_DELTA_FCC
-    0xE3, 0x09, 0x01, 0x00,                           # TEST_KDF_FEATURE
-    0xE3, 0x0B, 0x01, 0x00,                           # TX_POWER_TEMP_COMPENSATION
-####0xE3, 0x0C, 0x01, 0x03,                           # WIFI_COEX_MAX_TOLERANCE_COUNT
-####0xE3, 0x0D, 0x01, 0x00,                           # ADAPTIVE_HOPPING_THRESHOLD
-####0xE3, 0x13, 0x01, 0x00,                           # AUTHENTICITY_TAG
-####0xE3, 0x14, 0x02, 0x1E, 0x14,                     # RX_NBIC_CONFIG
-    0xE3, 0x15, 0x01, 0x03,                           # MAC_CFG
-####0xE3, 0x16, 0x01, 0x00                            # SESSION_INBAND_DATA_TX_BLOCKS
-####0xE3, 0x17, 0x01, 0x00                            # SESSION_INBAND_DATA_RX_BLOCKS
-####0xE3, 0x18, 0x01, 0x00                            # SUSPEND_RANGING
-####0xE3, 0x19, 0x01, 0x00                            # RX_ANTENNA_SELECTION_RFM
-####0xE3, 0x1A, 0x01, 0x00                            # DATA_TRANSFER_MODE
-    0xE3, 0x1B, 0x02, 0x01, 0x00,                     # ANTENNAS_CONFIGURATION_TX, supported from FW32
-    0xE3, 0x1C, 0x04, 0x00, 0x02, 0x01, 0x02          # ANTENNAS_CONFIGURATION_RX, supported from FW32, for 3D AoA
-#   0xE3, 0x1C, 0x04, 0x00, 0x02, 0x01, 0x00          # ANTENNAS_CONFIGURATION_RX, supported from FW32, for 2D AoA
-]
+UWB_SESSION_SET_APP_CONFIG_NXP = images.app_config(SESSION_ID, [
+    ("CIR_CAPTURE_MODE", 0x76),
+####("MAC_PAYLOAD_ENCRYPTION", 0x01),
+####("RX_ANTENNA_POLARIZATION_OPTION", 0x01),
+    ("SESSION_SYNC_ATTEMPTS", 0x03),
+    ("SESSION_SHED_ATTEMPTS", 0x03),
+    ("SCHED_STATUS_NTF", 0x00),
+    ("TX_POWER_DELTA_FCC", 0x00),
+    ("TEST_KDF_FEATURE", 0x00),
+    ("TX_POWER_TEMP_COMPENSATION", 0x00),
+####("WIFI_COEX_MAX_TOLERANCE_COUNT", 0x03),
+####("ADAPTIVE_HOPPING_THRESHOLD", 0x00),
+####("AUTHENTICITY_TAG", 0x00),
+####("RX_NBIC_CONFIG", [0x1E, 0x14]),
+    ("MAC_CFG", 0x03),
+####("SESSION_INBAND_DATA_TX_BLOCKS", 0x00),
+####("SESSION_INBAND_DATA_RX_BLOCKS", 0x00),
+####("SUSPEND_RANGING", 0x00),
+####("RX_ANTENNA_SELECTION_RFM", 0x00),
+####("DATA_TRANSFER_MODE", 0x00),
+    ("ANTENNAS_CONFIGURATION_TX", [0x01, 0x00]),             # supported from FW32
+    ("ANTENNAS_CONFIGURATION_RX", [0x00, 0x02, 0x01, 0x02])  # supported from FW32, for 3D AoA
+#   ("ANTENNAS_CONFIGURATION_RX", [0x00, 0x02, 0x01, 0x00])  # supported from FW32, for 2D AoA
+])
 
 # Set Application configurations parameters
 # Specific settings for Initiator
-UWB_SESSION_SET_INITIATOR_CONFIG = [0x21, 0x03, 0x00, 0x21] + SESSION_ID + [
-    0x04,                                          # Number of parameters
-    0x00, 0x01, 0x01,                              # DEVICE_TYPE: Controller
-    0x06, 0x02, 0x11, 0x11,                        # DEVICE_MAC_ADDRESS: 0x1111
-    0x07, 0x10, 0x00, 0x10, 0x01, 0x10, 
-        0x02, 0x10, 0x03, 0x10, 
-        0x04, 0x10, 0x05, 0x10, 
-        0x06, 0x10, 0x07, 0x10,                    # DST_MAC_ADDRESS: 0x1000-0x1007
-    0x11, 0x01, 0x01                               # DEVICE_ROLE: Initiator
-]
+UWB_SESSION_SET_INITIATOR_CONFIG = images.app_config(SESSION_ID, [
+    ("DEVICE_TYPE", 0x01),                         # Controller
+    ("DEVICE_MAC_ADDRESS", 0x1111),
+    ("DST_MAC_ADDRESS", [0x1000, 0x1001, 0x1002, 0x1003,
+                         0x1004, 0x1005, 0x1006, 0x1007]),
+    ("DEVICE_ROLE", 0x01)                          # Initiator
+])
 
 # Set Application configurations parameters
 # Specific settings for Responder
-UWB_SESSION_SET_RESPONDER_CONFIG = [0x21, 0x03, 0x00, 0x13] + SESSION_ID + [ 
-    0x04,                                          # Number of parameters
-    0x00, 0x01, 0x00,                              # DEVICE_TYPE: Controlee
-    0x06, 0x02, 0x22, 0x22,                        # DEVICE_MAC_ADDRESS: 0x2222
-    0x07, 0x02, 0x11, 0x11,                        # DST_MAC_ADDRESS: 0x1111
-    0x11, 0x01, 0x00                               # DEVICE_ROLE: Responder
-]
+UWB_SESSION_SET_RESPONDER_CONFIG = images.app_config(SESSION_ID, [
+    ("DEVICE_TYPE", 0x00),                         # Controlee
+    ("DEVICE_MAC_ADDRESS", 0x2222),
+    ("DST_MAC_ADDRESS", [0x1111]),
+    ("DEVICE_ROLE", 0x00)                          # Responder
+])
 
 # Set Debug configurations parameters
-UWB_SESSION_SET_DEBUG_CONFIG = [0x21, 0x03, 0x00, 0x3C] + SESSION_ID + [
-    0x0C,                                          # Number of parameters
-    0xE4, 0x00, 0x02, 0x00, 0x00,                  # THREAD_SECURE
-    0xE4, 0x01, 0x02, 0x00, 0x00,                  # THREAD_SECURE_ISR
-    0xE4, 0x02, 0x02, 0x00, 0x00,                  # THREAD_NON_SECURE_ISR
-    0xE4, 0x03, 0x02, 0x00, 0x00,                  # THREAD_SHELL
-    0xE4, 0x04, 0x02, 0x00, 0x00,                  # THREAD_PHY
-    0xE4, 0x05, 0x02, 0x00, 0x00,                  # THREAD_RANGING
-    0xE4, 0x06, 0x02, 0x00, 0x00,                  # THREAD_SECURE_ELEMENT
-    0xE4, 0x10, 0x01, 0x00,                        # DATA_LOGGER_NTF
-    0xE4, 0x11, 0x01, 0x00,                        # CIR_LOG_NTF
-    0xE4, 0x12, 0x01, 0x00,                        # PSDU_LOG_NTF
-    0xE4, 0x13, 0x01, 0x00,                        # RFRAME_LOG_NTF
-    0xE4, 0x14, 0x01, 0x00                         # TEST_CONTENTION_RANGING_FEATURE
-]
+UWB_SESSION_SET_DEBUG_CONFIG = images.app_config(SESSION_ID, [
+    ("THREAD_SECURE", 0x0000),
+    ("THREAD_SECURE_ISR", 0x0000),
+    ("THREAD_NON_SECURE_ISR", 0x0000),
+    ("THREAD_SHELL", 0x0000),
+    ("THREAD_PHY", 0x0000),
+    ("THREAD_RANGING", 0x0000),
+    ("THREAD_SECURE_ELEMENT", 0x0000),
+    ("DATA_LOGGER_NTF", 0x00),
+    ("CIR_LOG_NTF", 0x00),
+    ("PSDU_LOG_NTF", 0x00),
+    ("RFRAME_LOG_NTF", 0x00),
+    ("TEST_CONTENTION_RANGING_FEATURE", 0x00)
+])
 
 # Start UWB ranging session
-UWB_RANGE_START = [0x22, 0x00, 0x00, 0x04] + SESSION_ID
+UWB_RANGE_START = images.command(0x02, 0x00, SESSION_ID)
 
 # Stop UWB ranging session
-UWB_RANGE_STOP = [0x22, 0x01, 0x00, 0x04] + SESSION_ID
+UWB_RANGE_STOP = images.command(0x02, 0x01, SESSION_ID)
 
 # Deinit UWB session
-UWB_SESSION_DEINIT = [0x21, 0x01, 0x00, 0x04] + SESSION_ID
+UWB_SESSION_DEINIT = images.command(0x01, 0x01, SESSION_ID)
 
 #Set Calibration API
 #   0x00: VCO PLL
@@ -264,6 +325,7 @@ UWB_SESSION_DEINIT = [0x21, 0x01, 0x00, 0x04] + SESSION_ID
 #   0x14: RSSI_CALIB_CONSTANT_LOW_PWR
 #   0x15: SNR_CALIB_CONSTANT_UNIFIED
 
+# Completed with the values read from OTP: framed when sent
 UWB_SET_POWER_CALIBRATION = [0x2E, 0x11, 0x00, 0x09] + channel_ID + [ 
     0x17,               # TX_POWER_PER_ANTENNA
 	0x02,               # Number of parameters
@@ -276,30 +338,24 @@ UWB_SET_CFO_CALIBRATION = [0x2E, 0x11, 0x00, 0x05] + channel_ID + [
     0x12, 0x12, 0x21
 ] 
                                       
-UWB_SET_CALIBRATION_PDOA_MANUFACT_ZERO_OFFSET_CALIB_CH5 = [0x2E, 0x11, 0x00, 0x09,
-    0x05,               # Channel ID
-    0x11,               # PDOA_MANUFACT_ZERO_OFFSET_CALIB
+UWB_SET_CALIBRATION_PDOA_MANUFACT_ZERO_OFFSET_CALIB_CH5 = images.set_calibration(0x05, "PDOA_MANUFACT_ZERO_OFFSET_CALIB", [
 	0x02,               # Number of parameters
     #0x01, 0x00, 0x00,   # RX_ANTENNA_PAIR:0x01, in Q9.7 hex 
     #0x02, 0x00, 0x00,   # RX_ANTENNA_PAIR:0x02, in Q9.7 hex 
     0x01, 0xAD, 0x01,   # RX_ANTENNA_PAIR:0x01, in Q9.7 hex # N3 average data come from py#30_31 + 3.35 Murata EVK value
     0x02, 0xB1, 0x0A,   # RX_ANTENNA_PAIR:0x02, in Q9.7 hex # N3 average data come from py#30_31 +21.38 Murata EVK value
-]
+])
                                        
-UWB_SET_CALIBRATION_PDOA_MANUFACT_ZERO_OFFSET_CALIB_CH9 = [0x2E, 0x11, 0x00, 0x09,
-    0x09,               # Channel ID
-    0x11,               # PDOA_MANUFACT_ZERO_OFFSET_CALIB
+UWB_SET_CALIBRATION_PDOA_MANUFACT_ZERO_OFFSET_CALIB_CH9 = images.set_calibration(0x09, "PDOA_MANUFACT_ZERO_OFFSET_CALIB", [
     0x02,               # Number of parameters
     #0x01, 0x00, 0x00,   # RX_ANTENNA_PAIR:0x01, in Q9.7 hex 
     #0x02, 0x00, 0x00,   # RX_ANTENNA_PAIR:0x02, in Q9.7 hex 
     0x01, 0x83, 0xFB,   # RX_ANTENNA_PAIR:0x01, in Q9.7 hex # N3 average data come from py#30_31 -8.98 Murata EVK value
     0x02, 0x50, 0xFB,   # RX_ANTENNA_PAIR:0x02, in Q9.7 hex # N3 average data come from py#30_31 -9.38 Murata EVK value
-]
+])
 
            
-UWB_SET_CALIBRATION_PDOA_MULTIPOINT_CALIB_CH5 = [0x2E, 0x11, 0x00, 0x25,
-    0x05,                                               # Channel ID
-    0x0D,                                               # PDOA_MULTIPOINT_CALIB
+UWB_SET_CALIBRATION_PDOA_MULTIPOINT_CALIB_CH5 = images.set_calibration(0x05, "AOA_ANTENNAS_MULTIPOINT_CALIB", [
 	0x02,                                               # Number of parameters
     0x01,                                               # RX_ANTENNA_PAIR : 0x01
     0x80, 0x5C, 0x00, 0x00,                             # azimuth  00°(0x80) elevation -36°(0x5C)
@@ -311,11 +367,9 @@ UWB_SET_CALIBRATION_PDOA_MULTIPOINT_CALIB_CH5 = [0x2E, 0x11, 0x00, 0x25,
     0x80, 0xA4, 0x00, 0x00,                             # azimuth  00°(0x80) elevation +36°(0xA4)
     0x5C, 0x80, 0x00, 0x00,                             # azimuth -36°(0x5C) elevation  00°(0x80)
     0xA4, 0x80, 0x00, 0x00                              # azimuth +36°(0xA4) elevation  00°(0x80) PDoA +0° (0x0000)
-]
+])
        
-UWB_SET_CALIBRATION_PDOA_MULTIPOINT_CALIB_CH9 = [0x2E, 0x11, 0x00, 0x25,
-    0x09,                                               # Channel ID
-    0x0D,                                               # PDOA_MULTIPOINT_CALIB
+UWB_SET_CALIBRATION_PDOA_MULTIPOINT_CALIB_CH9 = images.set_calibration(0x09, "AOA_ANTENNAS_MULTIPOINT_CALIB", [
 	0x02,                                               # Number of parameters
     0x01,                                               # RX_ANTENNA_PAIR : 0x01
     0x80, 0x5C, 0x00, 0x00,                             # azimuth  00°(0x80) elevation -36°(0x5C)
@@ -327,11 +381,9 @@ UWB_SET_CALIBRATION_PDOA_MULTIPOINT_CALIB_CH9 = [0x2E, 0x11, 0x00, 0x25,
     0x80, 0xA4, 0x00, 0x00,                             # azimuth  00°(0x80) elevation +36°(0xA4)
     0x5C, 0x80, 0x00, 0x00,                             # azimuth -36°(0x5C) elevation  00°(0x80)
     0xA4, 0x80, 0x00, 0x00                              # azimuth +36°(0xA4) elevation  00°(0x80) PDoA +0° (0x0000)
-]
+])
 
-UWB_CORE_SET_RX_ANT_DELAY_CALIB_CH5 = [0x2E, 0x11, 0x00, 0x0F,
-	0x05,                                               # Channel ID
-	0x0F, 		                                        # RX_ANT_DELAY_CALIB
+UWB_CORE_SET_RX_ANT_DELAY_CALIB_CH5 = images.set_calibration(0x05, "RX_ANT_DELAY_CALIB", [
 	0x04,                                               # Number of parameters
 	#0x01, 0x05, 0x3B,                                  # RX_ANTENNA:0x01 NXP default value
 	#0x02, 0x05, 0x3B,                                  # RX_ANTENNA:0x02 NXP default value
@@ -341,11 +393,9 @@ UWB_CORE_SET_RX_ANT_DELAY_CALIB_CH5 = [0x2E, 0x11, 0x00, 0x0F,
     0x02, 0xDC, 0x3A,                                   # RX_ANTENNA:0x02 Murata EVK value
     0x03, 0xDC, 0x3A,                                   # RX_ANTENNA:0x03 Murata EVK value
     0x04, 0xDC, 0x3A                                    # RX_ANTENNA:0x04 Murata EVK value
-]
+])
 
-UWB_CORE_SET_RX_ANT_DELAY_CALIB_CH9 = [0x2E, 0x11, 0x00, 0x0F,
-	0x09,                                               # Channel ID
-	0x0F, 		                                        # RX_ANT_DELAY_CALIB
+UWB_CORE_SET_RX_ANT_DELAY_CALIB_CH9 = images.set_calibration(0x09, "RX_ANT_DELAY_CALIB", [
 	0x04,                                               # Number of parameters
 	#0x01, 0xE9, 0x3A,                                  # RX_ANTENNA:0x01 NXP default value
 	#0x02, 0xE9, 0x3A,                                  # RX_ANTENNA:0x02 NXP default value
@@ -355,11 +405,9 @@ UWB_CORE_SET_RX_ANT_DELAY_CALIB_CH9 = [0x2E, 0x11, 0x00, 0x0F,
     0x02, 0xC5, 0x3A,                                   # RX_ANTENNA:0x02 Murata EVK value
     0x03, 0xC5, 0x3A,                                   # RX_ANTENNA:0x03 Murata EVK value
     0x04, 0xC5, 0x3A                                    # RX_ANTENNA:0x04 Murata EVK value
-]
+])
           
-UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR1_CH5 = [0x2E, 0x11, 0x00, 0xF6,
-	0x05,                                               # Channel ID
-	0x0C,                                               # AOA_ANTENNAS_PDOA_CALIB
+UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR1_CH5 = images.set_calibration(0x05, "AOA_ANTENNAS_PDOA_CALIB", [
 	0x01,                                               # 
 	0x01,                                               # RX_ANTENNA_PAIR:0x01 
     # Pan  -60,        -48,        -36,        -24,        -12,          0,        +12,        +24,        +36,        +48,         +60,
@@ -374,11 +422,9 @@ UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR1_CH5 = [0x2E, 0x11, 0x00, 0xF6,
     0xF6, 0x23, 0xD0, 0x1E, 0x10, 0x12, 0xB5, 0x00, 0xA4, 0xFB, 0xCB, 0xF5, 0x6A, 0xF1, 0x45, 0xEA, 0xAE, 0xDF, 0xAB, 0xD6, 0x0D, 0xD4, 
     0x3D, 0x22, 0xE4, 0x19, 0xAA, 0x11, 0x1B, 0x04, 0x36, 0xFB, 0x71, 0xF2, 0x07, 0xEE, 0xBF, 0xE6, 0x3C, 0xDE, 0xBB, 0xD4, 0x12, 0xD3, 
     0x94, 0x1F, 0xB5, 0x10, 0xC7, 0x0C, 0x5B, 0x0A, 0x92, 0x00, 0x5D, 0xEF, 0x6B, 0xE7, 0xB5, 0xDE, 0x6A, 0xDC, 0xE6, 0xD3, 0x04, 0xD3
-]
+])
 
-UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR2_CH5 = [0x2E, 0x11, 0x00, 0xF6,
-	0x05,                                               # Channel ID
-	0x0C,                                               # AOA_ANTENNAS_PDOA_CALIB
+UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR2_CH5 = images.set_calibration(0x05, "AOA_ANTENNAS_PDOA_CALIB", [
 	0x01,                                               # 
 	0x02,                                               # RX_ANTENNA_PAIR:0x02 
     # Pan  -60,        -48,        -36,        -24,        -12,          0,        +12,        +24,        +36,        +48,         +60,
@@ -393,11 +439,9 @@ UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR2_CH5 = [0x2E, 0x11, 0x00, 0xF6,
     0x63, 0xCC, 0x8A, 0xD1, 0x76, 0xDA, 0xD4, 0xE6, 0xFD, 0xF2, 0x0E, 0xFF, 0x68, 0x0B, 0xFD, 0x13, 0x84, 0x1B, 0x5D, 0x24, 0xE9, 0x28, 
     0x76, 0xCB, 0x15, 0xD2, 0x98, 0xDC, 0x3A, 0xE9, 0x6F, 0xF5, 0x52, 0xFF, 0x35, 0x07, 0xE7, 0x0D, 0x05, 0x12, 0xC4, 0x14, 0x29, 0x17, 
     0xB0, 0xD6, 0xB0, 0xDB, 0x5F, 0xE3, 0x30, 0xED, 0x60, 0xF6, 0x84, 0xFD, 0xAA, 0x04, 0xC7, 0x0A, 0x00, 0x0E, 0x24, 0x0F, 0x43, 0x11
-]
+])
 
-UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR1_CH9 = [0x2E, 0x11, 0x00, 0xF6,
-	0x09,                                               # Channel ID
-	0x0C,                                               # AOA_ANTENNAS_PDOA_CALIB
+UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR1_CH9 = images.set_calibration(0x09, "AOA_ANTENNAS_PDOA_CALIB", [
 	0x01,                                               # 
 	0x01,                                               # RX_ANTENNA_PAIR:0x01 
     # Pan  -60,        -48,        -36,        -24,        -12,          0,        +12,        +24,        +36,        +48,        +60,
@@ -412,11 +456,9 @@ UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR1_CH9 = [0x2E, 0x11, 0x00, 0xF6,
     0x5A, 0x3E, 0xC8, 0x3C, 0x3F, 0x2D, 0xFC, 0x22, 0x9F, 0x10, 0x91, 0xFE, 0xAB, 0xEF, 0xE6, 0xE1, 0x1B, 0xD5, 0x7A, 0xC8, 0x89, 0xBC, 
     0xA7, 0x45, 0x6B, 0x3C, 0x52, 0x2D, 0x8C, 0x20, 0x4D, 0x10, 0x22, 0xFC, 0xC4, 0xE8, 0x35, 0xDC, 0xD7, 0xD4, 0x7F, 0xC8, 0xAC, 0xBA, 
     0xCF, 0x44, 0x89, 0x35, 0x22, 0x30, 0x47, 0x25, 0xF2, 0x11, 0x85, 0xFB, 0xC0, 0xEB, 0x1B, 0xD9, 0x52, 0xCE, 0x49, 0xC7, 0xF1, 0xBB
-]
+])
 
-UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR2_CH9 = [0x2E, 0x11, 0x00, 0xF6,
-	0x09,                                               # Channel ID
-	0x0C,                                               # AOA_ANTENNAS_PDOA_CALIB
+UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR2_CH9 = images.set_calibration(0x09, "AOA_ANTENNAS_PDOA_CALIB", [
 	0x01,                                               # 
 	0x02,                                               # RX_ANTENNA_PAIR:0x02 
     # Pan  -60,        -48,        -36,        -24,        -12,          0,        +12,        +24,        +36,        +48,        +60,
@@ -431,39 +473,33 @@ UWB_CORE_SET_AOA_ANTENNAS_PDOA_CALIB_PAIR2_CH9 = [0x2E, 0x11, 0x00, 0xF6,
     0x31, 0xC8, 0xFD, 0xCD, 0x4B, 0xD3, 0x1B, 0xD9, 0xD4, 0xE3, 0x4F, 0xF5, 0xF0, 0x00, 0x75, 0x0D, 0x96, 0x1A, 0xF3, 0x25, 0x39, 0x2E, 
     0xB6, 0xCD, 0x84, 0xD5, 0x9E, 0xDA, 0x88, 0xDE, 0x4E, 0xE8, 0x28, 0xF6, 0xE1, 0xFE, 0xF1, 0x05, 0x02, 0x13, 0x4E, 0x1C, 0x1A, 0x20, 
     0xF5, 0xD5, 0x12, 0xD7, 0x80, 0xD9, 0x34, 0xE0, 0xF1, 0xEB, 0x18, 0xF8, 0x6B, 0x00, 0x93, 0x03, 0x64, 0x07, 0x38, 0x0C, 0xF7, 0x11
-]
+])
 
-UWB_CORE_SET_PDOA_OFFSET_CALIB_CH5 = [0x2E, 0x11, 0x00, 0x09,
-	0x05,                                                   # Channel ID
-	0x10,                                                   # PDOA_OFFSET_CALIB
+UWB_CORE_SET_PDOA_OFFSET_CALIB_CH5 = images.set_calibration(0x05, "PDOA_OFFSET_CALIB", [
 	0x02,                                                   # Number of parameters
 	0x01, 0xD6, 0x07,                                       # RX_ANTENNA_PAIR:0x01
     0x02, 0xF4, 0x05                                        # RX_ANTENNA_PAIR:0x02
-]
+])
 
-UWB_CORE_SET_PDOA_OFFSET_CALIB_CH9 = [0x2E, 0x11, 0x00, 0x09,
-	0x09,                                                   # Channel ID
-	0x10,                                                   # PDOA_OFFSET_CALIB
+UWB_CORE_SET_PDOA_OFFSET_CALIB_CH9 = images.set_calibration(0x09, "PDOA_OFFSET_CALIB", [
 	0x02,                                                   # Number of parameters
 	0x01, 0x0F, 0xFF,                                       # RX_ANTENNA_PAIR:0x01
     0x02, 0x97, 0x04                                        # RX_ANTENNA_PAIR:0x02
-]
+])
 
-UWB_CORE_SET_AOA_THRESHOLD_PDOA_CH5 = [0x2E, 0x11, 0x00, 0x09,
-	0x05,                                                   # Channel ID
-	0x12,                                                   # AOA_THRESHOLD_PDOA
+UWB_CORE_SET_AOA_THRESHOLD_PDOA_CH5 = images.set_calibration(0x05, "AOA_THRESHOLD_PDOA", [
 	0x02,                                                   # Number of parameters
 	0x01, 0xD7, 0xAD,                                       # RX_ANTENNA_PAIR:0x01
     0x02, 0xF5, 0xAB                                        # RX_ANTENNA_PAIR:0x02
-]
+])
 
-UWB_CORE_SET_AOA_THRESHOLD_PDOA_CH9 = [0x2E, 0x11, 0x00, 0x09,
-	0x09,                                                   # Channel ID
-	0x12,                                                   # AOA_THRESHOLD_PDOA
+UWB_CORE_SET_AOA_THRESHOLD_PDOA_CH9 = images.set_calibration(0x09, "AOA_THRESHOLD_PDOA", [
 	0x02,                                                   # Number of parameters
 	0x01, 0x0E, 0x59,                                       # RX_ANTENNA_PAIR:0x01
     0x02, 0x98, 0xAA                                        # RX_ANTENNA_PAIR:0x02
-]
+])
+
+startup.mark("command tables compiled")
 
 ###########################################################
 class SIGINThandler():
@@ -534,19 +570,36 @@ go_stop = Event()
 stop_write_thread = False
 stop_read_thread = False
 stop_ipc_thread = False
-retry_cmd = False
 meas_idx = 1
-seq_cnt = ""
-range_data = []
+range_data = SegmentBuffer(RANGE_DATA_MAX_SIZE)
 bin_store = False
-cir0_file = ""
-cir1_file = ""
-rframe_session = ""
-rframe_nb = 0
-rframe_meas = []
+cir0_data = SegmentBuffer(CIR_LOG_MAX_SIZE)
+cir1_data = SegmentBuffer(CIR_LOG_MAX_SIZE)
+rframe_data = SegmentBuffer(RFRAME_LOG_MAX_SIZE)
 file_ipc = None
 socket = None
 file_data_log = None
+frame_reader = None
+frame_queue = None
+acquisition = None
+dispatcher = UciDispatcher()
+range_decoder = RangeDecoder()
+transactions = None
+config_cache = None
+session_resume = None
+log_replay = None
+raw_log = None
+clock = TimestampClock()
+output_log = OutputLog(clock)
+pipeline = SinkPipeline()
+receive_time_ns = 0  # Time of the last frame received (time.monotonic_ns())
+is_stored = False
+
+# Rolling statistics of range data (per controlee)
+avg_window_size = 10
+is_avg_output = False  # Averages printed after each measurement (AVG given)
+RANGE_STATS_FIELDS = [("distance", LINEAR), ("azimuth", CIRCULAR), ("elevation", CIRCULAR)]
+range_stats = RollingStats(RANGE_STATS_FIELDS, avg_window_size)
 
 # Not draw when index is negative
 range_plot = {"index": -1, "valid": False, "nlos": 0, "distance": 0,
@@ -556,21 +609,21 @@ range_plot = {"index": -1, "valid": False, "nlos": 0, "distance": 0,
 cir_plot = {"nb_meas": 0, "mappings": [], "cir_samples": []}
 
 
-# Output string on STDOUT or store into file depending of IPC mode
-# Return True is success to write string into file
-def output(string):
+# Queue a line of the output, or a frame written as hex bytes after string, written by the log thread
+def output(string, frame=None, timestamp=None):
     global is_ipc
     global file_ipc
+    global output_log
     
     if (is_ipc):
         if ((file_ipc is not None) and (not file_ipc.closed) and (file_ipc.writable())):
             # File available for write
-            file_ipc.write(string + "\n")
+            output_log.put(file_ipc, string, frame, timestamp)
         
             return True
     else:
         # Output string on STDOUT
-        print(string)
+        output_log.put(None, string, frame, timestamp)
         
     return False
 
@@ -727,72 +780,123 @@ def draw_cir(plot_cir, data):
         plot_cir.legend(loc="upper left")
 
 
-def extract_seq_cnt(byte_array):
-    return int((byte_array[3] << 24) + (byte_array[2] << 16) + (byte_array[1] << 8) + byte_array[0])
-
-
-def extract_nlos(byte_array):
-    return int(byte_array[28])
-
-
-def extract_distance(byte_array):
-    return int((byte_array[30] << 8) + byte_array[29])
-
-
-def extract_azimuth(byte_array):
-    return int((byte_array[32] << 8) + byte_array[31])
-
-
-def extract_azimuth_fom(byte_array):
-    return int(byte_array[33])
+# Value of q_in in Qn_ints.n_fracs rounded to round_of decimals (lookup table of the format)
+def convert_qformat_to_float(q_in, n_ints, n_fracs, round_of=2):
+    return qformat(n_ints, n_fracs).to_float(q_in, round_of)
 
 
-def extract_elevation(byte_array):
-    return int((byte_array[35] << 8) + byte_array[34])
+def log_sent_command(uci_command):
+    global is_timestamp
+    global raw_log
+    global clock
+    
+    # Binary sinks are always timestamped, the text is formatted by the log thread
+    time_ns = clock.now()
+    if (raw_log is not None):
+        raw_log.frame(RAW_TX, bytes(uci_command), time_ns=time_ns)
+    else:
+        output("NXPUCIX => ", bytes(uci_command), time_ns if (is_timestamp) else None)
+    
+    if (startup.first_command()):
+        for line in startup.report():
+            output("Startup: " + line)
 
 
-def extract_elevation_fom(byte_array):
-    return int(byte_array[36])
+# time_ns: time of the read of the frame (time.monotonic_ns()), now if None
+def log_received_frame(uci_hdr, uci_payload, time_ns=None):
+    global is_timestamp
+    global is_stored
+    global raw_log
+    global clock
+    global receive_time_ns
+    
+    if (time_ns is None):
+        time_ns = clock.now()
+    receive_time_ns = time_ns
+    
+    # The payload may be a view on the read buffer: the frame is copied before being queued
+    if (raw_log is not None):
+        raw_log.frame(RAW_RX, uci_hdr, uci_payload, time_ns=time_ns)
+        is_stored = True
+    else:
+        is_stored = output("NXPUCIR <= ", b"".join((uci_hdr, uci_payload)), time_ns if (is_timestamp) else None)
 
 
-def extract_cir(byte_array):
-    cir_raw = []
+def transmit_command(uci_command):
+    global write_wait
+    global serial_port
     
-    for idx in range(0, len(byte_array), 4):
-        cir_sample = byte_array[idx:idx + 4]
+    write_wait.acquire()  # Acquire Lock to avoid mixing in output
+    if serial_port.isOpen():
+        log_sent_command(uci_command)
         
-        real = twos_comp(int((cir_sample[1] << 8) + cir_sample[0]), 16)
-        imaginary = twos_comp(int((cir_sample[3] << 8) + cir_sample[2]), 16)
-        
-        cir_raw.append(real + 1j * imaginary)
-    
-    return np.abs(cir_raw)
+        # USB packet built once for compiled commands
+        serial_port.write(wire_frame(uci_command))
+    write_wait.release()
 
-def extract_pdoa1(byte_array):
-    return int((byte_array[67] << 8) + byte_array[66])
-    
-def extract_pdoa2(byte_array):
-    return int((byte_array[71] << 8) + byte_array[70])
 
-def twos_comp(val, bits):
-    # Compute the 2's complement of integer val with the width of bits
-    if (val & (1 << (bits - 1))) != 0:  # If sign bit is set
-        val = val - (1 << bits)  # Compute negative value
-    return val
+# Send a command and wait for its RSP
+def execute_command(uci_command):
+    global transactions
+    
+    return transactions.send_command(uci_command).result()
 
 
-def convert_qformat_to_float(q_in, n_ints, n_fracs, round_of=2):
-    bits = n_ints + n_fracs
+# Handle a notification read from the configuration cache instead of the device
+def replay_notification(uci_hdr, uci_payload):
+    global write_wait
+    global dispatcher
+    global raw_log
     
-    # Compute the 2's complement of integer q_in with the width of n_ints + n_fracs
-    if (q_in & (1 << (bits - 1))) != 0:  # If sign bit is set
-        q_in = q_in - (1 << bits)  # Compute negative value
+    write_wait.acquire()  # Acquire Lock to avoid mixing in output
+    if (raw_log is not None):
+        raw_log.frame(RAW_CACHE, uci_hdr, uci_payload)
+    else:
+        output("NXPUCIC <= ", b"".join((uci_hdr, uci_payload)))
+    dispatcher.dispatch(uci_hdr, uci_payload)
+    write_wait.release()
+
+
+# Send a command and wait for its RSP, return False if stopped while waiting
+def send_command(uci_command):
+    global config_cache
+    global session_resume
+    global range_decoder
     
-    # Divide by 2^n_fracs
-    frac = q_in / (1 << n_fracs)
+    # Layout of the RANGE_DATA_NTF (applied to the device, sent or not)
+    range_decoder.configure(uci_command)
     
-    # Return rounded value
-    return round(frac, round_of)
+    try:
+        if ((session_resume is not None) and (session_resume.skip(uci_command))):
+            # Kept by the device since the previous run
+            return True
+        
+        if ((config_cache is not None) and (config_cache.skip(uci_command))):
+            # Already applied to the device
+            return True
+        
+        # Wait the reception of RSP before allowing send of new CMD
+        # (the command is repeated on timeout or retry request)
+        result = execute_command(uci_command)
+    except CancelledError:
+        return False
+    
+    if (config_cache is not None):
+        config_cache.update(uci_command, result)
+    
+    if ((not result.is_ok()) and (isinstance(uci_command, CoalescedCommand))):
+        # Merged command rejected: send the commands as defined
+        output("#=> Merged command %02x %02x rejected: %s, sending the %d commands separately" \
+               % (uci_command[0], uci_command[1], result.status_name(), len(uci_command.parts)))
+        for part in uci_command.parts:
+            if (not send_command(part)):
+                return False
+        return True
+    
+    if (not result.is_ok()):
+        output("#=> Command %02x %02x failed after %d attempt(s): %s" \
+               % (uci_command[0], uci_command[1], result.attempts, result.status_name()))
+    return True
 
 
 def write_to_serial_port():
@@ -800,28 +904,19 @@ def write_to_serial_port():
     global command_queue
     global session_status
     global go_stop
-    global write_wait
     global serial_port
-    global retry_cmd
-    global is_timestamp
+    global transactions
+    global config_cache
+    global session_resume
     global readOTP
     
     output("Write to serial port started")
     while (not stop_write_thread):
-        if (retry_cmd):
-            retry_cmd = False
-        else:
-            uci_command = command_queue.get()
+        uci_command = command_queue.get()
         
         if (uci_command[0] == 0xFF and uci_command[1] == 0xFF):
             break
         
-        usb_out_packet = bytearray()
-        usb_out_packet.append(0x01)
-        usb_out_packet.append(0x00)
-        usb_out_packet.append(len(uci_command))
-        usb_out_packet.extend(uci_command)
-        
         if (uci_command[0] == 0x21 and uci_command[1] == 0x03):
             # Wait Session State Initialized to send APP Configs
             session_status.allow_config.wait()
@@ -834,408 +929,372 @@ def write_to_serial_port():
             # Wait reach limit of measurements to stop ranging
             go_stop.wait()
             
-        write_wait.acquire()  # Acquire Lock to avoid mixing in output
         if serial_port.isOpen():
-            if (is_timestamp):
-                output(datetime.now().isoformat(sep=" ", timespec="milliseconds") + "NXPUCIX => " + \
-                      "".join("{:02x} ".format(x) for x in uci_command))
-            else:
-                output("NXPUCIX => " + "".join("{:02x} ".format(x) for x in uci_command))
-            
-            serial_port.write(serial.to_bytes(usb_out_packet))
-            # Wait the reception of RSP or timeout of 0.25s before allowing send of new CMD
-            notified = write_wait.wait(0.25)  
-            if (not (notified)): retry_cmd = True  # Repeat command if timeout
-        write_wait.release()
-    
+            if (not send_command(uci_command)):
+                break
+    
+    for line in transactions.report():
+        output("Command statistics: " + line)
+    if (config_cache is not None):
+        config_cache.save()
+        output("Bring-up statistics: " + config_cache.report())
+    if (session_resume is not None):
+        output("Session resume: " + session_resume.report())
     output("Write to serial port exited")
 
 
-def read_from_serial_port():
-    global stop_read_thread
-    global serial_port
-    global write_wait
-    global retry_cmd
+def handle_core_generic_error_ntf(uci_hdr, uci_payload):
+    global transactions
+    
+    if (transactions is None):
+        # Replay of a log: no command sent
+        return
+    if (uci_hdr[3] == 0x01 and uci_payload[0] == 0x0A):
+        # Command retry without wait response
+        transactions.on_retry_request()
+
+
+def handle_read_calib_data_ntf(uci_hdr, uci_payload):
+    global UWB_SET_POWER_CALIBRATION
+    global UWB_SET_CFO_CALIBRATION
+    
+    if (uci_hdr == UWB_EXT_READ_CALIB_DATA_XTAL_CAP_NTF):
+        #print("XTAL_CAP in OTP 0x%02X 0x%02X 0x%02X" % (uci_payload[2], uci_payload[3], uci_payload[4]))
+        #CALIB_DATA_XTAL_CAP = uci_payload
+        UWB_SET_CFO_CALIBRATION[6] = uci_payload[2]
+        UWB_SET_CFO_CALIBRATION[7] = uci_payload[3]
+        UWB_SET_CFO_CALIBRATION[8] = uci_payload[4]
+    
+    if (uci_hdr == UWB_EXT_READ_CALIB_DATA_TX_POWER_NTF):
+        #print("TX_POWER in OTP ", end="")
+        #CALIB_DATA_TX_POWER = uci_payload
+        UWB_SET_POWER_CALIBRATION[8] = uci_payload[2] + power_offset + int((2.1-0.6+0.5)*4) # Murata EVK case: ANT+2.1dBi, trace loss 0.6dB
+        UWB_SET_POWER_CALIBRATION[9] = uci_payload[3]
+        #print(" 0x%02X 0x%02X" % (uci_payload[2], uci_payload[3]))
+
+
+def handle_session_status_ntf(uci_hdr, uci_payload):
     global session_status
     global go_stop
-    global nb_meas
-    global is_timestamp
+    global is_ipc
+    global socket
+    
+    if (uci_hdr[3] == 0x06):
+        # Change Session state
+        session_status.set(uci_payload[4])
+        
+        if (uci_payload[5] == 0x01):
+            # Session termination on max RR Retry
+            go_stop.set()
+        
+        if ((is_ipc) and (uci_payload[4] == 0x02)):
+            # Ranging is active
+            output_log.flush()
+            file_ipc.close()
+            
+            # indicate to server the start of ranging
+            if(socket is not None):
+                try:
+                    socket.send_string("started")
+                except:
+                    print("Fail to send started on socket")
+
+
+def store_cir_log(cir_log, suffix):
     global meas_idx
+    
+    # Create file and write payload without Session ID
+    file_name = "uwb_data_session_"
+    file_name += format((cir_log[3] << 24) + (cir_log[2] << 16) + \
+                        (cir_log[1] << 8) + cir_log[0])
+    file_name += "_"
+    file_name += format(meas_idx)
+    file_name += suffix
+    
+    pipeline.publish("bin", (file_name, bytes(cir_log[4:])))
+
+
+def handle_cir0_log_segment(uci_hdr, uci_payload):
+    # DBG_CIR0_LOG_NTF with PBF = 1 and extended payload length
+    cir0_data.append(uci_payload)
+
+
+def handle_cir0_log_ntf(uci_hdr, uci_payload):
+    # DBG_CIR0_LOG_NTF with PBF = 0 and standard payload length
+    store_cir_log(cir0_data.complete(uci_payload), "_CIR0.log")
+
+
+def handle_cir1_log_segment(uci_hdr, uci_payload):
+    # DBG_CIR1_LOG_NTF with PBF = 1 and extended payload length
+    cir1_data.append(uci_payload)
+
+
+def handle_cir1_log_ntf(uci_hdr, uci_payload):
+    # DBG_CIR1_LOG_NTF with PBF = 0 and standard payload length
+    store_cir_log(cir1_data.complete(uci_payload), "_CIR1.log")
+
+
+def handle_rframe_log_segment(uci_hdr, uci_payload):
+    # DBG_RFRAME_LOG_NTF with PBF = 1
+    rframe_data.append(uci_payload)
+
+
+def handle_rframe_log_ntf(uci_hdr, uci_payload):
     global bin_store
-    global cir0_file
-    global cir1_file
-    global rframe_session
-    global rframe_nb
-    global rframe_meas
+    global meas_idx
+    global is_cir_plot
+    global pipeline
+    
+    # DBG_RFRAME_LOG_NTF with PBF = 0
+    rframe_log = rframe_data.complete(uci_payload)
+    
+    if (bin_store):
+        file_name = "uwb_data_session_"
+        file_name += format((rframe_log[3] << 24) + (rframe_log[2] << 16) + \
+                            (rframe_log[1] << 8) + rframe_log[0])
+        file_name += "_"
+        file_name += format(meas_idx)
+        file_name += "_rframe.log"
+        
+        # Number of measurements followed by measurements
+        pipeline.publish("bin", (file_name, bytes(rframe_log[4:])))
+    
+    if (not is_cir_plot):
+        # CIR samples are only used by the plot
+        return
+    
+    # CIR samples extracted by the plot sink
+    pipeline.publish("plot", ("cir", bytes(rframe_log)))
+
+
+# Sinks of the decoded events, called by their worker threads
+def write_csv_row(event):
+    global file_data_log
+    global clock
+    
+    # Row written after the time of the notification
+    time_ns, row = event
+    if ((file_data_log is not None) and (not file_data_log.closed)):
+        file_data_log.write(clock.format(time_ns) + row + "\n")
+
+
+def store_binary_file(event):
+    file_name, data = event
+    with open(file_name, "wb") as data_file:
+        data_file.write(data)
+
+
+def update_plot(event):
     global range_plot
+    global cir_plot
+    
+    if (event[0] == "range"):
+        range_plot.update(event[1])
+        return
+    
+    # DBG_RFRAME_LOG_NTF, all the measurements decoded at once
+    mappings, cir_samples = uci_cir.decode_rframe_cir(event[1])
+    
+    cir_plot["mappings"] = mappings.tolist()
+    cir_plot["cir_samples"] = np.abs(cir_samples)
+    
+    # Number of Rframe measurements set last as the plot is drawn once set
+    cir_plot["nb_meas"] = len(mappings)
+
+
+# CSV rows and binary files are never dropped, only the latest data is plotted
+def register_sinks():
+    global pipeline
+    global file_data_log
+    global bin_store
+    global is_range_plot
+    global is_cir_plot
+    
+    if (file_data_log is not None):
+        pipeline.add(Sink("csv", write_csv_row, policy=SINK_BLOCK), ["csv"])
+    if (bin_store):
+        pipeline.add(Sink("bin", store_binary_file, policy=SINK_BLOCK), ["bin"])
+    if ((is_range_plot) or (is_cir_plot)):
+        pipeline.add(Sink("plot", update_plot, capacity=4, policy=SINK_DROP_OLDEST), ["plot"])
+
+
+def handle_range_data_segment(uci_hdr, uci_payload):
+    # RANGE_DATA_NTF with PBF = 1
+    range_data.append(uci_payload)
+
+
+def handle_range_data_ntf(uci_hdr, uci_payload):
+    global go_stop
+    global nb_meas
+    global meas_idx
     global is_ipc
     global socket
-    global seq_cnt
-    global range_data
-    global UWB_SET_POWER_CALIBRATION
-    global UWB_SET_CFO_CALIBRATION
+    global file_data_log
+    global output_log
+    global receive_time_ns
+    global range_decoder
+    global range_stats
+    global is_avg_output
+    global is_range_plot
+    
+    # RANGE_DATA_NTF with PBF = 0
+    range_ntf = range_decoder.decode(range_data.complete(uci_payload))
+    seq_cnt = range_ntf.seq_cnt
+    
+    output("***[%d]" % (seq_cnt))
+    
+    if (startup.first_measurement()):
+        output("Startup: restart to first measurement %.1f ms" % (startup.elapsed() * 1000))
+    
+    log = "," + str(seq_cnt) + ","
+    plot = None
+    for num, meas in enumerate(range_ntf.measurements):
+        # Check Status (0x1B: negative distance, sign applied by the decoder)
+        if (not meas.valid):
+            output("***** Ranging Error Detected ****")
+            log += ",,,,,,,"
+        else:
+            output("***(%d) NLos:%d   Dist:%d   Azimuth:%f (FOM:%d)   Elevation:%f (FOM:%d)" \
+                  % (num, meas.nlos, meas.distance, meas.azimuth, meas.azimuth_fom, meas.elevation, meas.elevation_fom))
+            log += "%x,%d,%d,%f,%d,%f,%d," % (meas.address, meas.nlos, meas.distance, meas.azimuth, meas.azimuth_fom, meas.elevation, meas.elevation_fom)
+            
+            stats = range_stats.update(meas.address, (meas.distance, meas.azimuth, meas.elevation))
+            is_plotted = ((is_range_plot) and (plot is None))  # First valid controlee of the round plotted
+            if ((is_avg_output) or (is_plotted)):
+                # Averages of the controlee over the window, circular for the angles (around +/-180 degrees)
+                avg_azimuth = stats.azimuth.circular_mean()
+                avg_elevation = stats.elevation.circular_mean()
+            
+            if (is_avg_output):
+                output("Avg(%d) Dist:%d   Azimuth:%f   Elevation:%f" % (num, stats.distance.mean(), avg_azimuth, avg_elevation))
+            
+            if (is_plotted):
+                plot = {"valid": True, "nlos": meas.nlos, "distance": meas.distance,
+                        "azimuth": meas.azimuth, "elevation": meas.elevation,
+                        "avg_azimuth": avg_azimuth, "avg_elevation": avg_elevation,
+                        "index": seq_cnt}
+            
+            if(num == 0):
+                meas_idx = meas_idx + 1
+    if((file_data_log is not None) and (not file_data_log.closed) and (file_data_log.writable())):
+        pipeline.publish("csv", (receive_time_ns, log))
+    
+    if (plot is not None):
+        # Store range data for plot (index last as the plot is drawn once set)
+        pipeline.publish("plot", ("range", plot))
+    
+    if (nb_meas > 0 and meas_idx > nb_meas):
+        if (is_ipc):
+            output_log.flush()
+            file_ipc.close()
+            
+            # indicate to server the end of measurement set
+            if(socket is not None):
+                try:
+                    socket.send_string("ok")
+                except:
+                    print("Fail to send OK on socket")
+            
+            # Restart new set of measures
+            meas_idx = 1
+        else:
+            go_stop.set()
+
+
+def register_handlers():
+    global dispatcher
+    global bin_store
+    global is_async
+    global config_cache
+    global log_replay
+    
+    if ((not is_async) and (log_replay is None)):
+        # Retry requests are handled by the asyncio engine itself, no command sent in replay
+        dispatcher.register(MT_NTF, 0x00, 0x07, handle_core_generic_error_ntf)
+    dispatcher.register(MT_NTF, 0x0A, 0x01, handle_read_calib_data_ntf)
+    dispatcher.register(MT_NTF, 0x01, 0x02, handle_session_status_ntf)
+    
+    if (config_cache is not None):
+        # OTP values and end of session for the next start
+        dispatcher.register(MT_NTF, 0x0A, 0x01, config_cache.on_notification)
+        dispatcher.register(MT_NTF, 0x01, 0x02, config_cache.on_notification)
+    
+    if (bin_store):
+        dispatcher.register(MT_NTF, 0x0E, 0x04, handle_cir0_log_segment, pbf=1)
+        dispatcher.register(MT_NTF, 0x0E, 0x04, handle_cir0_log_ntf)
+        dispatcher.register(MT_NTF, 0x0E, 0x05, handle_cir1_log_segment, pbf=1)
+        dispatcher.register(MT_NTF, 0x0E, 0x05, handle_cir1_log_ntf)
+    
+    dispatcher.register(MT_NTF, 0x0E, 0x0B, handle_rframe_log_segment, pbf=1)
+    dispatcher.register(MT_NTF, 0x0E, 0x0B, handle_rframe_log_ntf)
+    dispatcher.register(MT_NTF, 0x02, 0x00, handle_range_data_segment, pbf=1)
+    dispatcher.register(MT_NTF, 0x02, 0x00, handle_range_data_ntf)
+
+
+# Log and dispatch a frame received from the device or replayed from a log
+def process_frame(uci_hdr, uci_payload, time_ns=None):
+    global serial_port
+    global write_wait
+    global dispatcher
+    global log_replay
+    
+    write_wait.acquire()  # Handlers serialized with the commands sent and the notifications of the cache
+    if len(uci_hdr) == 4:
+        count = uci_hdr[3]
+        if (uci_hdr[1] & 0x80) == 0x80:
+            # Extended length
+            count = int((uci_hdr[3] << 8) + uci_hdr[2])
+        
+        if count > 0:
+            if ((serial_port.isOpen()) or (log_replay is not None)):
+                log_received_frame(uci_hdr, uci_payload, time_ns)
+                
+                if len(uci_payload) == count:
+                    # Call the handlers registered for this type of frame
+                    dispatcher.dispatch(uci_hdr, uci_payload)
+                else:
+                    output("\nExpected Payload bytes is " + str(count) + \
+                          ", Actual Paylod bytes received is " + str(len(uci_payload)))
+            else:
+                output("Port is not opened")
+        else:
+            output("\nUCI Payload Size is Zero")
+    else:
+        output("\nUCI Header is not valid")
+    
+    write_wait.release()
+
+
+# Queue a frame read for the processing thread, after resolving the command of an RSP
+def acquire_frame(uci_hdr, uci_payload, time_ns):
+    global frame_queue
+    global transactions
     
-    meas_nlos = 0
-    meas_distance = 0
-    meas_azimuth = 0
-    meas_azimuth_fom = 0
-    meas_elevation = 0
-    meas_elevation_fom = 0
-    meas_pdoa1 = 0
-    meas_pdoa2 = 0
-    avg_window_size = 10
-    hist_distance = []
-    hist_azimuth = []
-    hist_elevation = []
-    hist_pdoa1 = []
-    hist_pdoa2 = []
-    is_stored = False
+    # The payload is a view on the read buffer, reused by the next read
+    uci_payload = bytes(uci_payload)
+    
+    if ((len(uci_hdr) == 4) and ((uci_hdr[0] & 0xF0) == 0x40) and (len(uci_payload) == uci_payload_length(uci_hdr))):
+        transactions.on_response(uci_hdr, uci_payload)  # Resolve the command of the RSP
+    
+    frame_queue.push_frame(uci_hdr, (uci_hdr, uci_payload, time_ns))
+
+
+# Acquisition: only frame the bytes read, the frames are processed by process_frames()
+def read_from_serial_port():
+    global stop_read_thread
+    global serial_port
+    global frame_reader
+    global frame_queue
+    
+    frame_reader = UciFrameReader(serial_port, bulk=is_bulk_read)
     
     output("Read from serial port started")
     while (not stop_read_thread):
         if serial_port.isOpen():
             if serial_port.isOpen():
-                uci_hdr = serial_port.read(4)  # Read header of UCI frame
-                write_wait.acquire()  # Acquire Lock to avoid mixing in output
-                if len(uci_hdr) == 4:
-                    count = uci_hdr[3]
-                    if (uci_hdr[1] & 0x80) == 0x80:
-                        # Extended length
-                        count = int((uci_hdr[3] << 8) + uci_hdr[2])
-                    
-                    if count > 0:
-                        if serial_port.isOpen():
-                            uci_payload = serial_port.read(count)  # Read payload of UCI frame
-                            
-                            if (is_timestamp):
-                                is_stored = output(datetime.now().isoformat(sep=" ", timespec="milliseconds") + \
-                                      "NXPUCIR <= " + "".join("{:02x} ".format(h) for h in uci_hdr) + \
-                                      "".join("{:02x} ".format(p) for p in uci_payload))
-                            else:
-                                is_stored = output("NXPUCIR <= " + "".join("{:02x} ".format(h) for h in uci_hdr) + \
-                                      "".join("{:02x} ".format(p) for p in uci_payload))
-                            
-                            if len(uci_payload) == count:
-                                if (uci_hdr[0] & 0xF0) == 0x40: write_wait.notify()  # Notify the reception of RSP
-                                
-                                if (uci_hdr[0] == 0x60 and uci_hdr[1] == 0x07 and uci_hdr[3] == 0x01 and \
-                                        uci_payload[0] == 0x0A):
-                                    # Command retry without wait response
-                                    retry_cmd = True
-                                    write_wait.notify()
-                                
-                                if (uci_hdr == UWB_EXT_READ_CALIB_DATA_XTAL_CAP_NTF):
-                                    #print("XTAL_CAP in OTP 0x%02X 0x%02X 0x%02X" % (uci_payload[2], uci_payload[3], uci_payload[4]))
-                                    #CALIB_DATA_XTAL_CAP = uci_payload
-                                    UWB_SET_CFO_CALIBRATION[6] = uci_payload[2]
-                                    UWB_SET_CFO_CALIBRATION[7] = uci_payload[3]
-                                    UWB_SET_CFO_CALIBRATION[8] = uci_payload[4]
-
-                                if (uci_hdr == UWB_EXT_READ_CALIB_DATA_TX_POWER_NTF):
-                                    #print("TX_POWER in OTP ", end="")
-                                    #CALIB_DATA_TX_POWER = uci_payload
-                                    UWB_SET_POWER_CALIBRATION[8] = uci_payload[2] + power_offset + int((2.1-0.6+0.5)*4) # Murata EVK case: ANT+2.1dBi, trace loss 0.6dB 
-                                    UWB_SET_POWER_CALIBRATION[9] = uci_payload[3]
-                                    #print(" 0x%02X 0x%02X" % (uci_payload[2], uci_payload[3]))
-
-                                if (uci_hdr[0] == 0x61 and uci_hdr[1] == 0x02 and uci_hdr[3] == 0x06):
-                                    # Change Session state
-                                    session_status.set(uci_payload[4])
-                                    
-                                    if (uci_payload[5] == 0x01):
-                                        # Session termination on max RR Retry
-                                        go_stop.set()
-                                        
-                                    if ((is_ipc) and (uci_payload[4] == 0x02)):
-                                        # Ranging is active
-                                        file_ipc.close()
-                                        
-                                        # indicate to server the start of ranging
-                                        if(socket is not None):
-                                            try:
-                                                socket.send_string("started")
-                                            except:
-                                                print("Fail to send started on socket")
-                                
-                                if (bin_store and uci_hdr[0] == 0x7E and uci_hdr[1] == 0x84):
-                                    # DBG_CIR0_LOG_NTF with PBF = 1 and extended payload length
-                                    
-                                    if (cir0_file == ""):
-                                        # First segment => create file and write payload without Session ID
-                                        
-                                        cir0_file = "uwb_data_session_"
-                                        cir0_file += format((uci_payload[3] << 24) + (uci_payload[2] << 16) + \
-                                                            (uci_payload[1] << 8) + uci_payload[0])
-                                        cir0_file += "_"
-                                        cir0_file += format(meas_idx)
-                                        cir0_file += "_CIR0.log"
-                                        
-                                        with open(cir0_file, "wb") as data_file:
-                                            data_file.write(uci_payload[4:])
-                                    
-                                    else:
-                                        # Second segment => append file
-                                        with open(cir0_file, "ab") as data_file:
-                                            data_file.write(uci_payload)
-                                
-                                if (bin_store and uci_hdr[0] == 0x6E and uci_hdr[1] == 0x04):
-                                    # DBG_CIR0_LOG_NTF with PBF = 0 and standard payload length
-                                    
-                                    if (cir0_file != ""):
-                                        # Last segment => append file
-                                        with open(cir0_file, "ab") as data_file:
-                                            data_file.write(uci_payload)
-                                    
-                                    cir0_file = ""
-                                
-                                if (bin_store and uci_hdr[0] == 0x7E and uci_hdr[1] == 0x85):
-                                    # DBG_CIR1_LOG_NTF with PBF = 1 and extended payload length
-                                    
-                                    if (cir1_file == ""):
-                                        # First segment => create file and write payload without Session ID
-                                        
-                                        cir1_file = "uwb_data_session_"
-                                        cir1_file += format((uci_payload[3] << 24) + (uci_payload[2] << 16) + \
-                                                            (uci_payload[1] << 8) + uci_payload[0])
-                                        cir1_file += "_"
-                                        cir1_file += format(meas_idx)
-                                        cir1_file += "_CIR1.log"
-                                        
-                                        with open(cir1_file, "wb") as data_file:
-                                            data_file.write(uci_payload[4:])
-                                    
-                                    else:
-                                        # Second segment => append file
-                                        with open(cir1_file, "ab") as data_file:
-                                            data_file.write(uci_payload)
-                                
-                                if (bin_store and uci_hdr[0] == 0x6E and uci_hdr[1] == 0x05):
-                                    # DBG_CIR1_LOG_NTF with PBF = 0 and standard payload length
-                                    
-                                    if (cir1_file != ""):
-                                        # Last segment => append file
-                                        with open(cir1_file, "ab") as data_file:
-                                            data_file.write(uci_payload)
-                                    
-                                    cir1_file = ""
-                                
-                                if (uci_hdr[0] == 0x7E and uci_hdr[1] == 0x0B):
-                                    # DBG_RFRAME_LOG_NTF with PBF = 1
-                                    
-                                    if (rframe_session == ""):
-                                        # First segment
-                                        rframe_session = format((uci_payload[3] << 24) + (uci_payload[2] << 16) + \
-                                                                (uci_payload[1] << 8) + uci_payload[0])
-                                        rframe_nb = uci_payload[4]
-                                        rframe_meas = uci_payload[5:]
-                                    
-                                    else:
-                                        # Second segment => append measurements
-                                        rframe_meas += uci_payload
-                                
-                                if (uci_hdr[0] == 0x6E and uci_hdr[1] == 0x0B):
-                                    # DBG_RFRAME_LOG_NTF with PBF = 0
-                                    
-                                    if (rframe_session == ""):
-                                        # No segment
-                                        rframe_session = format((uci_payload[3] << 24) + (uci_payload[2] << 16) + \
-                                                                (uci_payload[1] << 8) + uci_payload[0])
-                                        rframe_nb = uci_payload[4]
-                                        rframe_meas = uci_payload[5:]
-                                    
-                                    else:
-                                        # Last segment => append measurements
-                                        rframe_meas += uci_payload
-                                    
-                                    if (bin_store):
-                                        file_name = "uwb_data_session_"
-                                        file_name += rframe_session
-                                        file_name += "_"
-                                        file_name += format(meas_idx)
-                                        file_name += "_rframe.log"
-                                        
-                                        with open(file_name, "wb") as data_file:
-                                            data_file.write(rframe_nb)
-                                            data_file.write(rframe_meas)
-                                    
-                                    # Number of Rframe measurements
-                                    cir_plot["nb_meas"] = rframe_nb
-                                    
-                                    # Delete previeous Rframe measurements
-                                    cir_plot["mappings"] = []
-                                    cir_plot["cir_samples"] = []
-                                    
-                                    idx = 0
-                                    for rframe_meas_idx in range(0, rframe_nb):
-                                        cir_plot["mappings"].append(rframe_meas[idx])
-                                        idx += 27
-                                        cir_plot["cir_samples"].append(extract_cir(rframe_meas[idx:idx + 64]))
-                                        idx += 64
-                                    
-                                    rframe_session = ""
-                                    rframe_nb = 0
-                                    rframe_meas = []
-                                      
-                                if (uci_hdr[0] == 0x72 and uci_hdr[1] == 0x00):
-                                    # RANGE_DATA_NTF with PBF = 1
-                                    
-                                    if (seq_cnt == ""):
-                                        # First segment
-                                        seq_cnt = extract_seq_cnt(uci_payload)
-                                        range_data = uci_payload
-                                    else:
-                                        # Second segment => append measurements
-                                        range_data += uci_payload
-                                         
-                                if (uci_hdr[0] == 0x62 and uci_hdr[1] == 0x00):
-                                    # RANGE_DATA_NTF with PBF = 0
-                                    
-                                    if (seq_cnt == ""):
-                                        # No segment
-                                        seq_cnt = extract_seq_cnt(uci_payload)
-                                        range_data = uci_payload
-                                        
-                                    else:
-                                        # Last segment => append measurements
-                                        range_data += uci_payload
-                                        
-                                    # Number of Ranging Measurements
-                                    nb_range = range_data[24]
-                                    
-                                    output("***[%d]" % (seq_cnt))
-                                    
-                                    num = 0
-                                    log = datetime.now().isoformat(sep=" ", timespec="milliseconds") + "," + str(seq_cnt) + ","
-                                    while(num < nb_range):
-                                        data = range_data[(25+num*31):(55+num*31)]
-                                        # Check Status
-                                        if(data[2] != 0x00 and data[2] != 0x1b):
-                                            output("***** Ranging Error Detected ****")
-                                            log += ",,,,,,,"
-                                        else:
-                                            address = data[0] + (data[1] << 8)
-                                            meas_nlos = data[3]
-                                            meas_distance = (data[5] << 8) + data[4]
-                                            if (data[2] == 0x1b):   # negative distance
-                                                meas_distance = -1 * meas_distance
-                                            meas_azimuth = convert_qformat_to_float((data[7] << 8) + data[6], 9, 7, 1)
-                                            meas_azimuth_fom = data[8]
-                                            meas_elevation = convert_qformat_to_float((data[10] << 8) + data[9], 9, 7, 1)
-                                            meas_elevation_fom = data[11]
-                                            output("***(%d) NLos:%d   Dist:%d   Azimuth:%f (FOM:%d)   Elevation:%f (FOM:%d)" \
-                                                  % (num, meas_nlos, meas_distance, meas_azimuth, meas_azimuth_fom, meas_elevation, meas_elevation_fom))
-                                            log += "%x,%d,%d,%f,%d,%f,%d," % (address, meas_nlos, meas_distance, meas_azimuth, meas_azimuth_fom, meas_elevation, meas_elevation_fom)
-                                            
-                                            if(num == 0):
-                                                meas_idx = meas_idx + 1
-                                        num = num + 1
-                                    if((file_data_log is not None) and (not file_data_log.closed) and (file_data_log.writable())):
-                                        file_data_log.write(log+ "\n")
-
-                                    """
-                                    # Check Status
-                                    if (uci_payload[27] != 0x00):
-                                        output("***** Ranging Error Detected ****")
-                                        
-                                        # Store range data for plot
-                                        range_plot["index"] = seq_cnt
-                                        range_plot["valid"] = False
-                                        range_plot["nlos"] = 0
-                                        range_plot["distance"] = 0
-                                        range_plot["aoa1"] = 0
-                                        range_plot["aoa2"] = 0
-                                        range_plot["avg_aoa1"] = 0
-                                        range_plot["avg_aoa2"] = 0
-                                    else:
-                                        if (bin_store):
-                                            file_name = "uwb_data_session_"
-                                            file_name += format((uci_payload[7] << 24) + (uci_payload[6] << 16) + \
-                                                                (uci_payload[5] << 8) + uci_payload[4])
-                                            file_name += "_"
-                                            file_name += format(meas_idx)
-                                            file_name += "_ntf.log"
-                                            
-                                            with open(file_name, "wb") as data_file:
-                                                data_file.write(uci_payload)
-                                        
-                                        meas_nlos = (extract_nlos(uci_payload))
-                                        meas_distance = (extract_distance(uci_payload))
-                                        meas_azimuth = convert_qformat_to_float(extract_azimuth(uci_payload), 9, 7, 1)
-                                        meas_azimuth_fom = (extract_azimuth_fom(uci_payload))
-                                        meas_elevation = convert_qformat_to_float(extract_elevation(uci_payload), 9, 7, 1)
-                                        meas_elevation_fom = (extract_elevation_fom(uci_payload))
-                                        
-                                        # added by maya, 20210618
-                                        if (len(uci_payload) > 71):
-                                            meas_pdoa1 = convert_qformat_to_float(extract_pdoa1(uci_payload), 9, 7, 7)
-                                            meas_pdoa2 = convert_qformat_to_float(extract_pdoa2(uci_payload), 9, 7, 7)
-                                        
-                                        hist_distance.append(meas_distance)
-                                        hist_azimuth.append(meas_azimuth)
-                                        hist_elevation.append(meas_elevation)
-                                        hist_pdoa1.append(meas_pdoa1)
-                                        hist_pdoa2.append(meas_pdoa2)
-                                        
-                                        if (len(hist_distance) > avg_window_size): hist_distance.pop(0)
-                                        if (len(hist_azimuth) > avg_window_size): hist_azimuth.pop(0)
-                                        if (len(hist_elevation) > avg_window_size): hist_elevation.pop(0)
-                                        if (len(hist_pdoa1) > avg_window_size): hist_pdoa1.pop(0)
-                                        if (len(hist_pdoa2) > avg_window_size): hist_pdoa2.pop(0)
-                                        
-                                        avg_distance = sum(hist_distance) / len(hist_distance)
-                                        avg_azimuth = sum(hist_azimuth) / len(hist_azimuth)
-                                        avg_elevation = sum(hist_elevation) / len(hist_elevation)
-                                        avg_pdoa1 = sum(hist_pdoa1) / len(hist_pdoa1)
-                                        avg_pdoa2 = sum(hist_pdoa2) / len(hist_pdoa2)
-                                        
-                                        output("***(%d) NLos:%d   Dist:%d   Azimuth:%f (FOM:%d)   Elevation:%f (FOM:%d)  PDoA1:%f   PDoA2:%f" \
-                                              % (seq_cnt, meas_nlos, meas_distance, meas_azimuth, meas_azimuth_fom, meas_elevation, meas_elevation_fom, meas_pdoa1, meas_pdoa2))
-                                        output("*** Avg Dist:%d   Avg Azimuth:%f   Avg Elevation:%f   Avg_PDoA1:%f   Avg_PDoA2:%f" \
-                                              % (avg_distance, avg_azimuth, avg_elevation, avg_pdoa1, avg_pdoa2))
-                                        
-                                        # Store range data for plot
-                                        range_plot["index"] = seq_cnt
-                                        range_plot["valid"] = True
-                                        range_plot["nlos"] = meas_nlos
-                                        range_plot["distance"] = meas_distance
-                                        range_plot["azimuth"] = meas_azimuth
-                                        range_plot["elevation"] = meas_elevation
-                                        range_plot["avg_azimuth"] = avg_azimuth
-                                        range_plot["avg_elevation"] = avg_elevation
-                                        
-                                        if ((not is_ipc) or (is_stored)):
-                                            # Increment the number of valid measurements
-                                            meas_idx += 1
-                                    """
-                                    if (nb_meas > 0 and meas_idx > nb_meas):
-                                        if (is_ipc):
-                                            file_ipc.close()
-                                            
-                                            # indicate to server the end of measurement set
-                                            if(socket is not None):
-                                                try:
-                                                    socket.send_string("ok")
-                                                except:
-                                                    print("Fail to send OK on socket")
-                                            
-                                            # Restart new set of measures
-                                            meas_idx = 1
-                                        else:
-                                            go_stop.set()
-                                        
-                                    seq_cnt = ""
-                                    range_data = []
-                            else:
-                                output("\nExpected Payload bytes is " + str(count) + \
-                                      ", Actual Paylod bytes received is " + str(len(uci_payload)))
-                        else:
-                            output("Port is not opened")
-                    else:
-                        output("\nUCI Payload Size is Zero")
-                else:
-                    output("\nUCI Header is not valid")
-                
-                write_wait.release()
+                uci_hdr, uci_payload = frame_reader.read_frame()  # Read next UCI frame
+                if (len(uci_hdr) > 0):
+                    acquire_frame(uci_hdr, uci_payload, frame_reader.time_ns)
             else:
                 output("Port is not opened (2)")
         else:
@@ -1243,9 +1302,109 @@ def read_from_serial_port():
     
     if serial_port.isOpen(): serial_port.close()
     
+    frame_queue.push(None, force=True)  # End of the processing thread
+    output("Serial read statistics: " + frame_reader.stats.report())
     output("Read from serial port exited")
 
 
+# Acquisition in a child process: only move the frames from the shared memory to the frame queue
+# Start the child process owning the serial port, return False if it cannot open it
+def start_acquisition_process():
+    global serial_port
+    global acquisition
+    
+    acquisition = AcquisitionProcess(com_port, serial_port.baudrate)
+    if (not acquisition.start()):
+        acquisition.stop()
+        acquisition.close()
+        acquisition = None
+        return False
+    
+    # Commands written by the child process
+    serial_port = AcquisitionPort(acquisition)
+    return True
+
+
+def read_from_acquisition_process():
+    global stop_read_thread
+    global serial_port
+    global frame_queue
+    global acquisition
+    global write_wait
+    
+    output("Read from acquisition process started")
+    while (not stop_read_thread):
+        frame = acquisition.ring.pop()
+        if (frame is not None):
+            acquire_frame(frame[0], frame[1], frame[2])
+    
+    write_wait.acquire()  # No command written once the child process stops
+    serial_port.close()
+    write_wait.release()
+    acquisition.stop()
+    
+    frame_queue.push(None, force=True)  # End of the processing thread
+    output("Acquisition process statistics: " + acquisition.report())
+    acquisition.close()
+    output("Read from acquisition process exited")
+
+
+def process_frames():
+    global frame_queue
+    global dispatcher
+    global clock
+    global range_stats
+    
+    output("Processing of the frames started")
+    frame = frame_queue.pop()
+    while (frame is not None):
+        process_frame(frame[0], frame[1], frame[2])
+        if (len(frame[0]) == 4):
+            frame_queue.stats.add_latency(clock.now() - frame[2])
+        frame = frame_queue.pop()
+    
+    output("Frame queue statistics: " + frame_queue.report())
+    output("Dispatch statistics: " + dispatcher.stats.report())
+    output("Output log statistics: " + output_log.stats.report())
+    for line in pipeline.report():
+        output("Sink statistics: " + line)
+    for line in range_stats.report():
+        output("Range statistics: " + line)
+    output("Range decoder: " + range_decoder.report())
+    if (raw_log is not None):
+        output("Raw frame log: " + raw_log.report())
+    output("Processing of the frames exited")
+
+
+def replay_log():
+    global stop_read_thread
+    global log_replay
+    global dispatcher
+    global session_status
+    global go_stop
+    global range_stats
+    
+    output("Replay of the log started")
+    
+    # Until the end of the log, the end of processing or the number of measurements
+    log_replay.run(process_frame, lambda: (stop_read_thread) or (go_stop.is_set()))
+    
+    output("Replay statistics: " + log_replay.stats.report())
+    output("Dispatch statistics: " + dispatcher.stats.report())
+    output("Output log statistics: " + output_log.stats.report())
+    for line in pipeline.report():
+        output("Sink statistics: " + line)
+    for line in range_stats.report():
+        output("Range statistics: " + line)
+    output("Range decoder: " + range_decoder.report())
+    if (raw_log is not None):
+        output("Raw frame log: " + raw_log.report())
+    output("Replay of the log exited")
+    
+    # End of processing
+    session_status.set_all()
+
+
 def ipc_file_name():
     global stop_ipc_thread
     global file_ipc
@@ -1274,6 +1433,7 @@ def ipc_file_name():
             else:
                 # Close current output file if still open
                 if ((file_ipc is not None) and (not file_ipc.closed)):
+                    output_log.flush()
                     file_ipc.close()
                 
                 print("New file name: " + prefix_ipc + new_file_name)
@@ -1281,6 +1441,7 @@ def ipc_file_name():
             
     # Close output file if still open
     if ((file_ipc is not None) and (not file_ipc.closed)):
+        output_log.flush()
         file_ipc.close()
     
     try:
@@ -1293,6 +1454,8 @@ def ipc_file_name():
 
 def serial_port_configure():
     global serial_port
+    global is_acq_process
+    global is_async
     
     serial_port.baudrate = 3000000
     serial_port.timeout = 1  # To avoid endless blocking read
@@ -1300,6 +1463,16 @@ def serial_port_configure():
     
     if serial_port.isOpen(): serial_port.close()
     
+    if ((is_acq_process) and (not is_async)):
+        # Opened by the acquisition process
+        return
+    
+    serial_port_open()
+
+
+def serial_port_open():
+    global serial_port
+    
     try:
         serial_port.open()
     except:
@@ -1307,6 +1480,68 @@ def serial_port_configure():
         sys.exit(1)
 
 
+async def process_async():
+    global serial_port
+    global session_status
+    global command_queue
+    global dispatcher
+    global go_stop
+    global range_stats
+    
+    loop = asyncio.get_running_loop()
+    
+    # Stop of ranging is requested by the handlers running in the event loop
+    go_stop = asyncio.Event()
+    
+    interrupted = asyncio.Event()
+    loop.add_signal_handler(signal.SIGINT, interrupted.set)
+    
+    device = AsyncUciDevice(serial_port, dispatcher, on_receive=log_received_frame, on_send=log_sent_command)
+    device.open()
+    output("Asyncio engine started")
+    
+    commands = []
+    while (not command_queue.empty()):
+        commands.append(command_queue.get())
+    
+    # Layout of the RANGE_DATA_NTF from the configuration sent
+    for uci_command in commands:
+        range_decoder.configure(uci_command)
+    
+    run_task = asyncio.create_task(device.run_commands(commands, go_stop))
+    
+    # End on session deinit, Ctrl+C or STOP received by IPC
+    end_tasks = [asyncio.create_task(device.session_status.allow_end.wait()),
+                 asyncio.create_task(interrupted.wait()),
+                 loop.run_in_executor(None, session_status.allow_end.wait)]
+    await asyncio.wait(end_tasks, return_when=asyncio.FIRST_COMPLETED)
+    
+    if (interrupted.is_set()):
+        print("You pressed Ctrl+C!")
+    
+    # Release the executor waiting on the session states
+    session_status.set_all()
+    
+    run_task.cancel()
+    for task in end_tasks:
+        task.cancel()
+    
+    loop.remove_signal_handler(signal.SIGINT)
+    device.close()
+    
+    output("Serial read statistics: " + device.reader.stats.report())
+    output("Dispatch statistics: " + dispatcher.stats.report())
+    output("Output log statistics: " + output_log.stats.report())
+    for line in pipeline.report():
+        output("Sink statistics: " + line)
+    for line in range_stats.report():
+        output("Range statistics: " + line)
+    output("Range decoder: " + range_decoder.report())
+    if (raw_log is not None):
+        output("Raw frame log: " + raw_log.report())
+    output("Asyncio engine exited")
+
+
 def start_processing():
     global stop_ipc_thread
     global stop_read_thread
@@ -1320,6 +1555,8 @@ def start_processing():
     global cir_plot
     global command_queue
     global go_stop
+    global transactions
+    global frame_queue
     
     # Initialize plots
     if (is_range_plot):
@@ -1330,45 +1567,76 @@ def start_processing():
         read_thread = Thread(target=ipc_file_name, args = ())
         read_thread.start()
     
-    stop_read_thread = False
-    read_thread = Thread(target=read_from_serial_port, args=())
-    read_thread.start()
-    
-    stop_write_thread = False
-    write_thread = Thread(target=write_to_serial_port, args=())
-    write_thread.start()
+    register_handlers()
+    register_sinks()
     
-    handler = SIGINThandler()
-    signal.signal(signal.SIGINT, handler.signal_handler)
-    
-    while (session_status.allow_end.is_set() == False):
-        if handler.sigint:
-            break
+    if (is_async):
+        # Read, write and session handling on a single event loop
+        asyncio.run(process_async())
+    else:
+        if (log_replay is not None):
+            # Frames of the log processed as read from the serial port
+            stop_read_thread = False
+            read_thread = Thread(target=replay_log, args=())
+            read_thread.start()
+        else:
+            transactions = UciTransactions(transmit_command)
+            frame_queue = FrameQueue(frame_queue_size)
+            
+            if (is_acq_process):
+                if (start_acquisition_process()):
+                    output("Acquisition process started: " + com_port + " read and written by the child process")
+                else:
+                    output("#=> Acquisition process failed to open " + com_port + ", read from the serial port instead")
+                    serial_port_open()
+            
+            stop_read_thread = False
+            if (acquisition is not None):
+                read_thread = Thread(target=read_from_acquisition_process, args=())
+            else:
+                read_thread = Thread(target=read_from_serial_port, args=())
+            read_thread.start()
+            
+            process_thread = Thread(target=process_frames, args=())
+            process_thread.start()
+            
+            stop_write_thread = False
+            write_thread = Thread(target=write_to_serial_port, args=())
+            write_thread.start()
         
-        if ((is_range_plot) and (plt.get_fignums())):  # Check if figure is still open
-            if (range_plot["index"] >= 0):
-                # Plot new range data
-                draw_distance(plot_dist, range_plot)
-                draw_aoa(plot_azimuth, range_plot["azimuth"], range_plot["avg_azimuth"])
-                draw_aoa(plot_elevation, range_plot["elevation"], range_plot["avg_elevation"])
-                
-                # Disable range data
-                range_plot["index"] = -1
+        handler = SIGINThandler()
+        signal.signal(signal.SIGINT, handler.signal_handler)
+        
+        while (session_status.allow_end.is_set() == False):
+            if handler.sigint:
+                break
             
-            if ((is_cir_plot) and (cir_plot["nb_meas"] > 0)):
-                # Plot new rframe data
-                draw_cir(plot_cir, cir_plot)
+            if ((is_range_plot) and (plt.get_fignums())):  # Check if figure is still open
+                if (range_plot["index"] >= 0):
+                    # Plot new range data
+                    draw_distance(plot_dist, range_plot)
+                    draw_aoa(plot_azimuth, range_plot["azimuth"], range_plot["avg_azimuth"])
+                    draw_aoa(plot_elevation, range_plot["elevation"], range_plot["avg_elevation"])
+                    
+                    # Disable range data
+                    range_plot["index"] = -1
                 
-                # Disable rframe data
-                cir_plot["nb_meas"] = 0
-            
-            # Update figure
-            plt.draw()
-            plt.pause(0.001)
+                if ((is_cir_plot) and (cir_plot["nb_meas"] > 0)):
+                    # Plot new rframe data
+                    draw_cir(plot_cir, cir_plot)
+                    
+                    # Disable rframe data
+                    cir_plot["nb_meas"] = 0
+                
+                # Update figure
+                plt.draw()
+                plt.pause(0.001)
     
     # To restore output on STDOUT
     is_ipc = False
     
+    # Events queued to the sinks handled before closing the files
+    pipeline.close()
     if(data_log):
         file_data_log.close()
         
@@ -1379,6 +1647,7 @@ def start_processing():
     
     # Unblock the waiting in the write thread
     command_queue.put([0xFF, 0xFF])  # End of write
+    if (transactions is not None): transactions.cancel()
     session_status.set_all()
     go_stop.set()
     
@@ -1388,6 +1657,40 @@ def start_processing():
         range_plot["index"] = -1
 
 
+# Add configuration commands to the queue, merged if allowed
+def put_commands(uci_commands):
+    global command_queue
+    global is_coalesce
+    
+    if (is_coalesce):
+        coalesced = coalesce_commands(uci_commands)
+        if (len(coalesced) < len(uci_commands)):
+            output("%d configuration commands merged into %d" % (len(uci_commands), len(coalesced)))
+        uci_commands = coalesced
+    
+    for uci_command in uci_commands:
+        command_queue.put(uci_command)
+
+
+# Import the modules needed by the enabled modes
+def load_modules():
+    global np
+    global plt
+    global zmq
+    global uci_cir
+    global is_range_plot
+    global is_cir_plot
+    global is_ipc
+    
+    if ((is_range_plot) or (is_cir_plot)):
+        np = startup.load("numpy")
+        plt = startup.load("matplotlib.pyplot")
+        uci_cir = startup.load("uci_cir")
+    
+    if (is_ipc):
+        zmq = startup.load("zmq")
+
+
 def main():
     global nb_meas
     global rhodes_role
@@ -1404,8 +1707,31 @@ def main():
     global channel_ID
     global readOTP
     global power_offset
+    global is_bulk_read
+    global is_async
+    global is_cache
+    global is_coalesce
+    global is_resume
+    global config_cache
+    global session_resume
+    global log_replay
+    global raw_log
+    global frame_queue_size
+    global is_acq_process
+    global avg_window_size
+    global is_avg_output
+    global range_stats
+    
+    startup.mark("main")
+    
+    # Images of the commands stored for the next start (not when imported)
+    images.save()
     
     path = ""
+    replay_file = None
+    replay_speed = 1.0
+    raw_log_file = None
+    capture_file = None
     
     for arg in sys.argv[1:]:
         if (arg.isdecimal()):
@@ -1428,9 +1754,36 @@ def main():
             is_ipc = True
         elif (arg.startswith("OFFSET=")):
             power_offset = int(re.sub(r"\D", "", arg))
+        elif (arg == "legacyread"):
+            is_bulk_read = False
+        elif (arg == "async"):
+            is_async = True
+        elif (arg == "cache"):
+            is_cache = True
+        elif (arg == "nocoalesce"):
+            is_coalesce = False
+        elif (arg == "resume"):
+            is_resume = True
+        elif (arg.startswith("REPLAY=")):
+            replay_file = os.path.abspath(arg[len("REPLAY="):])
+        elif (arg.startswith("SPEED=")):
+            replay_speed = float(arg[len("SPEED="):])
+        elif (arg.startswith("RAWLOG=")):
+            raw_log_file = os.path.abspath(arg[len("RAWLOG="):])
+        elif (arg.startswith("CAPTURE=")):
+            capture_file = os.path.abspath(arg[len("CAPTURE="):])
+        elif (arg.startswith("QUEUE=")):
+            frame_queue_size = int(arg[len("QUEUE="):])
+        elif (arg == "acqproc"):
+            is_acq_process = True
+        elif (arg.startswith("AVG=")):
+            avg_window_size = int(arg[len("AVG="):])
+            is_avg_output = True
         else:
             path = arg
     
+    range_stats = RollingStats(RANGE_STATS_FIELDS, avg_window_size)
+    
     is_range_plot = False
     is_cir_plot = False
     
@@ -1511,12 +1864,47 @@ def main():
         file_data_log.write("ts,num,addr0,meas_nlos0,meas_distance0,meas_azimuth0,meas_azimuth_fom0,meas_elevation0,meas_elevation_fom0,addr1,meas_nlos1,meas_distance1,meas_azimuth1,meas_azimuth_fom1,meas_elevation1,meas_elevation_fom1,addr2,meas_nlos2,meas_distance2,meas_azimuth2,meas_azimuth_fom2,meas_elevation2,meas_elevation_fom2,addr3,meas_nlos3,meas_distance3,meas_azimuth3,meas_azimuth_fom3,meas_elevation3,meas_elevation_fom3,addr4,meas_nlos4,meas_distance4,meas_azimuth4,meas_azimuth_fom4,meas_elevation4,meas_elevation_fom4,addr5,meas_nlos5,meas_distance5,meas_azimuth5,meas_azimuth_fom5,meas_elevation5,meas_elevation_fom5,addr6,meas_nlos6,meas_distance6,meas_azimuth6,meas_azimuth_fom6,meas_elevation6,meas_elevation_fom6,addr7,meas_nlos7,meas_distance7,meas_azimuth7,meas_azimuth_fom7,meas_elevation7,meas_elevation_fom7\n")
     
     
+    load_modules()
+    startup.mark("plotting and IPC modules imported")
+    
     output("Role:" + rhodes_role + "   Port:" + com_port + "   Nb Meas:" + str(nb_meas) + "   Timestamp:" + str(is_timestamp) + \
-          "   Range Plot:" + str(is_range_plot) + "   CIR Plot:" + str(is_cir_plot) + "   IPC:" + str(is_ipc))
+          "   Range Plot:" + str(is_range_plot) + "   CIR Plot:" + str(is_cir_plot) + "   IPC:" + str(is_ipc) + \
+          "   Bulk Read:" + str(is_bulk_read) + "   Async:" + str(is_async) + "   Cache:" + str(is_cache) + \
+          "   Coalesce:" + str(is_coalesce) + "   Resume:" + str(is_resume) + "   Acq Process:" + str(is_acq_process))
+    
+    if (raw_log_file is not None):
+        raw_log = RawFrameLog(raw_log_file, clock)
+        output("Raw frame log: " + raw_log_file)
+    elif (capture_file is not None):
+        # Same interface as the raw log
+        raw_log = FrameCapture(capture_file, clock)
+        output("Capture: " + capture_file)
+    
+    if (replay_file is not None):
+        # No device: frames of the log processed with the threads engine
+        is_async = False
+        log_replay = LogReplay(replay_file, replay_speed, range_decoder.configure)
+        output("Replay of " + replay_file + "   Speed:" + str(replay_speed))
+        
+        output("Start processing...")
+        start_processing()
+        output("Processing finished")
+        return
     
     output("Configure serial port...")
     serial_port_configure()
     output("Serial port configured")
+    startup.mark("serial port configured")
+    
+    if ((is_cache) and (not is_async)):
+        config_cache = UciConfigCache(CONFIG_CACHE_FILE, execute_command, replay_notification, UWB_CORE_SET_CONFIG)
+        config_cache.add_otp_read(UWB_EXT_READ_CALIB_DATA_XTAL_CAP, UWB_EXT_READ_CALIB_DATA_XTAL_CAP_NTF)
+        config_cache.add_otp_read(UWB_EXT_READ_CALIB_DATA_TX_POWER, UWB_EXT_READ_CALIB_DATA_TX_POWER_NTF)
+    
+    if ((is_resume) and (not is_async)):
+        session_resume = UciSessionResume(execute_command, session_status.set, UWB_RANGE_STOP)
+    
+    output("Command images: " + images.report())
     
     # Add the UCI Commands to sent
     output("Start adding commands to the queue...")
@@ -1531,10 +1919,10 @@ def main():
         command_queue.put(UWB_EXT_READ_CALIB_DATA_XTAL_CAP)
         command_queue.put(UWB_EXT_READ_CALIB_DATA_TX_POWER)
     
-    command_queue.put(UWB_CORE_SET_CONFIG)
-    command_queue.put(UWB_CORE_SET_ANTENNA_RX_IDX_DEFINE)
-    command_queue.put(UWB_CORE_SET_ANTENNA_TX_IDX_DEFINE)
-    command_queue.put(UWB_CORE_SET_ANTENNAS_RX_PAIR_DEFINE)
+    put_commands([UWB_CORE_SET_CONFIG,
+                  UWB_CORE_SET_ANTENNA_RX_IDX_DEFINE,
+                  UWB_CORE_SET_ANTENNA_TX_IDX_DEFINE,
+                  UWB_CORE_SET_ANTENNAS_RX_PAIR_DEFINE])
     
     command_queue.put(UWB_SET_CFO_CALIBRATION)
     command_queue.put(UWB_SET_POWER_CALIBRATION)
@@ -1557,17 +1945,18 @@ def main():
         #command_queue.put(UWB_SET_CALIBRATION_PDOA_MULTIPOINT_CALIB_CH9)
         
     command_queue.put(UWB_SESSION_INIT_RANGING)
-    command_queue.put(UWB_SESSION_SET_APP_CONFIG)
-    command_queue.put(UWB_SESSION_SET_APP_CONFIG_NXP)
-    if (rhodes_role == "Initiator"): command_queue.put(UWB_SESSION_SET_INITIATOR_CONFIG)
-    if (rhodes_role == "Responder"): command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG)
-    #command_queue.put(UWB_SESSION_SET_DEBUG_CONFIG)
+    session_config = [UWB_SESSION_SET_APP_CONFIG, UWB_SESSION_SET_APP_CONFIG_NXP]
+    if (rhodes_role == "Initiator"): session_config.append(UWB_SESSION_SET_INITIATOR_CONFIG)
+    if (rhodes_role == "Responder"): session_config.append(UWB_SESSION_SET_RESPONDER_CONFIG)
+    #session_config.append(UWB_SESSION_SET_DEBUG_CONFIG)
+    put_commands(session_config)
     
     command_queue.put(UWB_RANGE_START)
     if (nb_meas > 0):
         command_queue.put(UWB_RANGE_STOP)
         command_queue.put(UWB_SESSION_DEINIT)
     output("adding commands to the queue completed")
+    startup.mark("commands queued")
     
     output("Start processing...")
     start_processing()
@@ -0,0 +1,259 @@
+# Decoding of the RANGE_DATA_NTF against the handlers of the scripts before uci_layout.py
+#
+# The Initiator walked the measurements with a 31-byte stride from offset 25, shifting
+# the fields by hand, the Responder read the single measurement of a unicast session at
+# absolute offsets and the PDoA at 66 and 70 when the payload was longer than 71 bytes,
+# both converted the angles and the PDoA with convert_qformat_to_float. These formulas
+# are copied here as they were and compared with RangeDecoder (uci_layout.py, configured
+# for the session or not), decode_range_data (uci_range.py, numpy) and Q9_7 for all the
+# raw values: statuses OK, negative distance (0x1B) and errors, with and without NXP
+# extended data, and without the PDoA index following the PDoA of the last measurement.
+#
+# Run: python -m unittest test_layout (from the multicast directory)
+
+import random
+import struct
+import unittest
+
+from uci_layout import RangeDecoder, MAC_EXTENDED
+from uci_qformat import Q9_7
+from uci_tlv import APP_CONFIG_PARAMS, CORE_CONFIG_PARAMS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SESSION_ID = 0x00000001
+SEED = 7
+ROUNDS = 50
+
+STATUSES = (0x00, 0x1B, 0x01, 0x21)
+
+
+def baseline_qformat_to_float(q_in, n_ints, n_fracs, round_of=2):
+    bits = n_ints + n_fracs
+
+    # Compute the 2's complement of integer q_in with the width of n_ints + n_fracs
+    if (q_in & (1 << (bits - 1))) != 0:  # If sign bit is set
+        q_in = q_in - (1 << bits)  # Compute negative value
+
+    # Divide by 2^n_fracs
+    frac = q_in / (1 << n_fracs)
+
+    # Return rounded value
+    return round(frac, round_of)
+
+
+# Measurements of a multicast notification as by the Initiator (None: ranging error)
+def baseline_initiator(range_data):
+    measurements = []
+    nb_range = range_data[24]
+    num = 0
+    while(num < nb_range):
+        data = range_data[(25+num*31):(55+num*31)]
+        # Check Status
+        if(data[2] != 0x00 and data[2] != 0x1b):
+            measurements.append(None)
+        else:
+            address = data[0] + (data[1] << 8)
+            meas_nlos = data[3]
+            meas_distance = (data[5] << 8) + data[4]
+            if (data[2] == 0x1b):   # negative distance
+                meas_distance = -1 * meas_distance
+            meas_azimuth = baseline_qformat_to_float((data[7] << 8) + data[6], 9, 7, 1)
+            meas_azimuth_fom = data[8]
+            meas_elevation = baseline_qformat_to_float((data[10] << 8) + data[9], 9, 7, 1)
+            meas_elevation_fom = data[11]
+            measurements.append((address, meas_nlos, meas_distance, meas_azimuth, meas_azimuth_fom, meas_elevation,
+                                 meas_elevation_fom))
+        num = num + 1
+    return measurements
+
+
+# Measurement of a unicast notification as by the Responder (None: ranging error), PDoA
+# 0 when not decoded
+def baseline_responder(uci_payload):
+    if (uci_payload[27] != 0x00 and uci_payload[27] != 0x1b):
+        return None
+    meas_nlos = int(uci_payload[28])
+    meas_distance = int((uci_payload[30] << 8) + uci_payload[29])
+    meas_azimuth = baseline_qformat_to_float(int((uci_payload[32] << 8) + uci_payload[31]), 9, 7, 1)
+    meas_azimuth_fom = int(uci_payload[33])
+    meas_elevation = baseline_qformat_to_float(int((uci_payload[35] << 8) + uci_payload[34]), 9, 7, 1)
+    meas_elevation_fom = int(uci_payload[36])
+    meas_pdoa1 = 0
+    meas_pdoa2 = 0
+    if (len(uci_payload) > 71):
+        meas_pdoa1 = baseline_qformat_to_float(int((uci_payload[67] << 8) + uci_payload[66]), 9, 7, 7)
+        meas_pdoa2 = baseline_qformat_to_float(int((uci_payload[71] << 8) + uci_payload[70]), 9, 7, 7)
+    if (uci_payload[27] == 0x1b):   # negative distance
+        meas_distance = -1 * meas_distance
+    return (meas_nlos, meas_distance, meas_azimuth, meas_azimuth_fom, meas_elevation, meas_elevation_fom, meas_pdoa1,
+            meas_pdoa2)
+
+
+# RANGE_DATA_NTF of random measurements (any raw value of the angles and PDoA), NXP
+# extended data if extended, without the last PDoA index if truncated
+def range_data_ntf(rng, seq_cnt, count, extended=False, truncated=False, mac_mode=0x00):
+    payload = struct.pack("<IIBIBBB8sB", seq_cnt, SESSION_ID, 0x00, 100, 0x01, 0x00, mac_mode, bytes(8), count)
+    for idx in range(0, count):
+        if (mac_mode == MAC_EXTENDED):
+            payload += struct.pack("<Q", rng.getrandbits(64))
+        else:
+            payload += struct.pack("<H", rng.getrandbits(16))
+        payload += struct.pack("<BBHHBHBHBHBB", rng.choice(STATUSES), rng.getrandbits(8), rng.getrandbits(16),
+                               rng.getrandbits(16), rng.getrandbits(8), rng.getrandbits(16), rng.getrandbits(8),
+                               rng.getrandbits(16), rng.getrandbits(8), rng.getrandbits(16), rng.getrandbits(8),
+                               idx)
+        payload += bytes(12 if (mac_mode != MAC_EXTENDED) else 6)
+    if (extended):
+        payload += struct.pack("<HBBBB", 12 * count + 4, 0x00, 0x00, 0x02, 0x00)
+        for idx in range(0, count):
+            payload += struct.pack("<HHHHHH", *[rng.getrandbits(16) for field in range(0, 6)])
+        if (truncated):
+            payload = payload[:-2]
+    return payload
+
+
+def app_config_cmd(count):
+    tlvs = b""
+    for name, value in (("MULTI_NODE_MODE", 0x01 if (count > 1) else 0x00), ("NUMBER_OF_CONTROLEES", count),
+                        ("MAC_ADDRESS_MODE", 0x00)):
+        tlvs += APP_CONFIG_PARAMS[name].id + bytes([0x01, value])
+    payload = struct.pack("<IB", SESSION_ID, 3) + tlvs
+    return bytes([0x21, 0x03, 0x00, len(payload)]) + payload
+
+
+def core_config_cmd(extended):
+    tlvs = CORE_CONFIG_PARAMS["NXP_EXTENDED_NTF_CONFIG"].id + bytes([0x01, 0x01 if (extended) else 0x00])
+    payload = bytes([1]) + tlvs
+    return bytes([0x20, 0x04, 0x00, len(payload)]) + payload
+
+
+def decoders(count, extended):
+    configured = RangeDecoder()
+    configured.configure(core_config_cmd(extended))
+    configured.configure(app_config_cmd(count))
+    return [configured, RangeDecoder()]
+
+
+class TestLayout(unittest.TestCase):
+    def test_q9_7(self):
+        for raw in range(0, 1 << 16):
+            self.assertEqual(Q9_7.to_float(raw, 1), baseline_qformat_to_float(raw, 9, 7, 1))
+            self.assertEqual(Q9_7.to_float(raw, 7), baseline_qformat_to_float(raw, 9, 7, 7))
+            signed = raw - (1 << 16) if (raw & 0x8000) else raw
+            self.assertEqual(Q9_7.to_float(signed, 1), baseline_qformat_to_float(raw, 9, 7, 1))
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_q9_7_array(self):
+        raws = numpy.arange(0, 1 << 16, dtype=numpy.uint16)
+        for round_of in (1, 7):
+            values = Q9_7.to_float_array(raws.view(numpy.int16), round_of)
+            self.assertEqual(values.tolist(), [baseline_qformat_to_float(raw, 9, 7, round_of) for raw in range(0, 1 << 16)])
+
+    def check_multicast(self, range_ntf, decoded):
+        self.assertEqual(decoded.nb_measurements, range_ntf[24])
+        for measurement, baseline in zip(decoded.measurements, baseline_initiator(range_ntf)):
+            self.assertEqual(measurement.valid, baseline is not None)
+            if (baseline is not None):
+                self.assertEqual((measurement.address, measurement.nlos, measurement.distance, measurement.azimuth,
+                                  measurement.azimuth_fom, measurement.elevation, measurement.elevation_fom), baseline)
+
+    def test_multicast(self):
+        rng = random.Random(SEED)
+        for extended in (False, True):
+            for count in (2, 8):
+                for decoder in decoders(count, extended):
+                    for seq_cnt in range(0, ROUNDS):
+                        range_ntf = range_data_ntf(rng, seq_cnt, count, extended)
+                        decoded = decoder.decode(range_ntf)
+                        self.check_multicast(range_ntf, decoded)
+                        self.assertEqual(len(decoded.measurements), count)
+                        self.assertEqual(decoded.measurements[0].pdoa1 is not None, extended)
+                self.assertEqual(decoders(count, extended)[0].layout(SESSION_ID).count, count)
+
+    def test_mismatch(self):
+        rng = random.Random(SEED)
+        decoder = decoders(8, True)[0]
+        for count in (0, 1, 3):
+            range_ntf = range_data_ntf(rng, 0, count, True)
+            decoded = decoder.decode(range_ntf)
+            self.assertEqual(len(decoded.measurements), count)
+            self.check_multicast(range_ntf, decoded)
+        self.assertEqual(decoder.mismatches, 3)
+
+        # Measurements not complete dropped
+        range_ntf = range_data_ntf(rng, 0, 3)[:-10]
+        self.assertEqual(len(decoder.decode(range_ntf).measurements), 2)
+
+    def test_extended_address(self):
+        rng = random.Random(SEED)
+        range_ntf = range_data_ntf(rng, 0, 2, True, mac_mode=MAC_EXTENDED)
+        decoded = RangeDecoder().decode(range_ntf)
+        for idx, measurement in enumerate(decoded.measurements):
+            start = 25 + idx * 31
+            self.assertEqual(measurement.address, int.from_bytes(range_ntf[start:start + 8], "little"))
+            self.assertEqual(measurement.slot, idx)
+            self.assertIsNotNone(measurement.pdoa2)
+
+    def test_unicast(self):
+        rng = random.Random(SEED)
+        for extended, truncated in ((False, False), (True, False), (True, True)):
+            for decoder in decoders(1, extended):
+                for seq_cnt in range(0, ROUNDS):
+                    range_ntf = range_data_ntf(rng, seq_cnt, 1, extended, truncated)
+                    self.assertEqual(len(range_ntf), 72 if (truncated) else 74 if (extended) else 56)
+                    measurement = decoder.decode(range_ntf).measurements[0]
+                    baseline = baseline_responder(range_ntf)
+                    self.assertEqual(measurement.valid, baseline is not None)
+                    if (baseline is None):
+                        continue
+                    pdoa1 = measurement.pdoa1 if (extended) else 0
+                    pdoa2 = measurement.pdoa2 if (extended) else 0
+                    self.assertEqual((measurement.nlos, measurement.distance, measurement.azimuth,
+                                      measurement.azimuth_fom, measurement.elevation, measurement.elevation_fom,
+                                      pdoa1, pdoa2), baseline)
+                    if (truncated):
+                        self.assertIsNone(measurement.pdoa2_index)
+                    elif (extended):
+                        self.assertEqual(measurement.pdoa2_index, int.from_bytes(range_ntf[72:74], "little"))
+                if (decoder.layout(SESSION_ID) is not None):
+                    self.assertEqual(decoder.mismatches, 0)
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_range_data(self):
+        from uci_range import decode_range_data, decode_range_data_batch
+
+        rng = random.Random(SEED)
+        range_ntfs = []
+        for extended, truncated in ((False, False), (True, False), (True, True)):
+            for count in (1, 8):
+                range_ntfs += [range_data_ntf(rng, seq_cnt, count, extended, truncated) for seq_cnt in range(0, 10)]
+        decoded = []
+        for range_ntf in range_ntfs:
+            columns = decode_range_data(range_ntf)
+            baseline = baseline_initiator(range_ntf)
+            self.assertEqual(columns["valid"].tolist(), [measurement is not None for measurement in baseline])
+            for idx, measurement in enumerate(baseline):
+                if (measurement is not None):
+                    self.assertEqual(tuple(columns[name][idx].item() for name in ("address", "nlos", "distance",
+                                                                                  "azimuth", "azimuth_fom",
+                                                                                  "elevation", "elevation_fom")),
+                                     measurement)
+            extended = (len(range_ntf) > 25 + range_ntf[24] * 31)
+            self.assertEqual(columns["extended"].tolist(), [extended] * range_ntf[24])
+            if (range_ntf[24] == 1):
+                responder = baseline_responder(range_ntf)
+                if ((responder is not None) and (extended)):
+                    self.assertEqual((columns["pdoa1"][0].item(), columns["pdoa2"][0].item()), responder[6:8])
+            decoded.append(columns)
+
+        batch = decode_range_data_batch(range_ntfs)
+        for name in ("address", "distance", "azimuth", "elevation", "valid", "extended", "pdoa2_index"):
+            self.assertEqual(batch[name].tolist(), [value for columns in decoded for value in columns[name].tolist()])
+
+
+if (__name__ == "__main__"):
+    unittest.main()
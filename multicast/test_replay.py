@@ -0,0 +1,98 @@
+# Replay of a log by the scripts (REPLAY argument)
+#
+# The log holds the frames of a ranging session, RANGE_DATA_NTF of two controlees and a
+# CORE_GENERIC_ERROR_NTF with the status "command retry" in the middle: no command is
+# sent in replay, the request must be ignored and the replay carried to the end of the
+# log. The SESSION_SET_APP_CONFIG sent before the session ("NXPUCIX => " line) gives the
+# layout of the notifications to the range data decoder, none must mismatch it. Each
+# script is run on the log as fast as possible (SPEED=0) without plot.
+#
+# Run: python -m unittest test_replay (from the multicast directory)
+
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from uci_replay import RECEIVED_FRAME, SENT_COMMAND
+from uci_tlv import APP_CONFIG_PARAMS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Maximum duration of a replay in seconds
+TIMEOUT = 60
+
+SESSION_ID = 0x00000001
+CONTROLEES = 2
+ROUNDS = 20
+
+# CORE_GENERIC_ERROR_NTF: command retry
+RETRY_NTF = bytes([0x60, 0x07, 0x00, 0x01, 0x0A])
+
+
+def frame(mt_gid, oid, payload):
+    return bytes([mt_gid, oid, 0x00, len(payload)]) + payload
+
+
+# Multicast RANGE_DATA_NTF, short MAC addresses
+def range_data_ntf(seq_cnt):
+    payload = struct.pack("<IIBIBBB8sB", seq_cnt, SESSION_ID, 0x00, 100, 0x01, 0x00, 0x00, bytes(8), CONTROLEES)
+    for idx in range(0, CONTROLEES):
+        payload += struct.pack("<HBBHhBhBhBhBB12s", 0x1000 + idx, 0x00, 0x00, 100 * (idx + 1) + seq_cnt % 3,
+                               10 << 7, 100, 5 << 7, 100, 0, 0, 0, 0, 0, bytes(12))
+    return frame(0x62, 0x00, payload)
+
+
+# SESSION_SET_APP_CONFIG: multicast session, short MAC addresses
+def app_config_cmd():
+    tlvs = b""
+    for name, value in (("MULTI_NODE_MODE", 0x01), ("NUMBER_OF_CONTROLEES", CONTROLEES), ("MAC_ADDRESS_MODE", 0x00)):
+        tlvs += APP_CONFIG_PARAMS[name].id + bytes([0x01, value])
+    return frame(0x21, 0x03, struct.pack("<IB", SESSION_ID, 3) + tlvs)
+
+
+def log_line(frame, prefix=RECEIVED_FRAME):
+    return prefix + " ".join("%02x" % byte for byte in frame) + " \n"
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.directory.name, "replay.txt")
+        frames = [frame(0x60, 0x01, bytes([0x01]))]
+        for seq_cnt in range(0, ROUNDS):
+            frames.append(range_data_ntf(seq_cnt))
+            if (seq_cnt == ROUNDS // 2):
+                frames.append(RETRY_NTF)
+        with open(self.log_file, "w") as log_file:
+            log_file.write(log_line(app_config_cmd(), SENT_COMMAND))
+            log_file.writelines(log_line(uci_frame) for uci_frame in frames)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def replay(self, script_args):
+        command = [sys.executable, "-u"] + script_args + ["REPLAY=" + self.log_file, "SPEED=0", "noplot"]
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                 cwd=self.directory.name, timeout=TIMEOUT)
+        self.assertNotIn("Traceback", process.stdout)
+        self.assertEqual(process.returncode, 0, process.stdout)
+        self.assertIn("Frames:%d" % (ROUNDS + 2), process.stdout)
+        self.assertIn("Commands:1", process.stdout)
+        self.assertIn("Sessions:1   Mismatches:0", process.stdout)
+        self.assertIn("Replay of the log exited", process.stdout)
+        self.assertIn("Processing finished", process.stdout)
+        return process.stdout
+
+    def test_initiator(self):
+        output = self.replay([os.path.join(HERE, "Initiator.py")])
+        self.assertIn("Range statistics: 1000   Measurements:%d" % ROUNDS, output)
+
+    def test_responder(self):
+        self.replay([os.path.join(HERE, "Responder.py"), "r"])
+
+
+if (__name__ == "__main__"):
+    unittest.main()
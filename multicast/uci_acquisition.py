@@ -0,0 +1,117 @@
+# Acquisition of the frames, decoupled from their processing
+#
+# The read thread used to log, decode and dispatch each frame (console, CSV, CIR files,
+# plots) with the lock of the output held before reading the next one: slow terminal
+# or disk I/O delayed the reads and the writer until the kernel buffer of the UART
+# overran. The acquisition thread now only frames the bytes, copies and timestamps each
+# frame, resolves the command waiting for an RSP (only under the lock of the
+# transactions) and pushes the frame to a bounded FrameQueue. The processing thread
+# pops the frames to log, decode and dispatch them.
+# The queue is a deque: pushing a frame takes no lock (append and popleft are atomic),
+# the processing thread waits on an event only when the queue is empty. When the queue
+# is full, the new notifications are dropped and counted instead of blocking the reads
+# (RSP, core and session management notifications and the end marker are always queued:
+# the commands wait for the session states, only range and debug data can be lost).
+# Whole notifications are dropped: the decision is taken at the first frame of a
+# segmented notification and kept until its last frame, so that the reassembly is
+# never fed a partial notification.
+
+from collections import deque
+from threading import Event
+
+# Frames queued by default (4 s of notifications at 1 kHz)
+FRAME_QUEUE_SIZE = 4096
+
+# Notifications never dropped (GID): core (generic errors, device status) and session
+# management (session status)
+KEPT_NTF_GIDS = (0x00, 0x01)
+
+
+class FrameQueueStats():
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.pushed = 0
+        self.dropped = 0
+        self.high_water = 0
+        self.latency_max = 0  # Longest time in ns between the read and the processing
+        self.latency_sum = 0
+        self.processed = 0
+
+    def add_latency(self, latency):
+        self.processed += 1
+        self.latency_sum += latency
+        if (latency > self.latency_max):
+            self.latency_max = latency
+
+    def report(self, depth):
+        return "Depth:%d   High-water:%d/%d   Pushed:%d   Dropped:%d   Latency avg:%.3f ms   max:%.3f ms" \
+               % (depth, self.high_water, self.capacity, self.pushed, self.dropped,
+                  self.latency_sum / max(self.processed, 1) / 1e6, self.latency_max / 1e6)
+
+
+class FrameQueue():
+    def __init__(self, capacity=FRAME_QUEUE_SIZE):
+        self.capacity = capacity
+        self.items = deque()
+        self.ready = Event()
+        self.waiting = False
+        self.segmented = False  # Next frame continues a segmented notification
+        self.dropping = False   # Frames of the current notification dropped
+        self.stats = FrameQueueStats(capacity)
+
+    # Return False if the item is dropped as the queue is full (never if forced)
+    def push(self, item, force=False):
+        depth = len(self.items)
+        if ((depth >= self.capacity) and (not force)):
+            self.stats.dropped += 1
+            return False
+
+        self.items.append(item)
+        self.stats.pushed += 1
+        if (depth + 1 > self.stats.high_water):
+            self.stats.high_water = depth + 1
+        if (self.waiting):
+            self.ready.set()
+        return True
+
+    # Push a frame whose header is uci_hdr, return False if it is dropped
+    def push_frame(self, uci_hdr, item):
+        if (len(uci_hdr) < 4):
+            return self.push(item)
+
+        is_first = (not self.segmented)
+        self.segmented = ((uci_hdr[0] & 0x10) != 0)
+        if ((uci_hdr[0] & 0xE0) != 0x60):
+            # CMD/RSP (the RSP resolves the command waiting for it) and data are kept
+            return self.push(item, force=True)
+        if ((uci_hdr[0] & 0x0F) in KEPT_NTF_GIDS):
+            # Session states waited for by the commands
+            return self.push(item, force=True)
+
+        if (is_first):
+            self.dropping = (len(self.items) >= self.capacity)
+        if (self.dropping):
+            self.stats.dropped += 1
+            return False
+        return self.push(item, force=(not is_first))
+
+    # Wait for the next item
+    def pop(self):
+        while True:
+            try:
+                return self.items.popleft()
+            except IndexError:
+                pass
+
+            self.ready.clear()
+            self.waiting = True
+            if (len(self.items) == 0):
+                # push() sets the event once waiting is set, the timeout is only a guard
+                self.ready.wait(0.1)
+            self.waiting = False
+
+    def depth(self):
+        return len(self.items)
+
+    def report(self):
+        return self.stats.report(len(self.items))
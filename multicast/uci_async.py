@@ -0,0 +1,175 @@
+# UCI transport and session engine running on a single asyncio event loop
+#
+# Alternative to the read and write threads: the tty is read without blocking when
+# the event loop reports it readable (loop.add_reader), commands are awaitables
+# resolved by their RSP and session states are asyncio events. Several devices can
+# share the same loop. Requires an event loop able to watch a tty (POSIX).
+
+import asyncio
+
+from uci_reader import UciFrameReader
+from uci_dispatch import UciDispatcher
+from uci_coalesce import CoalescedCommand
+from uci_tlv import wire_frame
+
+
+class AsyncSessionStates():
+    def __init__(self):
+        self.allow_config = asyncio.Event()
+        self.allow_start = asyncio.Event()
+        self.allow_stop = asyncio.Event()
+        self.allow_end = asyncio.Event()
+
+    def set(self, status):
+        if (status == 0x00):
+            # SESSION_STATE_INIT
+            self.allow_config.set()
+            self.allow_start.clear()
+            self.allow_stop.clear()
+            self.allow_end.clear()
+
+        if (status == 0x01):
+            # SESSION_STATE_DEINIT
+            self.allow_config.clear()
+            self.allow_start.clear()
+            self.allow_stop.clear()
+            self.allow_end.set()
+
+        if (status == 0x02):
+            # SESSION_STATE_ACTIVE
+            self.allow_config.set()
+            self.allow_start.set()
+            self.allow_stop.set()
+            self.allow_end.clear()
+
+        if (status == 0x03):
+            # SESSION_STATE_IDLE
+            self.allow_config.set()
+            self.allow_start.set()
+            self.allow_stop.clear()
+            self.allow_end.clear()
+
+        if (status == 0xFF):
+            # SESSION_ERROR
+            self.allow_config.clear()
+            self.allow_start.clear()
+            self.allow_stop.clear()
+            self.allow_end.clear()
+
+    def set_all(self):
+        self.allow_config.set()
+        self.allow_start.set()
+        self.allow_stop.set()
+        self.allow_end.set()
+
+
+class AsyncUciDevice():
+    # port: serial.Serial already configured and opened
+    # on_receive(uci_hdr, uci_payload, time_ns) and on_send(uci_command) are called for logging
+    def __init__(self, port, dispatcher=None, on_receive=None, on_send=None, rsp_timeout=0.25, retries=3):
+        self.port = port
+        self.dispatcher = dispatcher if (dispatcher is not None) else UciDispatcher()
+        self.on_receive = on_receive
+        self.on_send = on_send
+        self.rsp_timeout = rsp_timeout
+        self.retries = retries
+        self.reader = UciFrameReader(port)
+        self.session_status = AsyncSessionStates()
+        self.pending = None  # Future of the command waiting for its RSP
+        self.lock = None     # Only one command in flight per device
+        self.loop = None
+
+    def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.lock = asyncio.Lock()
+
+        # Never block the loop in read
+        self.port.timeout = 0
+        self.loop.add_reader(self.port.fileno(), self.on_readable)
+
+    def close(self):
+        if (self.loop is not None):
+            self.loop.remove_reader(self.port.fileno())
+            self.loop = None
+
+        if (self.pending is not None and not self.pending.done()):
+            self.pending.cancel()
+
+        if self.port.isOpen(): self.port.close()
+
+    def on_readable(self):
+        if (self.reader.fill() == 0):
+            return
+
+        frame = self.reader.extract_frame()
+        while (frame is not None):
+            self.on_frame(frame[0], frame[1])
+            frame = self.reader.extract_frame()
+
+    def on_frame(self, uci_hdr, uci_payload):
+        if (self.on_receive is not None):
+            self.on_receive(uci_hdr, uci_payload, self.reader.time_ns)
+
+        if ((uci_hdr[0] & 0xF0) == 0x40):
+            # RSP of the pending command
+            if (self.pending is not None and not self.pending.done()):
+                self.pending.set_result((uci_hdr, bytes(uci_payload)))
+
+        if (uci_hdr[0] == 0x60 and uci_hdr[1] == 0x07 and uci_hdr[3] == 0x01 and uci_payload[0] == 0x0A):
+            # Command retry without wait response
+            if (self.pending is not None and not self.pending.done()):
+                self.pending.set_result(None)
+
+        if (uci_hdr[0] == 0x61 and uci_hdr[1] == 0x02 and uci_hdr[3] == 0x06):
+            # Change Session state
+            self.session_status.set(uci_payload[4])
+
+        self.dispatcher.dispatch(uci_hdr, uci_payload)
+
+    # Send a UCI command and return header and payload of its RSP (None if no RSP)
+    async def send_command(self, uci_command):
+        usb_out_packet = wire_frame(uci_command)
+
+        async with self.lock:
+            for attempt in range(0, self.retries + 1):
+                self.pending = self.loop.create_future()
+
+                if (self.on_send is not None):
+                    self.on_send(uci_command)
+                self.port.write(usb_out_packet)
+
+                try:
+                    rsp = await asyncio.wait_for(self.pending, self.rsp_timeout)
+                except asyncio.TimeoutError:
+                    # Repeat command if timeout
+                    continue
+                finally:
+                    self.pending = None
+
+                if (rsp is not None):
+                    return rsp
+
+        return None
+
+    # Send the commands in order, waiting for the session states as write_to_serial_port does
+    # stop: asyncio.Event allowing to stop ranging
+    async def run_commands(self, commands, stop=None):
+        for uci_command in commands:
+            if (uci_command[0] == 0x21 and uci_command[1] == 0x03):
+                # Wait Session State Initialized to send APP Configs
+                await self.session_status.allow_config.wait()
+            if (uci_command[0] == 0x22 and uci_command[1] == 0x00):
+                # Wait Session State Idle to start ranging
+                await self.session_status.allow_start.wait()
+            if (uci_command[0] == 0x22 and uci_command[1] == 0x01):
+                # Wait Session State Activated
+                await self.session_status.allow_stop.wait()
+                # Wait reach limit of measurements to stop ranging
+                if (stop is not None):
+                    await stop.wait()
+
+            rsp = await self.send_command(uci_command)
+            if (isinstance(uci_command, CoalescedCommand) and (rsp is not None) and (rsp[1][0] != 0x00)):
+                # Merged command rejected: send the commands as defined
+                for part in uci_command.parts:
+                    await self.send_command(part)
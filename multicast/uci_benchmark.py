@@ -0,0 +1,404 @@
+# Micro-benchmarks of the per-frame decode path
+#
+# Each step run by the read thread for a received notification is timed on synthetic
+# notifications built by the virtual device (uci_simulator.py), for 1 to 8 controlees,
+# in a single frame or segmented in frames of SEGMENT bytes:
+#   - header parsing (UciFrameReader.fill and extract_frame)
+#   - PBF reassembly (SegmentBuffer)
+#   - dispatch to the multicast RANGE_DATA_NTF handler of Initiator.py (layout of the
+#     session compiled by uci_layout.py for the number of controlees)
+#   - DBG_RFRAME_LOG_NTF handler and its plot sink (27 + 64-byte stride, CIR samples decoded)
+#   - NXPUCIR hex log, queued by the read thread (log_received_frame) and formatted with
+#     its time by the log thread (format_frame), console output excluded
+#   - all of them as chained by the read thread
+#   - convert_qformat_to_float and twos_comp (per call)
+#   - decode_cir and decode_rframe_cir_batch (uci_cir.py, a batch of 64 notifications
+#     of 8 measurements) against the per-sample extract_cir they replaced
+#   - RangeDecoder.decode (uci_layout.py, 8 controlees, layout of the session or of the
+#     notification)
+#   - decode_range_data and decode_range_data_batch (uci_range.py, 8 controlees, a batch
+#     of 1000 rounds)
+#   - Q9.7 conversions of uci_qformat.py (lookup table: scalar, 1000 values of a buffer)
+#     against the scalar conversion they replaced
+#   - rolling statistics of a measurement (uci_stats.py, 5 fields of a window of 10 and
+#     100 values) against the history lists they replaced
+# Times are the best of REPEAT runs of NUMBER notifications. CPython has no allocation
+# counter: the memory allocated per notification is measured with tracemalloc (peak of
+# bytes allocated while processing it) with the number of blocks still allocated after.
+# Results are saved as a JSON baseline and compared with a previous one if given. The
+# headroom gives the shortest RANGING_DURATION the host can follow for each number of
+# controlees, and its load with the RANGING_DURATION configured in Initiator.py.
+#
+# Arguments: uci_benchmark.py [BASELINE=<file.json>] [SAVE=<file.json>] [NUMBER=2000] [REPEAT=5] [SEGMENT=64]
+#   Previous results to compare with
+#   File of the results (default uci_benchmark_<date>_<time>.json)
+#   Number of notifications of a run
+#   Number of runs of each step (best one kept)
+#   Payload size of the frames of segmented notifications
+
+from datetime import datetime
+
+import gc
+import importlib
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import Initiator as script
+
+from uci_dispatch import UciDispatcher, MT_NTF
+from uci_layout import RangeDecoder
+from uci_log import format_frame
+from uci_qformat import Q9_7, twos_comp
+from uci_timestamp import TimestampClock
+from uci_reader import UciFrameReader
+from uci_segment import SegmentBuffer, RANGE_DATA_MAX_SIZE
+from uci_stats import RollingStats, LINEAR, CIRCULAR
+from uci_simulator import VirtualDevice, split_tlvs
+from uci_tlv import APP_CONFIG_PARAMS, build_command, encode_params
+
+# Number of controlees of the notifications
+CONTROLEES = range(1, 9)
+
+
+# Scalar conversion of the scripts before the lookup tables of uci_qformat.py (reference)
+def reference_qformat_to_float(q_in, n_ints, n_fracs, round_of=2):
+    bits = n_ints + n_fracs
+    if (q_in & (1 << (bits - 1))) != 0:
+        q_in = q_in - (1 << bits)
+    return round(q_in / (1 << n_fracs), round_of)
+
+
+# Two's complement of the scripts before uci_qformat.py (reference)
+def reference_twos_comp(val, bits):
+    if (val & (1 << (bits - 1))) != 0:
+        val = val - (1 << bits)
+    return val
+
+
+# Amplitude of the CIR samples of the scripts before uci_cir.py (reference)
+def reference_extract_cir(byte_array):
+    cir_raw = []
+    for idx in range(0, len(byte_array), 4):
+        cir_sample = byte_array[idx:idx + 4]
+        real = reference_twos_comp(int((cir_sample[1] << 8) + cir_sample[0]), 16)
+        imaginary = reference_twos_comp(int((cir_sample[3] << 8) + cir_sample[2]), 16)
+        cir_raw.append(real + 1j * imaginary)
+    return script.np.abs(cir_raw)
+
+
+# Averages of the Responder before uci_stats.py (reference): history lists of 5 fields
+def reference_history(histories, values, window):
+    for hist, value in zip(histories, values):
+        hist.append(value)
+        if (len(hist) > window): hist.pop(0)
+    return [sum(hist) / len(hist) for hist in histories]
+
+
+class BufferPort():
+    # Serial port receiving the same bytes at each read
+    def __init__(self, data):
+        self.data = data
+        self.in_waiting = len(data)
+
+    def read(self, size):
+        return self.data
+
+
+# Frames (header, payload) of the wire bytes of a notification
+def split_frames(data):
+    reader = UciFrameReader(BufferPort(data))
+    reader.fill()
+    frames = []
+    frame = reader.extract_frame()
+    while (frame is not None):
+        frames.append((frame[0], bytes(frame[1])))
+        frame = reader.extract_frame()
+    return frames
+
+
+def virtual_device(controlees, segment):
+    device = VirtualDevice(controlees=controlees, segment=segment, seed=0)
+    device.session_id = bytes([0x01, 0x00, 0x00, 0x00])
+    device.core_config.update(split_tlvs(script.UWB_CORE_SET_CONFIG[5:]))
+    device.app_config.update(split_tlvs(script.UWB_SESSION_SET_APP_CONFIG[9:]))
+    device.app_config.update(split_tlvs(script.UWB_SESSION_SET_INITIATOR_CONFIG[9:]))
+    return device
+
+
+# RangeDecoder configured by the commands of the script for a number of controlees
+def range_decoder(controlees):
+    decoder = RangeDecoder()
+    decoder.configure(script.UWB_CORE_SET_CONFIG)
+    decoder.configure(script.UWB_SESSION_SET_APP_CONFIG)
+    decoder.configure(build_command(0x01, 0x03, bytes([0x01, 0x00, 0x00, 0x00]) +
+                                    encode_params(APP_CONFIG_PARAMS, [("NUMBER_OF_CONTROLEES", controlees)])))
+    return decoder
+
+
+# Best time of a step in ns (the step processes one notification)
+def measure(step, number, repeat):
+    step()  # Warm-up
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    best = None
+    for run in range(0, repeat):
+        start = time.perf_counter_ns()
+        for idx in range(0, number):
+            step()
+        elapsed = time.perf_counter_ns() - start
+        if ((best is None) or (elapsed < best)):
+            best = elapsed
+    if (gc_enabled):
+        gc.enable()
+
+    return best / number
+
+
+# Peak of bytes allocated by a step and blocks still allocated after it
+def allocations(step, number):
+    step()  # Warm-up
+    number = min(number, 200)
+
+    tracemalloc.start()
+    peak_bytes = 0
+    start_blocks = sys.getallocatedblocks()
+    for idx in range(0, number):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        step()
+        peak_bytes += tracemalloc.get_traced_memory()[1] - current
+    kept_blocks = sys.getallocatedblocks() - start_blocks
+    tracemalloc.stop()
+
+    return (peak_bytes / number, max(kept_blocks, 0) / number)
+
+
+class Benchmark():
+    def __init__(self, number, repeat, segment):
+        self.number = number
+        self.repeat = repeat
+        self.segment = segment
+        self.results = {}
+
+        # Handlers of the script without console output
+        script.output = lambda string, frame=None, timestamp=None: False
+        script.bin_store = False
+        script.file_data_log = None
+        script.nb_meas = 0
+        script.is_cir_plot = True
+        try:
+            script.np = importlib.import_module("numpy")
+            script.uci_cir = importlib.import_module("uci_cir")
+        except ImportError:
+            script.np = None
+
+        self.dispatcher = UciDispatcher()
+        self.dispatcher.register(MT_NTF, 0x02, 0x00, script.handle_range_data_segment, pbf=1)
+        self.dispatcher.register(MT_NTF, 0x02, 0x00, script.handle_range_data_ntf)
+        self.dispatcher.register(MT_NTF, 0x0E, 0x0B, script.handle_rframe_log_segment, pbf=1)
+        self.dispatcher.register(MT_NTF, 0x0E, 0x0B, script.handle_rframe_log_ntf)
+
+    def add(self, name, step, frames=1):
+        ns = measure(step, self.number, self.repeat)
+        peak_bytes, kept_blocks = allocations(step, self.number)
+        self.results[name] = {"ns": round(ns, 1), "peak_bytes": round(peak_bytes, 1),
+                              "kept_blocks": round(kept_blocks, 2), "frames": frames}
+        print("%-36s %10.0f ns %10.0f B %8.2f blocks %4d frame(s)" % (name, ns, peak_bytes, kept_blocks, frames))
+
+    def run_range_data(self, controlees, segmented):
+        device = virtual_device(controlees, self.segment if segmented else 0xFFFF)
+        data = device.range_data_ntf(device.peers())
+        script.range_decoder = range_decoder(controlees)
+        frames = split_frames(data)
+        suffix = "[%d%s]" % (controlees, ",seg" if segmented else "")
+
+        port = BufferPort(data)
+        reader = UciFrameReader(port)
+        def header():
+            reader.fill()
+            while (reader.extract_frame() is not None):
+                pass
+        self.add("header " + suffix, header, len(frames))
+
+        segments = SegmentBuffer(RANGE_DATA_MAX_SIZE)
+        def reassembly():
+            for uci_hdr, uci_payload in frames[:-1]:
+                segments.append(uci_payload)
+            segments.complete(frames[-1][1])
+        self.add("reassembly " + suffix, reassembly, len(frames))
+
+        dispatch = self.dispatcher.dispatch
+        def range_data():
+            for uci_hdr, uci_payload in frames:
+                dispatch(uci_hdr, uci_payload)
+        self.add("range_data " + suffix, range_data, len(frames))
+
+        log_received_frame = script.log_received_frame
+        def hex_log():
+            for uci_hdr, uci_payload in frames:
+                log_received_frame(uci_hdr, uci_payload)
+        self.add("hex_log " + suffix, hex_log, len(frames))
+
+        clock = TimestampClock()
+        def hex_format():
+            for uci_hdr, uci_payload in frames:
+                format_frame("NXPUCIR <= ", clock.format(clock.now()), b"".join((uci_hdr, uci_payload)))
+        self.add("hex_format " + suffix, hex_format, len(frames))
+
+        # As chained by the read thread
+        def total():
+            reader.fill()
+            frame = reader.extract_frame()
+            while (frame is not None):
+                log_received_frame(frame[0], frame[1])
+                dispatch(frame[0], frame[1])
+                frame = reader.extract_frame()
+        self.add("total " + suffix, total, len(frames))
+
+    def run_rframe(self, controlees):
+        device = virtual_device(controlees, 0xFF)
+        frames = split_frames(device.rframe_log_ntf(device.peers()))
+
+        dispatch = self.dispatcher.dispatch
+        def rframe():
+            for uci_hdr, uci_payload in frames:
+                dispatch(uci_hdr, uci_payload)
+        self.add("rframe [%d]" % controlees, rframe, len(frames))
+
+        rframe_log = b"".join(uci_payload for uci_hdr, uci_payload in frames)
+        self.add("rframe_plot [%d]" % controlees, lambda: script.update_plot(("cir", rframe_log)))
+
+    def run_helpers(self):
+        self.run_qformat()
+        self.run_twos_comp()
+        cir_bytes = bytes(range(0, 64))
+        self.add("reference_extract_cir (16 samples)", lambda: reference_extract_cir(cir_bytes))
+        self.add("decode_cir (16 samples)", lambda: script.uci_cir.decode_cir(cir_bytes))
+
+        device = virtual_device(8, 0xFFFF)
+        rframe_logs = [bytes(device.rframe_log_ntf(device.peers())[4:])] * 64
+        self.add("decode_rframe_cir_batch (64x8)", lambda: script.uci_cir.decode_rframe_cir_batch(rframe_logs), 64)
+
+        range_ntf = bytes(device.range_data_ntf(device.peers())[4:])
+        decoder = range_decoder(8)
+        self.add("RangeDecoder.decode [8]", lambda: decoder.decode(range_ntf))
+        unconfigured = RangeDecoder()
+        self.add("RangeDecoder.decode [8] (no session)", lambda: unconfigured.decode(range_ntf))
+
+        uci_range = importlib.import_module("uci_range")
+        self.add("decode_range_data [8]", lambda: uci_range.decode_range_data(range_ntf))
+        range_ntfs = [range_ntf] * 1000
+        self.add("decode_range_data_batch (1000x8)", lambda: uci_range.decode_range_data_batch(range_ntfs), 1000)
+
+    def run_stats(self):
+        values = (120.0, 33.7, -5.4, 16.8, 2.7)
+        for window in [10, 100]:
+            histories = [[] for value in values]
+            self.add("reference history [%d]" % window, lambda: reference_history(histories, values, window))
+            stats = RollingStats([("distance", LINEAR), ("azimuth", CIRCULAR), ("elevation", CIRCULAR),
+                                  ("pdoa1", CIRCULAR), ("pdoa2", CIRCULAR)], window)
+            self.add("RollingStats.update [%d]" % window, lambda: stats.update(0x1000, values).means())
+
+    def run(self):
+        for controlees in CONTROLEES:
+            for segmented in [False, True]:
+                self.run_range_data(controlees, segmented)
+        if (script.np is not None):
+            for controlees in CONTROLEES:
+                self.run_rframe(controlees)
+            self.run_helpers()
+        else:
+            print("numpy not available: RFRAME, CIR and array steps skipped")
+            self.run_qformat(False)
+            self.run_twos_comp()
+        self.run_stats()
+
+    def run_twos_comp(self):
+        self.add("reference_twos_comp", lambda: reference_twos_comp(0xFF38, 16))
+        self.add("twos_comp", lambda: twos_comp(0xFF38, 16))
+
+    def run_qformat(self, arrays=True):
+        Q9_7.to_float(0, 1)  # Lookup table built before the measures
+        self.add("reference_qformat_to_float", lambda: reference_qformat_to_float(0x1480, 9, 7, 1))
+        self.add("convert_qformat_to_float", lambda: script.convert_qformat_to_float(0x1480, 9, 7, 1))
+        self.add("Q9_7.to_float", lambda: Q9_7.to_float(0x1480, 1))
+        if (arrays):
+            data = bytes(range(0, 250)) * 8
+            self.add("reference (1000 values)", lambda: [reference_qformat_to_float(data[idx] + (data[idx + 1] << 8), 9, 7, 1)
+                                                         for idx in range(0, 2000, 2)])
+            self.add("Q9_7.decode (1000 values)", lambda: Q9_7.decode(data, round_of=1))
+
+    # Shortest RANGING_DURATION followed with the whole core, load at the configured one
+    def headroom(self):
+        tlv = split_tlvs(script.UWB_SESSION_SET_APP_CONFIG[9:])[bytes([0x09])]
+        ranging_duration = int.from_bytes(tlv[2:], "little")
+
+        lines = []
+        for controlees in CONTROLEES:
+            ns = self.results["total [%d,seg]" % controlees]["ns"]
+            lines.append("%d controlee(s): %7.1f us/round   Shortest RANGING_DURATION:%7.3f ms   Load at %d ms:%7.4f %%" \
+                         % (controlees, ns / 1000, ns / 1e6, ranging_duration, ns / 1e6 / ranging_duration * 100))
+        return lines
+
+    def compare(self, baseline):
+        for name in self.results:
+            if (name in baseline["results"]):
+                ratio = self.results[name]["ns"] / baseline["results"][name]["ns"]
+                print("%-36s %6.2fx %s" % (name, ratio, "(slower)" if (ratio > 1.1) else ""))
+
+    def save(self, file_name):
+        with open(file_name, "w") as result_file:
+            json.dump({"date": datetime.now().isoformat(sep=" ", timespec="seconds"),
+                       "python": platform.python_version(), "platform": platform.platform(),
+                       "machine": platform.machine(), "number": self.number, "repeat": self.repeat,
+                       "segment": self.segment, "results": self.results}, result_file, indent=1)
+
+
+def main():
+    baseline_file = None
+    save_file = "uci_benchmark_" + datetime.now().strftime("%y%m%d_%H%M%S") + ".json"
+    number = 2000
+    repeat = 5
+    segment = 64
+
+    for arg in sys.argv[1:]:
+        name, _, value = arg.partition("=")
+        if (name == "BASELINE"):
+            baseline_file = value
+        elif (name == "SAVE"):
+            save_file = value
+        elif (name == "NUMBER"):
+            number = int(value)
+        elif (name == "REPEAT"):
+            repeat = int(value)
+        elif (name == "SEGMENT"):
+            segment = int(value)
+        else:
+            print("Unknown argument: " + arg)
+            sys.exit(1)
+
+    benchmark = Benchmark(number, repeat, segment)
+    print("%-36s %13s %12s %15s" % ("step [controlees]", "time", "peak alloc", "kept"))
+    benchmark.run()
+
+    print("")
+    for line in benchmark.headroom():
+        print("Headroom: " + line)
+
+    if (baseline_file is not None):
+        print("")
+        print("Compared with " + baseline_file + ":")
+        with open(baseline_file, "r") as result_file:
+            benchmark.compare(json.load(result_file))
+
+    benchmark.save(save_file)
+    print("")
+    print("Results saved in " + save_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# Indexed capture of the frames sent and received by the scripts
+#
+# A single append-only file holds every frame with its receive time, instead of the hex
+# lines of the output, the CSV of the measurements and the binary files of the CIR and
+# RFrame notifications (all of them can be rebuilt by replaying the capture):
+#   CAPTURE_MAGIC, CAPTURE_HEADER (anchor of the clock: wall-clock and monotonic times)
+#   then per frame: CAPTURE_RECORD (monotonic time in ns, direction, length), header, payload
+# Times are time.monotonic_ns(), converted to wall-clock with the anchor of the header.
+# A sparse index is written in a sidecar file (capture file name + ".idx"): one entry
+# every INDEX_INTERVAL records (at the next frame not continuing a segmented notification)
+# with the time of the record, the last seq_cnt of RANGE_DATA_NTF before it and its
+# offset. Readers map the capture in memory, find the entry before a time or a seq_cnt
+# with a binary search and only parse the records from there. Records after the last entry (capture not closed) are indexed when opened.
+#
+# Arguments: uci_capture.py <capture_file> [TIME=s] [SEQ=n] [COUNT=n]
+#   Start at the first frame received s seconds after the start of the capture
+#   Start at the first RANGE_DATA_NTF with a seq_cnt of at least n
+#   Number of frames written (default all), as lines of the output log of the scripts
+
+from bisect import bisect_left
+
+import atexit
+import mmap
+import struct
+import sys
+
+from uci_log import format_frame, RAW_RX, RAW_TX, RAW_CACHE
+from uci_timestamp import TimestampClock
+
+CAPTURE_MAGIC = b"UCICAP\x00\x01"
+CAPTURE_HEADER = struct.Struct("<qq")
+CAPTURE_RECORD = struct.Struct("<qBI")
+
+INDEX_MAGIC = b"UCIIDX\x00\x01"
+INDEX_ENTRY = struct.Struct("<qqQ")
+INDEX_INTERVAL = 256
+
+# Prefix of the frames in the output log of the scripts
+FRAME_PREFIX = {RAW_RX: "NXPUCIR <= ", RAW_TX: "NXPUCIX => ", RAW_CACHE: "NXPUCIC <= "}
+
+
+class RangeSeqCounter():
+    # seq_cnt of the RANGE_DATA_NTF received, the next frames of a segmented notification
+    # are skipped
+    def __init__(self):
+        self.seq_cnt = -1
+        self.continued = False
+
+    # Return the seq_cnt if the frame starts a RANGE_DATA_NTF, else None
+    def frame(self, direction, uci_hdr, uci_payload):
+        if ((direction != RAW_RX) or ((uci_hdr[0] & 0xEF) != 0x62) or ((uci_hdr[1] & 0x3F) != 0x00)):
+            return None
+
+        seq_cnt = None
+        if ((not self.continued) and (len(uci_payload) >= 4)):
+            seq_cnt = int.from_bytes(uci_payload[0:4], "little")
+            self.seq_cnt = seq_cnt
+        self.continued = ((uci_hdr[0] & 0x10) != 0)
+        return seq_cnt
+
+
+class FrameCapture():
+    # clock gives the times of the frames not timestamped by the caller and its anchor
+    def __init__(self, file_name, clock):
+        self.file_name = file_name
+        self.clock = clock
+        self.file = open(file_name, "wb", buffering=1 << 20)
+        self.index_file = open(file_name + ".idx", "wb", buffering=1 << 16)
+        self.seq_counter = RangeSeqCounter()
+        self.frames = 0
+        self.entries = 0
+        self.since_entry = INDEX_INTERVAL
+
+        # Entries of the index are written before the end of the script
+        atexit.register(self.close)
+
+        self.file.write(CAPTURE_MAGIC)
+        self.file.write(CAPTURE_HEADER.pack(clock.wall_clock_ns, clock.monotonic_ns))
+        self.offset = len(CAPTURE_MAGIC) + CAPTURE_HEADER.size
+        self.index_file.write(INDEX_MAGIC)
+
+    # Store a frame (header and payload) with its direction and time (time.monotonic_ns()),
+    # timestamped now if None: records are always timestamped
+    def frame(self, direction, uci_hdr, uci_payload=b"", time_ns=None):
+        if (time_ns is None):
+            time_ns = self.clock.now()
+        if ((self.since_entry >= INDEX_INTERVAL) and (not self.seq_counter.continued)):
+            self.index_file.write(INDEX_ENTRY.pack(time_ns, self.seq_counter.seq_cnt, self.offset))
+            self.entries += 1
+            self.since_entry = 0
+        self.since_entry += 1
+        self.seq_counter.frame(direction, uci_hdr, uci_payload)
+
+        length = len(uci_hdr) + len(uci_payload)
+        self.file.write(CAPTURE_RECORD.pack(time_ns, direction, length))
+        self.file.write(uci_hdr)
+        self.file.write(uci_payload)
+        self.frames += 1
+        self.offset += CAPTURE_RECORD.size + length
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
+
+    def report(self):
+        return "File:%s   Frames:%d   Bytes:%d   Index entries:%d" \
+               % (self.file_name, self.frames, self.offset, self.entries)
+
+
+class CaptureReader():
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, "rb") as capture_file:
+            self.data = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if (self.data[0:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC):
+            self.data.close()
+            raise ValueError(file_name + " is not a capture file")
+        wall_clock_ns, self.start_ns = CAPTURE_HEADER.unpack_from(self.data, len(CAPTURE_MAGIC))
+        self.clock = TimestampClock(wall_clock_ns, self.start_ns)
+        self.first_offset = len(CAPTURE_MAGIC) + CAPTURE_HEADER.size
+
+        self.times = []
+        self.seq_cnts = []
+        self.offsets = []
+        self.load_index()
+
+    def load_index(self):
+        try:
+            with open(self.file_name + ".idx", "rb") as index_file:
+                index = index_file.read()
+        except OSError:
+            index = b""
+
+        if (index[0:len(INDEX_MAGIC)] == INDEX_MAGIC):
+            entries = (len(index) - len(INDEX_MAGIC)) // INDEX_ENTRY.size
+            for time_ns, seq_cnt, offset in INDEX_ENTRY.iter_unpack(index[len(INDEX_MAGIC):len(INDEX_MAGIC) + entries * INDEX_ENTRY.size]):
+                if (offset >= len(self.data)):
+                    break
+                self.times.append(time_ns)
+                self.seq_cnts.append(seq_cnt)
+                self.offsets.append(offset)
+
+        # Records after the last entry (or all of them without index)
+        if (len(self.offsets) == 0):
+            self.times.append(self.start_ns)
+            self.seq_cnts.append(-1)
+            self.offsets.append(self.first_offset)
+
+        seq_counter = RangeSeqCounter()
+        seq_counter.seq_cnt = self.seq_cnts[-1]
+        since_entry = 0
+        for offset, time_ns, direction, uci_hdr, uci_payload in self.records(self.offsets[-1]):
+            if ((since_entry >= INDEX_INTERVAL) and (not seq_counter.continued)):
+                self.times.append(time_ns)
+                self.seq_cnts.append(seq_counter.seq_cnt)
+                self.offsets.append(offset)
+                since_entry = 0
+            since_entry += 1
+            seq_counter.frame(direction, uci_hdr, uci_payload)
+
+    # Records from an offset: (offset, time in ns, direction, header, payload), a truncated
+    # last record is skipped
+    def records(self, offset=None):
+        data = self.data
+        if (offset is None):
+            offset = self.first_offset
+
+        while (offset + CAPTURE_RECORD.size <= len(data)):
+            time_ns, direction, length = CAPTURE_RECORD.unpack_from(data, offset)
+            start = offset + CAPTURE_RECORD.size
+            if ((length < 4) or (start + length > len(data))):
+                break
+            yield (offset, time_ns, direction, data[start:start + 4], data[start + 4:start + length])
+            offset = start + length
+
+    # Offset of the first record at or after a monotonic time
+    def seek_time(self, time_ns):
+        entry = max(bisect_left(self.times, time_ns) - 1, 0)
+        for offset, record_ns, direction, uci_hdr, uci_payload in self.records(self.offsets[entry]):
+            if (record_ns >= time_ns):
+                return offset
+        return len(self.data)
+
+    # Offset of the first RANGE_DATA_NTF with a seq_cnt at or after seq_cnt (seq_cnt only
+    # increases during a session)
+    def seek_seq(self, seq_cnt):
+        entry = max(bisect_left(self.seq_cnts, seq_cnt) - 1, 0)
+        seq_counter = RangeSeqCounter()
+        for offset, time_ns, direction, uci_hdr, uci_payload in self.records(self.offsets[entry]):
+            record_seq = seq_counter.frame(direction, uci_hdr, uci_payload)
+            if ((record_seq is not None) and (record_seq >= seq_cnt)):
+                return offset
+        return len(self.data)
+
+    def wall_clock(self, time_ns):
+        return self.clock.datetime(time_ns)
+
+    # Frames received from an offset: (timestamp, header, payload)
+    def frames(self, offset=None):
+        for offset, time_ns, direction, uci_hdr, uci_payload in self.records(offset):
+            if (direction == RAW_RX):
+                yield (self.wall_clock(time_ns), uci_hdr, uci_payload)
+
+    def close(self):
+        self.data.close()
+
+
+def main():
+    if ((len(sys.argv) < 2) or ("=" in sys.argv[1])):
+        print("Usage: uci_capture.py <capture_file> [TIME=s] [SEQ=n] [COUNT=n]")
+        sys.exit(1)
+
+    reader = CaptureReader(sys.argv[1])
+    offset = None
+    count = None
+    for arg in sys.argv[2:]:
+        name, _, value = arg.partition("=")
+        if (name == "TIME"):
+            offset = reader.seek_time(reader.start_ns + int(float(value) * 1e9))
+        elif (name == "SEQ"):
+            offset = reader.seek_seq(int(value))
+        elif (name == "COUNT"):
+            count = int(value)
+        else:
+            print("Unknown argument: " + arg)
+            sys.exit(1)
+
+    for offset, time_ns, direction, uci_hdr, uci_payload in reader.records(offset):
+        if (count is not None):
+            if (count == 0):
+                break
+            count -= 1
+        print(format_frame(FRAME_PREFIX.get(direction, "NXPUCI? <= "), reader.clock.format(time_ns), uci_hdr + uci_payload))
+
+    reader.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Vectorized decode of the CIR samples of DBG_RFRAME_LOG_NTF and DBG_CIR0/CIR1_LOG_NTF
+#
+# extract_cir() looped over the samples in Python (two twos_comp() per sample and a list
+# of complex numbers before np.abs()) and was called once per measurement of each
+# DBG_RFRAME_LOG_NTF. A CIR is an array of little-endian int16 pairs (real, imaginary):
+# the buffer is now reinterpreted with np.frombuffer in one call, converted to float32
+# and viewed as complex64, so the phase is kept (np.abs() gives the amplitude plotted).
+# All the measurements of a DBG_RFRAME_LOG_NTF are decoded at once with a structured
+# dtype of their 91-byte records, and a batch of notifications by joining their records.
+# Imported by load_modules() of the scripts with numpy, only when plots are enabled.
+
+import numpy as np
+
+# DBG_RFRAME_LOG_NTF: session ID, number of measurements, then the measurements
+RFRAME_HEADER_SIZE = 5
+
+# Measurement: mapping (slot index, 0x80 for the second RX), RFU and info, 16 CIR samples
+RFRAME_MEASUREMENT = np.dtype([("mapping", "u1"), ("info", "V26"), ("cir", "<i2", (16, 2))])
+
+# DBG_CIR0/CIR1_LOG_NTF: session ID, then the CIR samples
+CIR_LOG_HEADER_SIZE = 4
+
+
+# Complex64 samples of an int16 array of (real, imaginary) pairs on its last axis
+def to_complex(samples):
+    return samples.astype(np.float32).view(np.complex64)[..., 0]
+
+
+# Complex64 samples of the int16 pairs from an offset (a trailing partial sample is ignored)
+def decode_cir(data, offset=0):
+    count = (len(data) - offset) // 4
+    return to_complex(np.frombuffer(data, dtype="<i2", count=count * 2, offset=offset).reshape(count, 2))
+
+
+# Number of complete measurements of a DBG_RFRAME_LOG_NTF
+def rframe_count(rframe_log):
+    available = (len(rframe_log) - RFRAME_HEADER_SIZE) // RFRAME_MEASUREMENT.itemsize
+    return max(min(rframe_log[4], available), 0)
+
+
+# Mappings and CIR samples (measurements x 16, complex64) of a DBG_RFRAME_LOG_NTF
+def decode_rframe_cir(rframe_log):
+    records = np.frombuffer(rframe_log, dtype=RFRAME_MEASUREMENT, count=rframe_count(rframe_log),
+                            offset=RFRAME_HEADER_SIZE)
+    return records["mapping"], to_complex(records["cir"])
+
+
+# Same for a batch of DBG_RFRAME_LOG_NTF, with the index in the batch of each measurement
+def decode_rframe_cir_batch(rframe_logs):
+    counts = [rframe_count(rframe_log) for rframe_log in rframe_logs]
+    records = np.frombuffer(b"".join(rframe_log[RFRAME_HEADER_SIZE:RFRAME_HEADER_SIZE + count * RFRAME_MEASUREMENT.itemsize]
+                                     for rframe_log, count in zip(rframe_logs, counts)), dtype=RFRAME_MEASUREMENT)
+    return np.repeat(np.arange(len(counts)), counts), records["mapping"], to_complex(records["cir"])
+
+
+# CIR samples (complex64) of a DBG_CIR0/CIR1_LOG_NTF
+def decode_cir_log(cir_log):
+    return decode_cir(cir_log, CIR_LOG_HEADER_SIZE)
@@ -0,0 +1,92 @@
+# Coalescing of UCI configuration commands
+#
+# Consecutive CORE_SET_CONFIG commands, or SESSION_SET_APP_CONFIG commands of the
+# same session, are merged into the fewest commands fitting in a USB packet: the
+# parameter lists are concatenated and the payload length and number of parameters
+# are recomputed. A merged command keeps the original commands to send them one by
+# one if the device rejects it. Merged commands are framed once for the USB link.
+
+from uci_tlv import MAX_COMMAND_SIZE, usb_frame
+
+# Offset of the number of parameters for each mergeable command (GID/OID)
+PARAMETERS_OFFSET = {
+    (0x20, 0x04): 4,  # CORE_SET_CONFIG: number of parameters, parameters
+    (0x21, 0x03): 8,  # SESSION_SET_APP_CONFIG: session ID, number of parameters, parameters
+}
+
+
+class CoalescedCommand(list):
+    def __init__(self, parts):
+        list.__init__(self, parts[0])
+        self.parts = [parts[0]]
+        self.frame = usb_frame(self)
+
+    # Offset of the number of parameters
+    def offset(self):
+        return PARAMETERS_OFFSET[(self[0], self[1])]
+
+    def add(self, uci_command):
+        offset = self.offset()
+        self.parts.append(uci_command)
+        self.extend(uci_command[offset + 1:])
+        self[offset] = len(parameter_ids(self[offset + 1:]))
+        self[3] = len(self) - 4
+        self.frame = usb_frame(self)
+
+
+# IDs of the parameters of a TLV list (IDs 0xE0 to 0xE4 are followed by a second byte)
+def parameter_ids(tlvs):
+    ids = []
+    idx = 0
+    while (idx < len(tlvs)):
+        if (0xE0 <= tlvs[idx] <= 0xE4):
+            ids.append(bytes(tlvs[idx:idx + 2]))
+            idx += 2
+        else:
+            ids.append(bytes(tlvs[idx:idx + 1]))
+            idx += 1
+        idx += 1 + tlvs[idx]
+    return ids
+
+
+def can_merge(merged, uci_command, max_size):
+    if ((merged is None) or ((merged[0], merged[1]) != (uci_command[0], uci_command[1]))):
+        return False
+
+    offset = merged.offset()
+    if (list(merged[4:offset]) != list(uci_command[4:offset])):
+        # Other session
+        return False
+    if (len(merged) + len(uci_command) - offset - 1 > max_size):
+        return False
+
+    # A parameter set twice is kept in separate commands to preserve the order
+    ids = parameter_ids(merged[offset + 1:])
+    for parameter_id in parameter_ids(uci_command[offset + 1:]):
+        if (parameter_id in ids):
+            return False
+    return True
+
+
+# Return the commands with consecutive configuration commands merged
+# (commands not merged are returned as they are)
+def coalesce_commands(uci_commands, max_size=MAX_COMMAND_SIZE):
+    coalesced = []
+    merged = None
+
+    for uci_command in uci_commands:
+        if (can_merge(merged, uci_command, max_size)):
+            merged.add(uci_command)
+        elif ((uci_command[0], uci_command[1]) in PARAMETERS_OFFSET):
+            merged = CoalescedCommand([uci_command])
+            coalesced.append(merged)
+        else:
+            merged = None
+            coalesced.append(uci_command)
+
+    # Single commands are not modified
+    for idx in range(0, len(coalesced)):
+        if (isinstance(coalesced[idx], CoalescedCommand) and (len(coalesced[idx].parts) == 1)):
+            coalesced[idx] = coalesced[idx].parts[0]
+
+    return coalesced
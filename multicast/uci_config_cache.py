@@ -0,0 +1,196 @@
+# Persistent cache of the configuration applied to each UWB device
+#
+# Devices are identified by a hash of their GET_DEVICE_INFO response. For each device
+# the cache remembers the OTP calibration values read and the hash of every
+# configuration block (CORE_SET_CONFIG and SET_CALIBRATION) applied since the last
+# UWB_RESET_DEVICE, with the round trip time of each command.
+# On the next start:
+#   - the OTP reads are replaced by the notifications read before (OTP never changes)
+#   - if the previous run ended with the session deinitialized and the device still
+#     holds the core configuration (checked with CORE_GET_CONFIG), the reset is skipped
+#     and the blocks which did not change since they were applied are not sent again
+# A block which changed is sent and recorded, any mismatch falls back to a full bring-up.
+
+from datetime import datetime
+
+import hashlib
+import json
+import time
+
+from uci_coalesce import parameter_ids
+
+# Configuration blocks: CORE_SET_CONFIG and SET_CALIBRATION
+CONFIG_COMMANDS = [(0x20, 0x04), (0x2E, 0x11)]
+
+
+def is_config_block(uci_command):
+    return ((uci_command[0], uci_command[1]) in CONFIG_COMMANDS)
+
+
+# Identify the part of the configuration written by a command: parameter ID for a
+# configuration block (channel and calibration parameter for SET_CALIBRATION),
+# whole command otherwise
+def command_slot(uci_command):
+    if (is_config_block(uci_command)):
+        return bytes(uci_command[0:2] + uci_command[4:8]).hex()
+    return bytes(uci_command[0:2] + uci_command[4:]).hex()
+
+
+def command_hash(uci_command):
+    return hashlib.sha1(bytes(uci_command)).hexdigest()
+
+
+# Build the CORE_GET_CONFIG command reading back the parameters of a CORE_SET_CONFIG
+def core_get_config(core_set_config):
+    ids = list(b"".join(parameter_ids(core_set_config[5:])))
+    return [0x20, 0x05, 0x00, 1 + len(ids), core_set_config[4]] + ids
+
+
+class UciConfigCache():
+    # execute(uci_command) sends a command and returns its CommandResult
+    # replay(uci_hdr, uci_payload) handles a notification read from the cache
+    # core_config: CORE_SET_CONFIG read back to check that the device was not reset
+    def __init__(self, file_name, execute, replay, core_config):
+        self.file_name = file_name
+        self.execute = execute
+        self.replay = replay
+        self.core_config = core_config
+        self.otp_reads = []  # (command, header of its notification)
+        self.key = None
+        self.entry = None
+        self.warm = False
+        self.started = None
+        self.finished = None
+        self.skipped = 0
+        self.saved_rtt = 0.0
+
+        try:
+            with open(file_name, "r") as cache_file:
+                self.devices = json.load(cache_file)
+        except (OSError, ValueError):
+            self.devices = {}
+
+    # Command reading OTP data answered by a notification with the given header
+    def add_otp_read(self, uci_command, uci_ntf_hdr):
+        self.otp_reads.append((bytes(uci_command).hex(), bytes(uci_ntf_hdr)))
+
+    def identify(self):
+        result = self.execute([0x20, 0x02, 0x00, 0x00])  # Get Device Information
+        if (not result.is_ok()):
+            return
+
+        self.key = hashlib.sha1(result.payload).hexdigest()[0:16]
+        if (self.key not in self.devices):
+            self.devices[self.key] = {"device_info": result.payload.hex(), "otp": {}, "blocks": {}, "rtt": {},
+                                      "clean": False, "cold_bring_up": None, "last_bring_up": None}
+        self.entry = self.devices[self.key]
+
+    # Check that the device still holds the configuration applied by the previous run
+    def verify(self):
+        if ((self.entry is None) or (not self.entry["clean"])):
+            return False
+
+        result = self.execute(core_get_config(self.core_config))
+        return (result.is_ok() and (result.payload[1:] == bytes(self.core_config[4:])))
+
+    def skip_command(self, uci_command):
+        slot = command_slot(uci_command)
+        self.skipped += 1
+        self.saved_rtt += self.entry["rtt"].get(slot, 0.0)
+
+    # Return True if the command does not need to be sent
+    def skip(self, uci_command):
+        if (self.started is None):
+            self.started = time.perf_counter()
+
+        if (uci_command[0] == 0x20 and uci_command[1] == 0x00):
+            # UWB_RESET_DEVICE: identify the device before to decide
+            self.identify()
+            self.warm = self.verify()
+            if (self.warm):
+                self.skip_command(uci_command)
+                return True
+            if (self.entry is not None):
+                # Configuration lost with the reset
+                self.entry["blocks"] = {}
+            return False
+
+        if (self.entry is None):
+            return False
+
+        command = bytes(uci_command).hex()
+        for otp_command, otp_ntf_hdr in self.otp_reads:
+            if ((command == otp_command) and (command in self.entry["otp"])):
+                # OTP values already read from this device
+                self.replay(otp_ntf_hdr, bytes.fromhex(self.entry["otp"][command]))
+                self.skip_command(uci_command)
+                return True
+
+        if ((self.warm) and (is_config_block(uci_command)) and \
+            (self.entry["blocks"].get(command_slot(uci_command)) == command_hash(uci_command))):
+            # Block unchanged since it was applied
+            self.skip_command(uci_command)
+            return True
+
+        return False
+
+    # Record the result of a command sent
+    def update(self, uci_command, result):
+        if (self.entry is None):
+            return
+
+        slot = command_slot(uci_command)
+        if ((result.is_ok()) and (result.attempts == 1)):
+            self.entry["rtt"][slot] = result.rtt
+
+        if (is_config_block(uci_command)):
+            if (result.is_ok()):
+                self.entry["blocks"][slot] = command_hash(uci_command)
+            else:
+                self.entry["blocks"].pop(slot, None)
+
+        if (uci_command[0] == 0x21 and uci_command[1] == 0x00):
+            # SESSION_INIT: end of the bring-up, session to deinit before next warm start
+            self.finished = time.perf_counter()
+            self.entry["last_bring_up"] = self.finished - self.started
+            if (not self.warm):
+                self.entry["cold_bring_up"] = self.entry["last_bring_up"]
+            self.entry["clean"] = False
+            self.save()
+
+    # Notification received from the device
+    def on_notification(self, uci_hdr, uci_payload):
+        if (self.entry is None):
+            return
+
+        for otp_command, otp_ntf_hdr in self.otp_reads:
+            if (uci_hdr == otp_ntf_hdr):
+                self.entry["otp"][otp_command] = bytes(uci_payload).hex()
+
+        if (uci_hdr[0] == 0x61 and uci_hdr[1] == 0x02 and uci_payload[4] == 0x01):
+            # SESSION_STATE_DEINIT
+            self.entry["clean"] = True
+
+    def save(self):
+        if (self.entry is not None):
+            self.entry["updated"] = datetime.now().isoformat(sep=" ", timespec="seconds")
+
+        try:
+            with open(self.file_name, "w") as cache_file:
+                json.dump(self.devices, cache_file, indent=1)
+        except OSError:
+            pass
+
+    def report(self):
+        if (self.entry is None):
+            return "Device not identified"
+
+        string = "Device:%s   Start:%s   Skipped:%d commands (%.1f ms of round trips)" \
+                 % (self.key, "warm" if self.warm else "cold", self.skipped, self.saved_rtt * 1000)
+        if (self.finished is not None):
+            string += "   Bring-up:%.1f ms" % ((self.finished - self.started) * 1000)
+            if ((self.warm) and (self.entry["cold_bring_up"] is not None)):
+                string += "   Cold bring-up:%.1f ms   Saved:%.1f ms" \
+                          % (self.entry["cold_bring_up"] * 1000,
+                             (self.entry["cold_bring_up"] - (self.finished - self.started)) * 1000)
+        return string
@@ -0,0 +1,79 @@
+# Table-driven dispatch of received UCI frames
+#
+# Handlers are registered for a (MT, GID, OID, PBF) combination and looked up with a
+# single dictionary access keyed on the first header byte (MT | PBF | GID) and the OID.
+# Several handlers can be attached to the same frame type, they are called in order
+# of registration with the header and the payload of the frame.
+
+import time
+
+# Message types
+MT_DATA = 0x00
+MT_CMD = 0x01
+MT_RSP = 0x02
+MT_NTF = 0x03
+
+
+def dispatch_key(mt, gid, oid, pbf=0):
+    return ((((mt & 0x07) << 5) | ((pbf & 0x01) << 4) | (gid & 0x0F)), oid & 0x3F)
+
+
+class DispatchStats():
+    def __init__(self):
+        self.frames = 0
+        self.unhandled = 0
+        self.overhead_ns = 0
+        self.handler_ns = 0
+
+    def overhead_per_frame(self):
+        if (self.frames == 0):
+            return 0.0
+        return self.overhead_ns / self.frames
+
+    def handler_per_frame(self):
+        if (self.frames == 0):
+            return 0.0
+        return self.handler_ns / self.frames
+
+    def report(self):
+        return "Frames:%d   Unhandled:%d   Dispatch overhead:%.0f ns/frame   Handlers:%.0f ns/frame" \
+               % (self.frames, self.unhandled, self.overhead_per_frame(), self.handler_per_frame())
+
+
+class UciDispatcher():
+    def __init__(self):
+        self.handlers = {}
+        self.stats = DispatchStats()
+
+    def register(self, mt, gid, oid, handler, pbf=0):
+        key = dispatch_key(mt, gid, oid, pbf)
+
+        if (key not in self.handlers):
+            self.handlers[key] = []
+        self.handlers[key].append(handler)
+
+    def unregister(self, mt, gid, oid, handler, pbf=0):
+        key = dispatch_key(mt, gid, oid, pbf)
+
+        if ((key in self.handlers) and (handler in self.handlers[key])):
+            self.handlers[key].remove(handler)
+            if (len(self.handlers[key]) == 0):
+                del self.handlers[key]
+
+    def dispatch(self, uci_hdr, uci_payload):
+        start = time.perf_counter_ns()
+        handlers = self.handlers.get((uci_hdr[0], uci_hdr[1] & 0x3F))
+        lookup = time.perf_counter_ns()
+
+        self.stats.frames += 1
+        self.stats.overhead_ns += lookup - start
+
+        if (handlers is None):
+            self.stats.unhandled += 1
+            return False
+
+        for handler in handlers:
+            handler(uci_hdr, uci_payload)
+
+        self.stats.handler_ns += time.perf_counter_ns() - lookup
+        return True
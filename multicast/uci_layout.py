@@ -0,0 +1,237 @@
+# Layouts of the RANGE_DATA_NTF: unicast and multicast, short and extended MAC addresses
+#
+# Initiator.py walked the multicast measurements with a 31-byte stride, Responder.py read
+# the single measurement of a unicast session at absolute offsets (extract_nlos(),
+# extract_distance()... and the PDoA at 66 and 70 when the payload was longer than 71
+# bytes), and the two drifted apart. A unicast RANGE_DATA_NTF is laid out as a multicast
+# one with a single measurement. A layout is the header, the measurements of the MAC
+# addressing mode (2-byte or 8-byte MAC address, 31 bytes both) and, when
+# NXP_EXTENDED_NTF_CONFIG is enabled, the NXP extended data (RSSI and PDoA of each
+# measurement), compiled in one struct.Struct. The PDoA index of the second antenna pair
+# of the last measurement may be missing, as the Responder decoded the PDoA of payloads
+# of 72 bytes and more (None then).
+# The layout of each session is compiled from the configuration sent: MULTI_NODE_MODE,
+# NUMBER_OF_CONTROLEES and MAC_ADDRESS_MODE of SESSION_SET_APP_CONFIG,
+# NXP_EXTENDED_NTF_CONFIG of CORE_SET_CONFIG. A notification which does not match it
+# (number of measurements, MAC addressing mode or length) is decoded with the layout
+# of its header and length. A notification is decoded by one unpack_from() and the
+# same conversions for every measurement: sign of the distance and validity looked up
+# from the status, Q9.7 angles and PDoA.
+
+from collections import namedtuple
+
+import struct
+
+from uci_coalesce import parameter_ids
+from uci_qformat import Q9_7, qformat
+from uci_tlv import APP_CONFIG_PARAMS, CORE_CONFIG_PARAMS
+
+# Header: sequence counter, session ID, RCR indication, current ranging interval, ranging
+# measurement type, (RFU), MAC addressing mode, (RFU), number of measurements
+RANGE_DATA_HEADER = "IIBIBxB8xB"
+RANGE_DATA_HEADER_SIZE = struct.calcsize("<" + RANGE_DATA_HEADER)
+HEADER_VALUES = 7
+
+# Measurement per MAC addressing mode of the notification: MAC address, status, NLoS,
+# distance, AoA azimuth and FOM, AoA elevation and FOM, destination AoA azimuth and FOM,
+# destination AoA elevation and FOM, slot index, (RFU)
+MAC_SHORT = 0x00
+MAC_EXTENDED = 0x01
+MEASUREMENT = {MAC_SHORT: "HBBHhBhBhBhBB12x",
+               MAC_EXTENDED: "QBBHhBhBhBhBB6x"}
+MEASUREMENT_SIZE = 31
+MEASUREMENT_VALUES = 13
+
+# NXP extended data: length, data type, RX mode, number of RX antennas, RX antenna info,
+# then per measurement RSSI RX1 and RX2, PDoA and PDoA index of both antenna pairs
+NXP_EXTENDED_HEADER = "HBBBB"
+NXP_EXTENDED_HEADER_SIZE = struct.calcsize("<" + NXP_EXTENDED_HEADER)
+NXP_EXTENDED_HEADER_VALUES = 5
+NXP_EXTENDED_MEASUREMENT = "hhhHhH"
+NXP_EXTENDED_MEASUREMENT_SIZE = struct.calcsize("<" + NXP_EXTENDED_MEASUREMENT)
+NXP_EXTENDED_VALUES = 6
+
+# Bytes of the extended data of the last measurement which may be missing (PDoA index)
+NXP_EXTENDED_OPTIONAL_SIZE = 2
+
+STATUS_OK = 0x00
+STATUS_NEGATIVE_DISTANCE = 0x1B
+
+# Per status: measurement valid, sign of the distance
+STATUS_VALID = tuple((status == STATUS_OK) or (status == STATUS_NEGATIVE_DISTANCE) for status in range(256))
+DISTANCE_SIGN = tuple(-1 if (status == STATUS_NEGATIVE_DISTANCE) else 1 for status in range(256))
+
+# RSSI in dBm
+RSSI = qformat(15, 1)
+
+# Parameters of the configuration giving the layout
+MULTI_NODE_MODE = APP_CONFIG_PARAMS["MULTI_NODE_MODE"].id
+NUMBER_OF_CONTROLEES = APP_CONFIG_PARAMS["NUMBER_OF_CONTROLEES"].id
+MAC_ADDRESS_MODE = APP_CONFIG_PARAMS["MAC_ADDRESS_MODE"].id
+NXP_EXTENDED_NTF_CONFIG = CORE_CONFIG_PARAMS["NXP_EXTENDED_NTF_CONFIG"].id
+
+RangeData = namedtuple("RangeData", ["seq_cnt", "session_id", "rcr", "interval", "measurement_type", "mac_mode",
+                                     "nb_measurements", "measurements"])
+
+# Angles and PDoA in degrees, RSSI in dBm, extended fields None without NXP extended data
+RangeMeasurement = namedtuple("RangeMeasurement", ["address", "status", "valid", "nlos", "distance",
+                                                   "azimuth", "azimuth_fom", "elevation", "elevation_fom",
+                                                   "dest_azimuth", "dest_azimuth_fom",
+                                                   "dest_elevation", "dest_elevation_fom", "slot",
+                                                   "rssi1", "rssi2", "pdoa1", "pdoa1_index", "pdoa2", "pdoa2_index"])
+
+NO_EXTENDED = (None,) * NXP_EXTENDED_VALUES
+
+
+# Values of the raw values of a format met (None: field absent from the layout), a dict
+# lookup instead of a call per field
+class ValueTable(dict):
+    def __init__(self, fmt, round_of):
+        dict.__init__(self, {None: None})
+        self.fmt = fmt
+        self.round_of = round_of
+
+    def __missing__(self, raw):
+        value = self.fmt.to_float(raw, self.round_of)
+        self[raw] = value
+        return value
+
+
+ANGLE = ValueTable(Q9_7, 1)
+PDOA = ValueTable(Q9_7, 7)
+RSSI_DBM = ValueTable(RSSI, 1)
+
+
+class RangeLayout():
+    def __init__(self, mac_mode, count, extended):
+        self.mac_mode = mac_mode
+        self.count = count
+        self.extended = extended
+        layout = RANGE_DATA_HEADER + MEASUREMENT[mac_mode] * count
+        if (extended):
+            layout += NXP_EXTENDED_HEADER + NXP_EXTENDED_MEASUREMENT * count
+        self.struct = struct.Struct("<" + layout)
+        self.size = self.struct.size
+        self.min_size = self.size - (NXP_EXTENDED_OPTIONAL_SIZE if ((extended) and (count > 0)) else 0)
+
+        # Slices of the values of each measurement and of its extended data (without NXP
+        # extended data, the None values appended to the values of the notification)
+        extended_start = HEADER_VALUES + count * MEASUREMENT_VALUES + (NXP_EXTENDED_HEADER_VALUES if (extended) else 0)
+        self.slices = []
+        for idx in range(0, count):
+            start = HEADER_VALUES + idx * MEASUREMENT_VALUES
+            ext = extended_start + (idx * NXP_EXTENDED_VALUES if (extended) else 0)
+            self.slices.append((slice(start, start + MEASUREMENT_VALUES), slice(ext, ext + NXP_EXTENDED_VALUES)))
+
+    def __repr__(self):
+        return "RangeLayout(%s, %d%s)" % ("extended" if (self.mac_mode == MAC_EXTENDED) else "short", self.count,
+                                          ", NXP extended" if (self.extended) else "")
+
+    # The notification has the measurements of the layout
+    def matches(self, range_ntf):
+        return ((len(range_ntf) >= self.min_size) and (range_ntf[24] == self.count) and (range_ntf[15] == self.mac_mode))
+
+    def decode(self, range_ntf):
+        if (len(range_ntf) < self.size):
+            # Last PDoA index missing
+            values = self.struct.unpack_from(bytes(range_ntf) + bytes(self.size - len(range_ntf)))[:-1] + (None,)
+        else:
+            values = self.struct.unpack_from(range_ntf)
+        values += NO_EXTENDED
+        make_measurement = RangeMeasurement._make  # Without the argument parsing of RangeMeasurement()
+        measurements = []
+        for measurement, extended in self.slices:
+            (address, status, nlos, distance, azimuth, azimuth_fom, elevation, elevation_fom, dest_azimuth,
+             dest_azimuth_fom, dest_elevation, dest_elevation_fom, slot) = values[measurement]
+            rssi1, rssi2, pdoa1, pdoa1_index, pdoa2, pdoa2_index = values[extended]
+            measurements.append(make_measurement((address, status, STATUS_VALID[status], nlos,
+                                                  DISTANCE_SIGN[status] * distance,
+                                                  ANGLE[azimuth], azimuth_fom, ANGLE[elevation], elevation_fom,
+                                                  ANGLE[dest_azimuth], dest_azimuth_fom,
+                                                  ANGLE[dest_elevation], dest_elevation_fom, slot,
+                                                  RSSI_DBM[rssi1], RSSI_DBM[rssi2], PDOA[pdoa1], pdoa1_index,
+                                                  PDOA[pdoa2], pdoa2_index)))
+        return RangeData(*values[0:HEADER_VALUES], measurements)
+
+
+# Layouts compiled once, shared by the sessions
+LAYOUTS = {}
+
+
+def range_layout(mac_mode, count, extended):
+    key = (mac_mode, count, extended)
+    layout = LAYOUTS.get(key)
+    if (layout is None):
+        layout = RangeLayout(mac_mode, count, extended)
+        LAYOUTS[key] = layout
+    return layout
+
+
+# Layout of a notification from its header and length (measurements not complete dropped)
+def notification_layout(range_ntf):
+    mac_mode = range_ntf[15]
+    if (mac_mode not in MEASUREMENT):
+        return range_layout(MAC_SHORT, 0, False)
+    count = range_ntf[24]
+    size = RANGE_DATA_HEADER_SIZE + count * MEASUREMENT_SIZE
+    if ((count > 0) and (len(range_ntf) >= size + NXP_EXTENDED_HEADER_SIZE + count * NXP_EXTENDED_MEASUREMENT_SIZE
+                                        - NXP_EXTENDED_OPTIONAL_SIZE)):
+        return range_layout(mac_mode, count, True)
+    available = (len(range_ntf) - RANGE_DATA_HEADER_SIZE) // MEASUREMENT_SIZE
+    return range_layout(mac_mode, max(min(count, available), 0), False)
+
+
+# Values of the parameters of a TLV list
+def parameter_values(tlvs):
+    values = {}
+    idx = 0
+    for parameter_id in parameter_ids(tlvs):
+        idx += len(parameter_id)
+        values[parameter_id] = bytes(tlvs[idx + 1:idx + 1 + tlvs[idx]])
+        idx += 1 + tlvs[idx]
+    return values
+
+
+class RangeDecoder():
+    def __init__(self):
+        self.extended = False  # NXP_EXTENDED_NTF_CONFIG, disabled after reset
+        self.sessions = {}     # Configuration of each session (parameter ID: value)
+        self.layouts = {}      # Layout of each session
+        self.mismatches = 0    # Notifications not matching the layout of their session
+
+    # Record the layout parameters of a CORE_SET_CONFIG or SESSION_SET_APP_CONFIG sent
+    def configure(self, uci_command):
+        if ((uci_command[0], uci_command[1]) == (0x20, 0x04)):
+            value = parameter_values(uci_command[5:]).get(NXP_EXTENDED_NTF_CONFIG)
+            if (value is not None):
+                self.extended = (value[0] != 0x00)
+                for session_id in self.sessions:
+                    self.compile(session_id)
+        elif ((uci_command[0], uci_command[1]) == (0x21, 0x03)):
+            session_id = int.from_bytes(bytes(uci_command[4:8]), "little")
+            config = self.sessions.setdefault(session_id, {})
+            config.update(parameter_values(uci_command[9:]))
+            self.compile(session_id)
+
+    def compile(self, session_id):
+        config = self.sessions[session_id]
+        mac_mode = MAC_SHORT if (config.get(MAC_ADDRESS_MODE, b"\x00")[0] == 0x00) else MAC_EXTENDED
+        count = 1
+        if (config.get(MULTI_NODE_MODE, b"\x00")[0] != 0x00):
+            count = config.get(NUMBER_OF_CONTROLEES, b"\x01")[0]
+        self.layouts[session_id] = range_layout(mac_mode, count, self.extended)
+
+    def layout(self, session_id):
+        return self.layouts.get(session_id)
+
+    def decode(self, range_ntf):
+        layout = self.layouts.get(int.from_bytes(range_ntf[4:8], "little"))
+        if ((layout is None) or (not layout.matches(range_ntf))):
+            self.mismatches += 1
+            layout = notification_layout(range_ntf)
+        return layout.decode(range_ntf)
+
+    def report(self):
+        return "Sessions:%d   Mismatches:%d   Layouts:%s" \
+               % (len(self.layouts), self.mismatches,
+                  " ".join("%08x:%r" % (session_id, layout) for session_id, layout in sorted(self.layouts.items())))
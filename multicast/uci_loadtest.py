@@ -0,0 +1,176 @@
+# Load test of the acquisition: frames lost and latency, with and without plotting
+#
+# Runs the virtual device (uci_simulator.py) with a transmit FIFO, so that the rounds
+# not read in time by the host are lost as by the overrun of the UART, and Initiator.py
+# on it for DURATION seconds, for each acquisition (read thread, "acqproc") with and
+# without a plotting load. For each run:
+#   - rounds sent by the device and lost by the overrun of its FIFO
+#   - measurements logged by the script and rounds missing in their seq_cnt
+#   - latency of the frames from their read to their processing (frame queue)
+#   - notifications dropped by the frame queue and the ring of the acquisition process
+# The scripts disable the plots (is_range_plot forced to False): the plotting load is a
+# thread of the process of the script redrawing a figure like the plot loop of
+# start_processing (matplotlib, Agg backend, 4 axes with the distances, AoA and CIR),
+# then waiting 1 ms as plt.pause(0.001). This module starts it and calls main() of the
+# script (uci_loadtest.py PLOTLOAD <script> <arguments of the script>).
+#
+# Arguments: uci_loadtest.py [RATE=1000] [DURATION=10] [FIFO=16384] [CONTROLEES=8] [RFRAME=0] [CIR=0] [SCRIPT=Initiator.py]
+#   Ranging rounds per second of the device
+#   Duration of each run in seconds, from the start of the script
+#   Size in bytes of the transmit buffer of the device
+#   Number of controlees, DBG_RFRAME_LOG_NTF and DBG_CIR0/CIR1_LOG_NTF every N rounds (0: never)
+#   Script tested (multicast RANGE_DATA_NTF logged as "***[seq_cnt]")
+
+import importlib
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Runs: (name, arguments of the script, plotting load)
+RUNS = [("thread", [], False),
+        ("thread + plot", [], True),
+        ("acqproc", ["acqproc"], False),
+        ("acqproc + plot", ["acqproc"], True)]
+
+
+# Redraw a figure until the end of the process, as the plot loop of the scripts
+def plot_load(stats):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    figure, axes = plt.subplots(2, 2)
+    lines = [axes[0][0].plot(np.zeros(100))[0], axes[0][1].plot(np.zeros(100))[0],
+             axes[1][0].plot(np.zeros(100))[0], axes[1][1].plot(np.zeros(1016))[0]]
+    while True:
+        for line in lines:
+            data = np.random.random(len(line.get_ydata()))
+            line.set_ydata(data)
+        for axis in axes.flat:
+            axis.relim()
+            axis.autoscale_view()
+        figure.canvas.draw()
+        stats["redraws"] += 1
+        time.sleep(0.001)
+
+
+def run_script_with_plot_load():
+    script_file = sys.argv[2]
+    sys.argv = [script_file] + sys.argv[3:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script_file)))
+    script = importlib.import_module(os.path.splitext(os.path.basename(script_file))[0])
+
+    stats = {"redraws": 0, "start": time.monotonic()}
+    threading.Thread(target=plot_load, args=(stats,), daemon=True).start()
+    script.main()
+    print("Plot load: %d redraws (%.1f/s)" % (stats["redraws"], stats["redraws"] / (time.monotonic() - stats["start"])))
+
+
+# Value of a statistic in the output ("Name:12.3"), None if missing
+def statistic(text, line_prefix, name):
+    for line in text.splitlines():
+        if (line.startswith(line_prefix)):
+            match = re.search(re.escape(name) + r":\s*([0-9.]+)", line)
+            if (match is not None):
+                return float(match.group(1))
+    return None
+
+
+def run(name, script_args, is_plot, options, directory):
+    here = os.path.dirname(os.path.abspath(__file__))
+    # Port named like a COM port for the script, in the working directory of both
+    link = os.path.join(directory, "COMLOAD")
+    simulator = subprocess.Popen([sys.executable, os.path.join(here, "uci_simulator.py"), "LINK=COMLOAD"] +
+                                 ["%s=%s" % (key, options[key]) for key in ["RATE", "FIFO", "CONTROLEES", "RFRAME", "CIR"]],
+                                 stdout=subprocess.PIPE, text=True, cwd=directory)
+    while (not os.path.lexists(link)):
+        time.sleep(0.05)
+
+    script_file = os.path.join(here, options["SCRIPT"])
+    command = [sys.executable, "-u"]
+    if (is_plot):
+        command += [os.path.abspath(__file__), "PLOTLOAD"]
+    command += [script_file, "COMLOAD", "noplot", "0"] + script_args
+    script = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, cwd=directory)
+
+    # Output read while running, the pipe must not slow down the script
+    output = []
+    reader = threading.Thread(target=lambda: output.append(script.stdout.read()), daemon=True)
+    reader.start()
+
+    time.sleep(options["DURATION"])
+    script.send_signal(signal.SIGINT)
+    try:
+        script.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        script.kill()
+        script.wait()
+    reader.join()
+    simulator.send_signal(signal.SIGTERM)
+    simulator_output = simulator.communicate()[0]
+    text = "".join(output)
+
+    seq_cnts = sorted(set(int(seq) for seq in re.findall(r"^\*\*\*\[(\d+)\]", text, re.M)))
+    lost = (seq_cnts[-1] - seq_cnts[0] + 1 - len(seq_cnts)) if (len(seq_cnts) > 0) else 0
+    result = {"name": name,
+              "rounds": statistic(simulator_output, "Simulator statistics", "Rounds"),
+              "overruns": statistic(simulator_output, "Simulator statistics", "Overruns"),
+              "received": len(seq_cnts),
+              "lost": lost,
+              "latency_avg": statistic(text, "Frame queue statistics", "Latency avg"),
+              "latency_max": statistic(text, "Frame queue statistics", "max"),
+              "queue_dropped": statistic(text, "Frame queue statistics", "Dropped"),
+              "ring_dropped": statistic(text, "Acquisition process statistics", "Dropped"),
+              "redraws": statistic(text, "Plot load", "Plot load")}
+    if ((result["rounds"] is None) or (result["latency_avg"] is None)):
+        print(text[-2000:])
+    return result
+
+
+def main():
+    if ((len(sys.argv) > 2) and (sys.argv[1] == "PLOTLOAD")):
+        run_script_with_plot_load()
+        return
+
+    options = {"RATE": 1000, "DURATION": 10.0, "FIFO": 16384, "CONTROLEES": 8, "RFRAME": 0, "CIR": 0,
+               "SCRIPT": "Initiator.py"}
+    for arg in sys.argv[1:]:
+        name, _, value = arg.partition("=")
+        if (name == "DURATION"):
+            options[name] = float(value)
+        elif (name in ["RATE", "FIFO", "CONTROLEES", "RFRAME", "CIR"]):
+            options[name] = int(value)
+        elif (name == "SCRIPT"):
+            options[name] = value
+        else:
+            print("Unknown argument: " + arg)
+            sys.exit(1)
+
+    print("Rate:%d/s   Duration:%.0f s   FIFO:%d bytes   Controlees:%d   RFrame:%d   CIR:%d   Script:%s"
+          % (options["RATE"], options["DURATION"], options["FIFO"], options["CONTROLEES"], options["RFRAME"],
+             options["CIR"], options["SCRIPT"]))
+    print("%-16s %8s %9s %9s %7s %7s %12s %12s %9s %9s %8s" % ("run", "rounds", "overruns", "received", "lost", "lost %",
+                                                              "latency avg", "latency max", "q.drop", "ring drop", "redraws"))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, script_args, is_plot in RUNS:
+            result = run(name, script_args, is_plot, options, directory)
+            seen = result["received"] + result["lost"]
+            print("%-16s %8s %9s %9d %7d %6.2f%% %9s ms %9s ms %9s %9s %8s"
+                  % (name, "%d" % result["rounds"] if (result["rounds"] is not None) else "-",
+                     "%d" % result["overruns"] if (result["overruns"] is not None) else "-",
+                     result["received"], result["lost"], 100.0 * result["lost"] / max(seen, 1),
+                     "%.3f" % result["latency_avg"] if (result["latency_avg"] is not None) else "-",
+                     "%.3f" % result["latency_max"] if (result["latency_max"] is not None) else "-",
+                     "%d" % result["queue_dropped"] if (result["queue_dropped"] is not None) else "-",
+                     "%d" % result["ring_dropped"] if (result["ring_dropped"] is not None) else "-",
+                     "%d" % result["redraws"] if (result["redraws"] is not None) else "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# Output log of the scripts, written off the read and write threads
+#
+# Frames were logged as hexadecimal bytes formatted one by one with a Python format
+# call while the output lock is held. Instead, the hot threads only queue a copy of
+# the frame with its time (uci_timestamp.py), and a log thread formats the pending
+# frames and times in batches with bytes.hex(" ") (same text as before) and writes
+# each batch at once. The other lines of the output are queued in the same order. The
+# destination of a line (console or IPC file) is chosen when it is queued: flush()
+# must be called before closing a file so that its pending lines are written first.
+#
+# As an alternative to the hex text, frames can be stored in a raw binary log, much
+# smaller on disk: RAW_MAGIC followed by one record per frame (RAW_RECORD: direction,
+# wall-clock time in ns since the epoch or 0, length) followed by the UCI header and payload.
+
+from collections import deque
+from threading import Condition, Thread
+
+import atexit
+import struct
+
+RAW_MAGIC = b"UCIRAW\x00\x01"
+RAW_RECORD = struct.Struct("<BqI")
+
+# Direction of the frames in the raw log
+RAW_RX = 0x00     # Received from the device
+RAW_TX = 0x01     # Sent to the device
+RAW_CACHE = 0x02  # Notification read from the configuration cache
+
+
+# Write lines separated by "\n" to a destination (None for the console)
+def write_lines(destination, text):
+    if (destination is None):
+        print(text)
+    elif (not destination.closed):
+        destination.write(text + "\n")
+
+
+# Line of a frame as written in the text log, after the text of its time if any
+def format_frame(prefix, timestamp, frame):
+    line = prefix + frame.hex(" ") + " "
+    if (timestamp is not None):
+        line = timestamp + line
+    return line
+
+
+class OutputLogStats():
+    def __init__(self):
+        self.lines = 0
+        self.frames = 0
+        self.batches = 0
+        self.max_pending = 0
+        self.lost = 0  # Lines not written (destination closed or failing)
+
+    def report(self):
+        return "Lines:%d   Frames:%d   Batches:%d   Lines/batch:%.1f   Max pending:%d   Lost:%d" \
+               % (self.lines, self.frames, self.batches, self.lines / max(self.batches, 1), self.max_pending, self.lost)
+
+
+class OutputLog():
+    # clock formats the times of the lines (TimestampClock)
+    # write(destination, text) writes lines separated by "\n" to a destination
+    def __init__(self, clock, write=write_lines):
+        self.clock = clock
+        self.write = write
+        self.pending = deque()
+        self.condition = Condition()
+        self.busy = False
+        self.closed = False
+        self.stats = OutputLogStats()
+
+        self.thread = Thread(target=self.run, args=(), daemon=True)
+        self.thread.start()
+
+        # Pending lines are written before the end of the script
+        atexit.register(self.close)
+
+    # Queue a line, or a frame formatted with string as prefix, after the text of its time
+    # (time.monotonic_ns()) if any
+    def put(self, destination, string, frame=None, timestamp=None):
+        with self.condition:
+            self.pending.append((destination, string, frame, timestamp))
+            if (len(self.pending) > self.stats.max_pending):
+                self.stats.max_pending = len(self.pending)
+            self.condition.notify()
+
+    # Wait until the lines queued are written
+    def flush(self):
+        with self.condition:
+            while ((len(self.pending) > 0) or (self.busy)):
+                self.condition.wait()
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while ((len(self.pending) == 0) and (not self.closed)):
+                    self.condition.wait()
+                if (len(self.pending) == 0):
+                    return
+
+                batch = self.pending
+                self.pending = deque()
+                self.busy = True
+
+            try:
+                self.write_batch(batch)
+            finally:
+                # flush() never left waiting, even if the thread ends
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    # Write the lines of a destination, dropped (counted) if it fails: the IPC file may be
+    # closed between the check of write_lines() and the write
+    def write_lines(self, destination, lines):
+        try:
+            self.write(destination, "\n".join(lines))
+        except (ValueError, OSError):
+            self.stats.lost += len(lines)
+
+    def write_batch(self, batch):
+        lines = []
+        destination = batch[0][0]
+        for line_destination, string, frame, timestamp in batch:
+            if (line_destination is not destination):
+                self.write_lines(destination, lines)
+                lines = []
+                destination = line_destination
+
+            if (timestamp is not None):
+                timestamp = self.clock.format(timestamp)
+
+            if (frame is None):
+                lines.append(string if (timestamp is None) else timestamp + string)
+            else:
+                lines.append(format_frame(string, timestamp, frame))
+                self.stats.frames += 1
+
+        self.write_lines(destination, lines)
+        self.stats.lines += len(batch)
+        self.stats.batches += 1
+
+
+class RawFrameLog():
+    # clock converts the times of the frames to wall-clock (TimestampClock)
+    def __init__(self, file_name, clock):
+        self.file_name = file_name
+        self.clock = clock
+        self.file = open(file_name, "wb", buffering=1 << 20)
+        self.file.write(RAW_MAGIC)
+        self.frames = 0
+        self.bytes = len(RAW_MAGIC)
+
+        # Buffered records are written before the end of the script
+        atexit.register(self.close)
+
+    # Store a frame (header and payload) with its direction and time (time.monotonic_ns(),
+    # None if not timestamped)
+    def frame(self, direction, uci_hdr, uci_payload=b"", time_ns=None):
+        length = len(uci_hdr) + len(uci_payload)
+        wall_clock = self.clock.wall_clock(time_ns) if (time_ns is not None) else 0
+        self.file.write(RAW_RECORD.pack(direction, wall_clock, length))
+        self.file.write(uci_hdr)
+        self.file.write(uci_payload)
+        self.frames += 1
+        self.bytes += RAW_RECORD.size + length
+
+    def close(self):
+        self.file.close()
+
+    def report(self):
+        return "File:%s   Frames:%d   Bytes:%d" % (self.file_name, self.frames, self.bytes)
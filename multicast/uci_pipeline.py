@@ -0,0 +1,167 @@
+# Fan-out of the decoded events to the sinks
+#
+# The handlers wrote the CSV rows, opened and wrote the binary files of the CIR and
+# RFrame notifications and updated the data of the plots inline, so a slow sink delayed
+# the processing of all the others. The handlers now publish events of a kind ("csv",
+# "bin", "plot") to the SinkPipeline, which queues them to the sinks registered for this
+# kind. Each sink has its own bounded queue and worker thread, and a policy applied when
+# its queue is full:
+#   SINK_BLOCK        the handler waits for room, nothing is lost (CSV rows, binary files)
+#   SINK_DROP_OLDEST  the oldest event queued is dropped, only the latest state matters (plots)
+#   SINK_SAMPLE       above half of the queue, one event out of "sample" is kept, the new
+#                     event is dropped when the queue is full
+# A sink with SINK_BLOCK only slows down the handlers, never the other sinks. Each sink
+# counts the events received, handled and dropped, its throughput and its lag (time of
+# an event in the queue). The text output (console and IPC files) has its own queue and
+# thread (uci_log.py).
+
+from collections import deque
+from threading import Condition, Thread
+
+import time
+
+SINK_BLOCK = "block"
+SINK_DROP_OLDEST = "drop-oldest"
+SINK_SAMPLE = "sample"
+
+
+class SinkStats():
+    def __init__(self):
+        self.received = 0
+        self.handled = 0
+        self.dropped = 0
+        self.errors = 0
+        self.blocked = 0     # Events for which the handler waited for room
+        self.high_water = 0
+        self.lag_max = 0     # Time in ns of an event in the queue
+        self.lag_sum = 0
+        self.busy = 0        # Time in ns spent handling the events
+        self.start = None
+
+    def report(self, depth):
+        elapsed = (time.monotonic_ns() - self.start) / 1e9 if (self.start is not None) else 0
+        return "Received:%d   Handled:%d   Dropped:%d   Errors:%d   Blocked:%d   Depth:%d   High-water:%d" \
+               "   Events/s:%.1f   Lag avg:%.3f ms   max:%.3f ms   Busy:%.1f %%" \
+               % (self.received, self.handled, self.dropped, self.errors, self.blocked, depth, self.high_water,
+                  self.handled / max(elapsed, 1e-9), self.lag_sum / max(self.handled, 1) / 1e6,
+                  self.lag_max / 1e6, self.busy / max(elapsed * 1e9, 1) * 100)
+
+
+class Sink():
+    # handle(event) is called by the worker thread of the sink for each event
+    def __init__(self, name, handle, capacity=1024, policy=SINK_BLOCK, sample=10):
+        self.name = name
+        self.handle = handle
+        self.capacity = capacity
+        self.policy = policy
+        self.sample = sample
+        self.events = deque()
+        self.condition = Condition()
+        self.busy = False
+        self.closed = False
+        self.skipped = 0
+        self.stats = SinkStats()
+
+        self.thread = Thread(target=self.run, args=(), daemon=True)
+        self.thread.start()
+
+    # Queue an event as allowed by the policy, return False if it is dropped
+    def put(self, event):
+        stats = self.stats
+        with self.condition:
+            if (stats.start is None):
+                stats.start = time.monotonic_ns()
+            stats.received += 1
+            if (self.closed):
+                stats.dropped += 1
+                return False
+
+            if ((self.policy == SINK_SAMPLE) and (len(self.events) >= self.capacity // 2)):
+                self.skipped += 1
+                if (((self.skipped % self.sample) != 0) or (len(self.events) >= self.capacity)):
+                    stats.dropped += 1
+                    return False
+
+            if (len(self.events) >= self.capacity):
+                if (self.policy == SINK_DROP_OLDEST):
+                    self.events.popleft()
+                    stats.dropped += 1
+                else:
+                    stats.blocked += 1
+                    while ((len(self.events) >= self.capacity) and (not self.closed)):
+                        self.condition.wait()
+
+            self.events.append((time.monotonic_ns(), event))
+            if (len(self.events) > stats.high_water):
+                stats.high_water = len(self.events)
+            self.condition.notify_all()
+        return True
+
+    # Wait until the events queued are handled
+    def flush(self):
+        with self.condition:
+            while ((len(self.events) > 0) or (self.busy)):
+                self.condition.wait()
+
+    # Handle the events queued and stop the worker, the next events are dropped
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def run(self):
+        stats = self.stats
+        while True:
+            with self.condition:
+                while ((len(self.events) == 0) and (not self.closed)):
+                    self.condition.wait()
+                if (len(self.events) == 0):
+                    return
+
+                queued, event = self.events.popleft()
+                self.busy = True
+                self.condition.notify_all()
+
+            start = time.monotonic_ns()
+            try:
+                self.handle(event)
+            except Exception:
+                stats.errors += 1
+            end = time.monotonic_ns()
+
+            with self.condition:
+                self.busy = False
+                stats.handled += 1
+                stats.busy += end - start
+                stats.lag_sum += start - queued
+                if (start - queued > stats.lag_max):
+                    stats.lag_max = start - queued
+                self.condition.notify_all()
+
+    def report(self):
+        return self.stats.report(len(self.events))
+
+
+class SinkPipeline():
+    def __init__(self):
+        self.sinks = []
+        self.routes = {}  # Sinks of each kind of event
+
+    def add(self, sink, kinds):
+        self.sinks.append(sink)
+        for kind in kinds:
+            self.routes.setdefault(kind, []).append(sink)
+        return sink
+
+    # Queue an event to the sinks of its kind (nothing done without sink)
+    def publish(self, kind, event):
+        for sink in self.routes.get(kind, ()):
+            sink.put(event)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def report(self):
+        return [sink.name + " (" + sink.policy + ")   " + sink.report() for sink in self.sinks]
@@ -0,0 +1,153 @@
+# Fixed-point conversions (Qm.n, signed or unsigned) of scalars, numpy arrays and buffers
+#
+# convert_qformat_to_float() and twos_comp() computed the two's complement, the division
+# and round() for each angle and PDoA of each measurement. A QFormat of 16 bits or less
+# decodes with a lookup table of its raw values per number of decimals (round() of each
+# value, so the results are the same as convert_qformat_to_float): one index for a
+# scalar, one take() for a numpy array or a buffer of little-endian values. The table
+# of the scalars is filled as the raw values are met (building all of it would delay
+# the first measurement), the table of the arrays is complete. Wider formats are
+# computed. Floats are encoded to the nearest raw value, saturated to the range of the
+# format, to build calibration tables and configuration parameters:
+#   Q9_7.to_bytes(-8.98) -> b"\x83\xfb" (RX_ANTENNA_PAIR 1 of PDOA_MANUFACT_ZERO_OFFSET_CALIB)
+# numpy is only imported by the conversions of arrays and buffers.
+
+from itertools import chain, repeat
+
+# Widest format decoded with a lookup table
+TABLE_BITS = 16
+
+
+# Signed value of the two's complement val of the width of bits
+def twos_comp(val, bits):
+    if (val & (1 << (bits - 1))) != 0:  # If sign bit is set
+        val = val - (1 << bits)  # Compute negative value
+    return val
+
+
+class QFormat():
+    def __init__(self, n_ints, n_fracs, signed=True):
+        self.n_ints = n_ints
+        self.n_fracs = n_fracs
+        self.signed = signed
+        self.bits = n_ints + n_fracs
+        self.mask = (1 << self.bits) - 1
+        self.scale = float(1 << n_fracs)
+        if (signed):
+            self.min_raw = -(1 << (self.bits - 1))
+            self.max_raw = (1 << (self.bits - 1)) - 1
+        else:
+            self.min_raw = 0
+            self.max_raw = self.mask
+        self.size = (self.bits + 7) // 8  # Bytes of a value in a buffer
+        self.tables = {}  # Values of the raw values met per number of decimals (None if not yet)
+        self.arrays = {}  # Values of all the raw values per number of decimals (numpy arrays)
+
+    def __repr__(self):
+        return "%sQ%d.%d" % ("" if (self.signed) else "U", self.n_ints, self.n_fracs)
+
+    # Integer value of the bits of a raw value
+    def integer(self, raw):
+        raw &= self.mask
+        if (self.signed):
+            return twos_comp(raw, self.bits)
+        return raw
+
+    # Float of a raw value, computed
+    def compute(self, raw, round_of=None):
+        value = self.integer(raw) / self.scale
+        if (round_of is not None):
+            value = round(value, round_of)
+        return value
+
+    # Values of all the raw values, rounded to round_of decimals (not if None)
+    def table(self, round_of=None):
+        if (self.signed):
+            integers = chain(range(0, self.max_raw + 1), range(self.min_raw, 0))
+        else:
+            integers = range(0, self.max_raw + 1)
+        values = [integer / self.scale for integer in integers]
+        if (round_of is not None):
+            values = list(map(round, values, repeat(round_of)))
+        return values
+
+    # Float of a raw value
+    def to_float(self, raw, round_of=None):
+        if (self.bits > TABLE_BITS):
+            return self.compute(raw, round_of)
+
+        table = self.tables.get(round_of)
+        if (table is None):
+            table = [None] * (1 << self.bits)
+            self.tables[round_of] = table
+        raw &= self.mask
+        value = table[raw]
+        if (value is None):
+            value = self.compute(raw, round_of)
+            table[raw] = value
+        return value
+
+    # Raw value (bits of the format) nearest to a float, saturated
+    def from_float(self, value):
+        raw = min(max(round(value * self.scale), self.min_raw), self.max_raw)
+        return raw & self.mask
+
+    def to_bytes(self, value):
+        return self.from_float(value).to_bytes(self.size, "little")
+
+    # Floats of a numpy array of raw values (any integer type, signed values accepted)
+    def to_float_array(self, raw, round_of=None):
+        import numpy as np
+
+        raw = np.asarray(raw).astype(np.int64) & self.mask
+        if (self.bits <= TABLE_BITS):
+            array = self.arrays.get(round_of)
+            if (array is None):
+                array = np.array(self.table(round_of), dtype=np.float64)
+                self.arrays[round_of] = array
+            return array.take(raw)
+
+        if (self.signed):
+            raw = raw - ((raw >> (self.bits - 1)) << self.bits)
+        values = raw / self.scale
+        if (round_of is not None):
+            values = np.round(values, round_of)
+        return values
+
+    # Floats of the little-endian raw values of a buffer (formats of 8, 16, 32 or 64 bits)
+    def decode(self, data, offset=0, count=-1, round_of=None):
+        import numpy as np
+
+        if (self.size * 8 != self.bits):
+            raise ValueError("%r values are not byte-aligned" % self)
+        if (count < 0):
+            count = (len(data) - offset) // self.size
+        return self.to_float_array(np.frombuffer(data, dtype="<u%d" % self.size, count=count, offset=offset), round_of)
+
+    # Raw values (unsigned, bits of the format) nearest to an array of floats, saturated
+    def from_float_array(self, values):
+        import numpy as np
+
+        raw = np.clip(np.round(np.asarray(values, dtype=np.float64) * self.scale), self.min_raw, self.max_raw)
+        return raw.astype(np.int64) & self.mask
+
+    # Little-endian buffer of the raw values of an array of floats
+    def encode(self, values):
+        return self.from_float_array(values).astype("<u%d" % self.size).tobytes()
+
+
+# Formats created once, shared by the scripts and the decoders
+FORMATS = {}
+
+
+def qformat(n_ints, n_fracs, signed=True):
+    key = (n_ints, n_fracs, signed)
+    fmt = FORMATS.get(key)
+    if (fmt is None):
+        fmt = QFormat(n_ints, n_fracs, signed)
+        FORMATS[key] = fmt
+    return fmt
+
+
+# Angles and PDoA of the measurements, PDoA calibrations
+Q9_7 = qformat(9, 7)
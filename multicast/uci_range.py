@@ -0,0 +1,221 @@
+# Vectorized decode of the multicast RANGE_DATA_NTF
+#
+# The handler of the scripts walks the measurements of a round one at a time (31-byte
+# stride, fields shifted by hand, convert_qformat_to_float per angle). Here the header and
+# the measurement record are numpy structured dtypes: one np.frombuffer call decodes all
+# the controlees of a round, or the rounds of a whole log joined together, into columns
+# (one array per field, one row per measurement). The status mask, the sign of the
+# distances with the status 0x1B (negative distance) and the Q9.7 angles are computed
+# on the columns. Only the short MAC address layout (MAC addressing mode 0) is decoded.
+# The NXP extended data following the measurements (NXP_EXTENDED_NTF_CONFIG enabled)
+# is decoded the same way into columns of the measurements: RSSI of both RX, PDoA and
+# PDoA index of both antenna pairs, RX mode and antennas of the round. The rounds
+# without extended data have NaN RSSI and PDoA, 0 for the integer fields and False in
+# the "extended" column. The PDoA index of the second antenna pair of the last measurement
+# may be missing (0 then), as decoded by the Responder and uci_layout.py.
+#
+# Arguments: uci_range.py <log_file> [CSV=<file>]
+#   Output log, raw binary log or capture of the scripts (see uci_replay.py)
+#   File of the measurements decoded (one line per measurement)
+
+import sys
+
+import numpy as np
+
+from uci_layout import RSSI
+from uci_qformat import Q9_7
+from uci_replay import LogReplay
+from uci_segment import SegmentBuffer, RANGE_DATA_MAX_SIZE
+
+# Header: sequence counter, session ID, RCR indication, current ranging interval, ranging
+# measurement type, RFU, MAC addressing mode, RFU, number of measurements
+RANGE_DATA_HEADER = np.dtype([("seq_cnt", "<u4"), ("session_id", "<u4"), ("rcr", "u1"), ("interval", "<u4"),
+                              ("measurement_type", "u1"), ("rfu0", "u1"), ("mac_mode", "u1"), ("rfu1", "V8"),
+                              ("nb_measurements", "u1")])
+
+# Measurement with short MAC address: MAC address, status, NLoS, distance, AoA azimuth
+# and FOM, AoA elevation and FOM, destination AoA azimuth and FOM, destination AoA
+# elevation and FOM, slot index, RFU
+MULTICAST_MEASUREMENT = np.dtype([("address", "<u2"), ("status", "u1"), ("nlos", "u1"), ("distance", "<u2"),
+                                  ("azimuth", "<i2"), ("azimuth_fom", "u1"), ("elevation", "<i2"),
+                                  ("elevation_fom", "u1"), ("dest_azimuth", "<i2"), ("dest_azimuth_fom", "u1"),
+                                  ("dest_elevation", "<i2"), ("dest_elevation_fom", "u1"), ("slot", "u1"),
+                                  ("rfu", "V12")])
+
+# NXP extended data: length, data type, RX mode, number of RX antennas, RX antenna info,
+# then per measurement RSSI RX1 and RX2, PDoA and PDoA index of both antenna pairs
+NXP_EXTENDED_HEADER = np.dtype([("length", "<u2"), ("data_type", "u1"), ("rx_mode", "u1"), ("rx_antennas", "u1"),
+                                ("rx_antenna_info", "u1")])
+NXP_EXTENDED_MEASUREMENT = np.dtype([("rssi1", "<i2"), ("rssi2", "<i2"), ("pdoa1", "<i2"), ("pdoa1_index", "<u2"),
+                                     ("pdoa2", "<i2"), ("pdoa2_index", "<u2")])
+
+# Bytes of the extended data of the last measurement which may be missing (PDoA index)
+NXP_EXTENDED_OPTIONAL_SIZE = 2
+
+STATUS_OK = 0x00
+STATUS_NEGATIVE_DISTANCE = 0x1B
+
+# Angles in Q9.7, rounded to 1 decimal as by the handlers
+ANGLES = ["azimuth", "elevation", "dest_azimuth", "dest_elevation"]
+
+# Columns of the NXP extended data of the round of each measurement
+EXTENDED_ROUND = ["rx_mode", "rx_antennas", "rx_antenna_info"]
+
+# Columns written to the CSV: name and format
+CSV_COLUMNS = [("seq_cnt", "%d"), ("index", "%d"), ("address", "%x"), ("status", "%d"), ("nlos", "%d"),
+               ("distance", "%d"), ("azimuth", "%.1f"), ("azimuth_fom", "%d"), ("elevation", "%.1f"),
+               ("elevation_fom", "%d"), ("rssi1", "%.1f"), ("rssi2", "%.1f"), ("pdoa1", "%.2f"), ("pdoa2", "%.2f")]
+
+
+# Number of complete measurements of a RANGE_DATA_NTF, 0 if not decoded
+def measurement_count(range_ntf):
+    if ((len(range_ntf) < RANGE_DATA_HEADER.itemsize) or (range_ntf[15] != 0x00)):
+        return 0
+    available = (len(range_ntf) - RANGE_DATA_HEADER.itemsize) // MULTICAST_MEASUREMENT.itemsize
+    return min(range_ntf[24], available)
+
+
+# Offset of the NXP extended data of a RANGE_DATA_NTF of count measurements, None if none
+def extended_offset(range_ntf, count):
+    offset = RANGE_DATA_HEADER.itemsize + count * MULTICAST_MEASUREMENT.itemsize
+    if ((count == 0) or (len(range_ntf) < offset + NXP_EXTENDED_HEADER.itemsize + count * NXP_EXTENDED_MEASUREMENT.itemsize
+                                          - NXP_EXTENDED_OPTIONAL_SIZE)):
+        return None
+    return offset
+
+
+# Extended headers and records of a batch of RANGE_DATA_NTF (zeros for a round without)
+def extended_data(range_ntfs, counts):
+    headers = []
+    records = []
+    for range_ntf, count in zip(range_ntfs, counts):
+        offset = extended_offset(range_ntf, count)
+        size = count * NXP_EXTENDED_MEASUREMENT.itemsize
+        if (offset is None):
+            headers.append(bytes(NXP_EXTENDED_HEADER.itemsize))
+            records.append(bytes(size))
+        else:
+            offset += NXP_EXTENDED_HEADER.itemsize
+            headers.append(range_ntf[offset - NXP_EXTENDED_HEADER.itemsize:offset])
+            record = range_ntf[offset:offset + size]
+            records.append(bytes(record) + bytes(size - len(record)))
+    return (np.frombuffer(b"".join(headers), dtype=NXP_EXTENDED_HEADER),
+            np.frombuffer(b"".join(records), dtype=NXP_EXTENDED_MEASUREMENT))
+
+
+# Columns of measurement records: seq_cnt of their round and index in the round added,
+# with the NXP extended data of the rounds (present: rounds with extended data)
+def decode_measurements(records, seq_cnts, counts, headers, extended, present):
+    columns = {name: records[name] for name in MULTICAST_MEASUREMENT.names if (name != "rfu")}
+    columns["seq_cnt"] = np.repeat(seq_cnts, counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    columns["index"] = np.arange(len(records)) - starts
+
+    status = columns["status"]
+    columns["valid"] = (status == STATUS_OK) | (status == STATUS_NEGATIVE_DISTANCE)
+    distance = columns["distance"].astype(np.int32)
+    columns["distance"] = np.where(status == STATUS_NEGATIVE_DISTANCE, -distance, distance)
+    for name in ANGLES:
+        columns[name] = Q9_7.to_float_array(columns[name], 1)
+
+    columns["extended"] = np.repeat(present, counts)
+    for name in ["rssi1", "rssi2"]:
+        columns[name] = np.where(columns["extended"], RSSI.to_float_array(extended[name], 1), np.nan)
+    for name in ["pdoa1", "pdoa2"]:
+        columns[name] = np.where(columns["extended"], Q9_7.to_float_array(extended[name], 7), np.nan)
+    for name in ["pdoa1_index", "pdoa2_index"]:
+        columns[name] = extended[name]
+    for name in EXTENDED_ROUND:
+        columns[name] = np.repeat(headers[name], counts)
+    return columns
+
+
+# Columns of the measurements of a RANGE_DATA_NTF
+def decode_range_data(range_ntf):
+    count = measurement_count(range_ntf)
+    records = np.frombuffer(range_ntf, dtype=MULTICAST_MEASUREMENT, count=count, offset=RANGE_DATA_HEADER.itemsize)
+    seq_cnt = int.from_bytes(range_ntf[0:4], "little")
+    headers, extended = extended_data([range_ntf], [count])
+    present = np.array([extended_offset(range_ntf, count) is not None])
+    return decode_measurements(records, np.array([seq_cnt], dtype=np.uint32), np.array([count]), headers, extended,
+                               present)
+
+
+# Columns of the measurements of a batch of RANGE_DATA_NTF (rounds of another layout skipped)
+def decode_range_data_batch(range_ntfs):
+    counts = np.array([measurement_count(range_ntf) for range_ntf in range_ntfs], dtype=np.int64)
+    seq_cnts = np.array([int.from_bytes(range_ntf[0:4], "little") for range_ntf in range_ntfs], dtype=np.uint32)
+    size = MULTICAST_MEASUREMENT.itemsize
+    records = np.frombuffer(b"".join(range_ntf[RANGE_DATA_HEADER.itemsize:RANGE_DATA_HEADER.itemsize + count * size]
+                                     for range_ntf, count in zip(range_ntfs, counts)), dtype=MULTICAST_MEASUREMENT)
+    headers, extended = extended_data(range_ntfs, counts)
+    present = np.array([extended_offset(range_ntf, count) is not None for range_ntf, count in zip(range_ntfs, counts)],
+                       dtype=bool)
+    return decode_measurements(records, seq_cnts, counts, headers, extended, present)
+
+
+# Complete RANGE_DATA_NTF payloads received in a log
+def read_range_data(file_name):
+    range_data = SegmentBuffer(RANGE_DATA_MAX_SIZE)
+    range_ntfs = []
+    for timestamp, uci_hdr, uci_payload in LogReplay(file_name, 0).frames():
+        if (((uci_hdr[0] & 0xEF) != 0x62) or ((uci_hdr[1] & 0x3F) != 0x00)):
+            continue
+        if ((uci_hdr[0] & 0x10) != 0):
+            range_data.append(uci_payload)
+        else:
+            range_ntfs.append(bytes(range_data.complete(uci_payload)))
+    return range_ntfs
+
+
+def main():
+    if ((len(sys.argv) < 2) or ("=" in sys.argv[1])):
+        print("Usage: uci_range.py <log_file> [CSV=<file>]")
+        sys.exit(1)
+
+    csv_file = None
+    for arg in sys.argv[2:]:
+        name, _, value = arg.partition("=")
+        if (name == "CSV"):
+            csv_file = value
+        else:
+            print("Unknown argument: " + arg)
+            sys.exit(1)
+
+    range_ntfs = read_range_data(sys.argv[1])
+    columns = decode_range_data_batch(range_ntfs)
+    print("Rounds:%d   Measurements:%d   Valid:%d   NXP extended:%d" % (len(range_ntfs), len(columns["valid"]),
+                                                                      np.count_nonzero(columns["valid"]),
+                                                                      np.count_nonzero(columns["extended"])))
+
+    # Statistics of the valid measurements of each controlee
+    for address in np.unique(columns["address"]):
+        rows = (columns["address"] == address)
+        valid = rows & columns["valid"]
+        if (np.count_nonzero(valid) == 0):
+            print("Address:%04x   Measurements:%d   Valid:0" % (address, np.count_nonzero(rows)))
+            continue
+        distance = columns["distance"][valid]
+        line = ("Address:%04x   Measurements:%d   Valid:%d   Distance avg:%.1f   std:%.1f   min:%d   max:%d"
+                "   Azimuth avg:%.1f   Elevation avg:%.1f"
+                % (address, np.count_nonzero(rows), np.count_nonzero(valid), distance.mean(), distance.std(),
+                   distance.min(), distance.max(), columns["azimuth"][valid].mean(), columns["elevation"][valid].mean()))
+        extended = valid & columns["extended"]
+        if (np.count_nonzero(extended) > 0):
+            line += ("   PDoA1 avg:%.2f   PDoA2 avg:%.2f   RSSI1 avg:%.1f   RSSI2 avg:%.1f"
+                     % (columns["pdoa1"][extended].mean(), columns["pdoa2"][extended].mean(),
+                        columns["rssi1"][extended].mean(), columns["rssi2"][extended].mean()))
+        print(line)
+
+    if (csv_file is not None):
+        # Object array to keep the integer columns formatted as integers
+        rows = np.empty((len(columns["valid"]), len(CSV_COLUMNS)), dtype=object)
+        for idx, (name, fmt) in enumerate(CSV_COLUMNS):
+            rows[:, idx] = columns[name]
+        np.savetxt(csv_file, rows, fmt=[fmt for name, fmt in CSV_COLUMNS], delimiter=",",
+                   header=",".join(name for name, fmt in CSV_COLUMNS), comments="")
+        print("Measurements written to " + csv_file)
+
+
+if __name__ == "__main__":
+    main()
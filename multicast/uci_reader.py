@@ -0,0 +1,137 @@
+# Bulk reader of UCI frames from the serial port
+#
+# Instead of one blocking read for the 4-byte header and one for the payload of each
+# frame, everything available on the port is drained in a single read into a
+# preallocated buffer and complete frames are then extracted incrementally.
+# Bytes of a partially received frame stay in the buffer until the next read.
+# The payload is returned as a memoryview on the buffer, valid until the next read_frame().
+# time_ns is the time (time.monotonic_ns()) of the read of the bytes of the last frame.
+
+import time
+
+# Size of the UCI header (MT/PBF/GID, OID, RFU or extended length, length)
+UCI_HDR_SIZE = 4
+
+# Largest UCI frame (extended length is coded on 16 bits)
+UCI_MAX_FRAME_SIZE = UCI_HDR_SIZE + 0xFFFF
+
+
+def uci_payload_length(buffer, offset=0):
+    # Payload length from the header starting at offset
+    if (buffer[offset + 1] & 0x80) == 0x80:
+        # Extended length
+        return int((buffer[offset + 3] << 8) + buffer[offset + 2])
+    return buffer[offset + 3]
+
+
+class ReadStats():
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.syscalls = 0
+        self.start = time.monotonic()
+
+    def frames_per_sec(self):
+        elapsed = time.monotonic() - self.start
+        if (elapsed <= 0):
+            return 0.0
+        return self.frames / elapsed
+
+    def syscalls_per_frame(self):
+        if (self.frames == 0):
+            return 0.0
+        return self.syscalls / self.frames
+
+    def report(self):
+        return "Frames:%d   Bytes:%d   Frames/s:%.1f   Syscalls/frame:%.2f" \
+               % (self.frames, self.bytes, self.frames_per_sec(), self.syscalls_per_frame())
+
+
+class UciFrameReader():
+    # bulk = False keeps the former header then payload read for comparison
+    def __init__(self, port, size=2 * UCI_MAX_FRAME_SIZE, bulk=True):
+        self.port = port
+        self.bulk = bulk
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Start of the first frame not yet extracted
+        self.end = 0    # End of the bytes received
+        self.time_ns = 0
+        self.stats = ReadStats()
+
+    # Return header and payload of the next UCI frame
+    # Header is shorter than UCI_HDR_SIZE if nothing was received before the port timeout
+    def read_frame(self):
+        if (not self.bulk):
+            return self.read_frame_direct()
+
+        frame = self.extract_frame()
+        while (frame is None):
+            if (self.fill() == 0):
+                # Port timeout: the partial frame stays in the buffer
+                return (b"", b"")
+            frame = self.extract_frame()
+
+        return frame
+
+    def read_frame_direct(self):
+        uci_hdr = self.port.read(UCI_HDR_SIZE)  # Read header of UCI frame
+        self.time_ns = time.monotonic_ns()
+        self.stats.syscalls += 1
+
+        if (len(uci_hdr) != UCI_HDR_SIZE):
+            return (uci_hdr, b"")
+
+        uci_payload = b""
+        count = uci_payload_length(uci_hdr)
+        if (count > 0):
+            uci_payload = self.port.read(count)  # Read payload of UCI frame
+            self.stats.syscalls += 1
+
+        self.stats.frames += 1
+        self.stats.bytes += UCI_HDR_SIZE + len(uci_payload)
+        return (uci_hdr, uci_payload)
+
+    def extract_frame(self):
+        start = self.start
+        available = self.end - start
+
+        if (available < UCI_HDR_SIZE):
+            return None
+
+        size = UCI_HDR_SIZE + uci_payload_length(self.buffer, start)
+        if (available < size):
+            return None
+
+        uci_hdr = bytes(self.buffer[start:start + UCI_HDR_SIZE])
+        uci_payload = self.view[start + UCI_HDR_SIZE:start + size]
+
+        self.start = start + size
+        if (self.start == self.end):
+            # Buffer fully consumed
+            self.start = 0
+            self.end = 0
+
+        self.stats.frames += 1
+        self.stats.bytes += size
+        return (uci_hdr, uci_payload)
+
+    def fill(self):
+        if (len(self.buffer) - self.end < UCI_MAX_FRAME_SIZE):
+            # Move the partial frame to the beginning of the buffer
+            pending = self.end - self.start
+            self.view[0:pending] = self.buffer[self.start:self.end]
+            self.start = 0
+            self.end = pending
+
+        # Drain everything available, or block until the first byte or the port timeout
+        waiting = self.port.in_waiting
+        size = min(max(waiting, 1), len(self.buffer) - self.end)
+        data = self.port.read(size)
+        if (len(data) > 0):
+            self.time_ns = time.monotonic_ns()
+        self.stats.syscalls += 2
+
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        return len(data)
@@ -0,0 +1,170 @@
+# Replay of the frames recorded in the logs of the scripts
+#
+# Lines "NXPUCIR <= xx xx ..." of the output log or of the IPC files, with or without
+# the ISO timestamp prefix, are parsed back into frames (header, payload) and handed
+# to the same processing as the frames read from the serial port. Frames are replayed
+# at the original timing (speed 1), at a scaled rate (speed 10: ten times faster) or
+# as fast as possible (speed 0). Logs without timestamps are always replayed as fast
+# as possible. The file is read line by line, so large captures are not loaded.
+# Raw binary logs (uci_log.py, RAWLOG argument of the scripts) and captures (uci_capture.py,
+# CAPTURE argument) are replayed the same way. The commands sent ("NXPUCIX => " lines,
+# records sent) are not replayed, they are passed in order to an optional callback (the
+# configuration of the range data decoder).
+
+from datetime import datetime
+
+import time
+
+from uci_log import RAW_MAGIC, RAW_RECORD, RAW_RX, RAW_TX
+from uci_capture import CAPTURE_MAGIC, CaptureReader
+
+# Prefix of the frames received from the device (lines of the commands and of the
+# notifications read from the configuration cache are skipped)
+RECEIVED_FRAME = "NXPUCIR <= "
+
+# Prefix of the commands sent to the device
+SENT_COMMAND = "NXPUCIX => "
+
+
+class ReplayStats():
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.commands = 0
+        self.invalid = 0
+        self.first = None  # Timestamps of the first and last frames in the log
+        self.last = None
+        self.start = None
+        self.end = None
+
+    def report(self):
+        string = "Frames:%d   Bytes:%d   Commands:%d   Invalid lines:%d" % (self.frames, self.bytes, self.commands, self.invalid)
+        if ((self.start is not None) and (self.end is not None)):
+            elapsed = self.end - self.start
+            string += "   Replay:%.3f s   Frames/s:%.1f" % (elapsed, self.frames / max(elapsed, 1e-9))
+            if ((self.first is not None) and (self.last is not None)):
+                duration = (self.last - self.first).total_seconds()
+                string += "   Log duration:%.3f s (x%.1f)" % (duration, duration / max(elapsed, 1e-9))
+        return string
+
+
+# Return (timestamp, header, payload) of a received frame line, None for other lines
+# (timestamp is None without prefix), raise ValueError if the frame is invalid
+def parse_line(line):
+    idx = line.find(RECEIVED_FRAME)
+    if (idx < 0):
+        return None
+
+    timestamp = None
+    if (idx > 0):
+        timestamp = datetime.fromisoformat(line[0:idx])
+
+    frame = bytes.fromhex(line[idx + len(RECEIVED_FRAME):])
+    if (len(frame) < 4):
+        raise ValueError("UCI frame shorter than its header")
+    return (timestamp, frame[0:4], frame[4:])
+
+
+# Return the command of a sent command line, None for other lines, raise ValueError if
+# it is invalid
+def parse_command(line):
+    idx = line.find(SENT_COMMAND)
+    if (idx < 0):
+        return None
+    return bytes.fromhex(line[idx + len(SENT_COMMAND):])
+
+
+class LogReplay():
+    # on_command(uci_command) is called for each command sent in the log
+    def __init__(self, file_name, speed=1.0, on_command=None):
+        self.file_name = file_name
+        self.speed = speed
+        self.on_command = on_command
+        self.stats = ReplayStats()
+
+    def command(self, uci_command):
+        self.stats.commands += 1
+        if (self.on_command is not None):
+            self.on_command(uci_command)
+
+    # Frames of the log: (timestamp, header, payload)
+    def frames(self):
+        with open(self.file_name, "rb") as log_file:
+            magic = log_file.read(len(RAW_MAGIC))
+        if (magic == RAW_MAGIC):
+            yield from self.raw_frames()
+            return
+        if (magic == CAPTURE_MAGIC):
+            reader = CaptureReader(self.file_name)
+            try:
+                for offset, time_ns, direction, uci_hdr, uci_payload in reader.records():
+                    if (direction == RAW_RX):
+                        yield (reader.wall_clock(time_ns), uci_hdr, uci_payload)
+                    elif (direction == RAW_TX):
+                        self.command(uci_hdr + uci_payload)
+            finally:
+                reader.close()
+            return
+
+        with open(self.file_name, "r", errors="replace") as log_file:
+            for line in log_file:
+                try:
+                    frame = parse_line(line)
+                    if (frame is None):
+                        uci_command = parse_command(line)
+                        if (uci_command is not None):
+                            self.command(uci_command)
+                except ValueError:
+                    self.stats.invalid += 1
+                    continue
+
+                if (frame is not None):
+                    yield frame
+
+    # Frames received of a raw binary log
+    def raw_frames(self):
+        with open(self.file_name, "rb") as log_file:
+            log_file.seek(len(RAW_MAGIC))
+            while True:
+                record = log_file.read(RAW_RECORD.size)
+                if (len(record) < RAW_RECORD.size):
+                    break
+                direction, time_ns, length = RAW_RECORD.unpack(record)
+                frame = log_file.read(length)
+                if ((len(frame) < length) or (length < 4)):
+                    self.stats.invalid += 1
+                    break
+
+                if (direction == RAW_RX):
+                    timestamp = datetime.fromtimestamp(time_ns / 1e9) if (time_ns != 0) else None
+                    yield (timestamp, frame[0:4], frame[4:])
+                elif (direction == RAW_TX):
+                    self.command(frame)
+
+    # Call process(uci_hdr, uci_payload) for each frame of the log, until the end of the
+    # log or stop() returns True
+    def run(self, process, stop=lambda: False):
+        stats = self.stats
+        stats.start = time.perf_counter()
+
+        for timestamp, uci_hdr, uci_payload in self.frames():
+            if (stop()):
+                break
+
+            if (timestamp is not None):
+                if (stats.first is None):
+                    stats.first = timestamp
+                stats.last = timestamp
+
+                if (self.speed > 0):
+                    # Original timing scaled by the speed
+                    delay = (timestamp - stats.first).total_seconds() / self.speed - \
+                            (time.perf_counter() - stats.start)
+                    if (delay > 0):
+                        time.sleep(delay)
+
+            process(uci_hdr, uci_payload)
+            stats.frames += 1
+            stats.bytes += len(uci_hdr) + len(uci_payload)
+
+        stats.end = time.perf_counter()
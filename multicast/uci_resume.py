@@ -0,0 +1,106 @@
+# Resume of the ranging session kept by the device when the script is restarted
+#
+# Without UWB_RESET_DEVICE the device keeps its configuration and the session opened by
+# the previous run. The state of the session is read with SESSION_GET_STATE and given to
+# the session states as a SESSION_STATUS_NTF would be. If the session is ACTIVE or IDLE:
+#   - the reset, the session init, the OTP reads and the calibrations are not sent
+#   - configuration commands are read back (CORE_GET_CONFIG, SESSION_GET_APP_CONFIG) and
+#     only the ones which drifted are applied again, after stopping the ranging if the
+#     session is active
+#   - the ranging is started only if the session is not active anymore
+# Otherwise the full bring-up is done.
+
+from uci_coalesce import PARAMETERS_OFFSET, parameter_ids
+from uci_config_cache import core_get_config
+
+SESSION_STATES = {
+    0x00: "INIT",
+    0x01: "DEINIT",
+    0x02: "ACTIVE",
+    0x03: "IDLE",
+}
+
+# Commands of the bring-up kept by the device while it is not reset:
+# SET_BOARD_VARIANT, RESET_DEVICE, SESSION_INIT, SET_CALIBRATION and OTP reads
+RESUME_SKIPPED = [(0x2E, 0x00), (0x20, 0x00), (0x21, 0x00), (0x2E, 0x11), (0x2A, 0x01)]
+
+
+# Build the SESSION_GET_APP_CONFIG command reading back the parameters of a SESSION_SET_APP_CONFIG
+def session_get_app_config(session_set_app_config):
+    ids = parameter_ids(session_set_app_config[9:])
+    payload = list(session_set_app_config[4:8]) + [len(ids)] + list(b"".join(ids))
+    return [0x21, 0x04, 0x00, len(payload)] + payload
+
+
+class UciSessionResume():
+    # execute(uci_command) sends a command and returns its CommandResult
+    # on_state(state) updates the session states as a SESSION_STATUS_NTF
+    # range_stop: RANGE_STOP of the session, sent before applying again its configuration
+    def __init__(self, execute, on_state, range_stop):
+        self.execute = execute
+        self.on_state = on_state
+        self.range_stop = range_stop
+        self.session_id = list(range_stop[4:8])
+        self.state = None
+        self.resumed = None  # Unknown until the device is probed
+        self.skipped = 0
+        self.reapplied = 0
+
+    def probe(self):
+        result = self.execute([0x21, 0x06, 0x00, 0x04] + self.session_id)  # SESSION_GET_STATE
+        if (result.is_ok() and (len(result.payload) > 1)):
+            self.state = result.payload[1]
+
+        self.resumed = (self.state in [0x02, 0x03])
+        if (self.resumed):
+            self.on_state(self.state)
+
+    # Return True if the device holds the parameters set by a configuration command
+    def read_back(self, uci_command):
+        offset = PARAMETERS_OFFSET[(uci_command[0], uci_command[1])]
+        if (uci_command[0] == 0x20):
+            result = self.execute(core_get_config(uci_command))
+        else:
+            result = self.execute(session_get_app_config(uci_command))
+        return (result.is_ok() and (result.payload[1:] == bytes(uci_command[offset:])))
+
+    # Return True if the command does not need to be sent
+    def skip(self, uci_command):
+        if (self.resumed is None):
+            self.probe()
+
+        if (not self.resumed):
+            return False
+
+        key = (uci_command[0], uci_command[1])
+        if (key in RESUME_SKIPPED):
+            self.skipped += 1
+            return True
+
+        if (key in PARAMETERS_OFFSET):
+            if (self.read_back(uci_command)):
+                self.skipped += 1
+                return True
+
+            if ((key == (0x21, 0x03)) and (self.state == 0x02)):
+                # Application configuration is changed with the ranging stopped
+                self.execute(self.range_stop)
+                self.state = 0x03
+            self.reapplied += 1
+            return False
+
+        if ((key == (0x22, 0x00)) and (self.state == 0x02)):
+            # Ranging still active
+            self.skipped += 1
+            return True
+
+        return False
+
+    def report(self):
+        if (self.resumed is None):
+            return "Device not probed"
+
+        string = "Session:%s   Resumed:%s" % (SESSION_STATES.get(self.state, "NONE"), str(self.resumed))
+        if (self.resumed):
+            string += "   Skipped:%d commands   Reapplied:%d configurations" % (self.skipped, self.reapplied)
+        return string
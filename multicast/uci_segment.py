@@ -0,0 +1,55 @@
+# Reassembly of segmented UCI notifications (PBF = 1 segments followed by PBF = 0)
+#
+# Segments are copied once into a buffer preallocated to the maximum size of the
+# notification and the complete payload is handed over as a memoryview, so that
+# handlers slice it without creating new bytes objects.
+# A notification received in a single frame is handed over without any copy.
+# The returned memoryview is only valid until the next segment is appended.
+
+# RANGE_DATA_NTF: 25 bytes of header + 31 bytes per controlee (8 max) + NXP extended data
+RANGE_DATA_MAX_SIZE = 0x800
+
+# DBG_RFRAME_LOG_NTF: Session ID, number of measurements and up to 255 measurements
+# of 27 bytes of info and 64 bytes of CIR samples
+RFRAME_LOG_MAX_SIZE = 5 + 0xFF * (27 + 64)
+
+# DBG_CIR0_LOG_NTF and DBG_CIR1_LOG_NTF
+CIR_LOG_MAX_SIZE = 0x10000
+
+
+class SegmentBuffer():
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+
+    def is_empty(self):
+        return (self.length == 0)
+
+    # Store a segment received with PBF = 1
+    def append(self, payload):
+        end = self.length + len(payload)
+
+        if (end > len(self.buffer)):
+            # Larger than expected: grow the buffer (views already given remain valid)
+            buffer = bytearray(max(end, 2 * len(self.buffer)))
+            buffer[0:self.length] = self.view[0:self.length]
+            self.buffer = buffer
+            self.view = memoryview(self.buffer)
+
+        self.view[self.length:end] = payload
+        self.length = end
+
+    # Store the last segment received with PBF = 0 and return the complete payload
+    def complete(self, payload):
+        if (self.length == 0):
+            # No segment
+            return memoryview(payload)
+
+        self.append(payload)
+        data = self.view[0:self.length]
+        self.length = 0
+        return data
+
+    def reset(self):
+        self.length = 0
@@ -0,0 +1,355 @@
+# Acquisition of the frames in a child process, passed through a shared-memory ring
+#
+# The plot loop and the processing threads share the GIL with the read thread: while
+# they hold it, the serial port is not drained and the UART overruns. With "acqproc",
+# a child process (python uci_shm.py, with its own interpreter and GIL) reads the port,
+# frames and timestamps the bytes and writes the frames to a ring in shared memory.
+# The read thread of the script only moves the frames from the ring to the frame queue
+# (uci_acquisition.py): the RSP correlation, the decode and the sinks are unchanged, as
+# the handlers drive the session states and the commands of the script.
+# The child owns the serial port for both directions: a serial port (COMx) cannot be
+# opened by two processes on Windows, so the script does not open it and writes the
+# commands to a second ring (AcquisitionPort), written to the port by a thread of the
+# child.
+#
+# The ring has a single producer (child) and a single consumer (script). Positions are
+# byte counters that only increase, the write position is updated by the producer after
+# the records are written and the read position by the consumer after they are read.
+# Records: RING_RECORD (time in ns, length) followed by the frame. A record never wraps:
+# RING_PAD marks the end of the ring left unused when the next record does not fit.
+# The frames of a segmented notification are written together when its last frame is
+# read, or dropped together (counted) when the ring is full. RING_RESERVE bytes of the
+# ring are kept for the frames never dropped (RSP, core and session management
+# notifications, as in the frame queue): the commands wait for them. If even the reserve
+# is full, the child waits for the script to read the ring instead of dropping them.
+#
+# Arguments of the child process: uci_shm.py <shared memory name> <port> <baudrate> <command ring name>
+
+from multiprocessing import shared_memory
+
+import os
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+from uci_acquisition import KEPT_NTF_GIDS
+
+# Size of the data of the ring (about 7 s of 8-controlee notifications at 1 kHz)
+RING_SIZE = 1 << 21
+
+# Size of the data of the ring of the commands
+COMMAND_RING_SIZE = 1 << 16
+
+# Bytes of the ring only written by the frames never dropped
+RING_RESERVE = 1 << 14
+
+RING_RECORD = struct.Struct("<qI")
+RING_PAD = 0xFFFFFFFF
+
+# Fields of the header of the shared memory (64-bit counters)
+RING_FIELD = struct.Struct("<Q")
+RING_STATS_FIELDS = struct.Struct("<QQQQ")
+RING_WRITE_POS = 0
+RING_READ_POS = 8
+RING_DATA_SIZE = 16
+RING_STATS = 24      # Frames read by the child, written and dropped, high-water in bytes
+RING_STATE = 56
+RING_STOP = 64
+RING_HEADER_SIZE = 72
+
+# States of the child process
+RING_STARTING = 0
+RING_RUNNING = 1
+RING_FAILED = 2
+RING_EXITED = 3
+
+# Wait of the consumer when the ring is empty
+RING_POLL = 0.0005
+
+
+class FrameRing():
+    # Create the shared memory, or attach to the one of the name given
+    def __init__(self, name=None, size=RING_SIZE):
+        self.owner = (name is None)
+        if (self.owner):
+            self.shm = shared_memory.SharedMemory(create=True, size=RING_HEADER_SIZE + size)
+            self.shm.buf[0:RING_HEADER_SIZE] = bytes(RING_HEADER_SIZE)
+            RING_FIELD.pack_into(self.shm.buf, RING_DATA_SIZE, size)
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # Before Python 3.13, the resource tracker of the child would remove it
+                self.shm = shared_memory.SharedMemory(name=name)
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        self.buf = self.shm.buf
+        self.size = self.get(RING_DATA_SIZE)
+        self.write_pos = self.get(RING_WRITE_POS)
+        self.read_pos = self.get(RING_READ_POS)
+        self.pending = []  # Frames of the segmented notification being read
+        self.read = 0      # Statistics of the producer
+        self.written = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def name(self):
+        return self.shm.name
+
+    def get(self, field):
+        return RING_FIELD.unpack_from(self.buf, field)[0]
+
+    def set(self, field, value):
+        RING_FIELD.pack_into(self.buf, field, value)
+
+    # Position after a record of a frame written at pos
+    def next_pos(self, pos, length):
+        offset = pos % self.size
+        if (offset + RING_RECORD.size + length > self.size):
+            pos += self.size - offset  # End of the ring left unused
+        return pos + RING_RECORD.size + length
+
+    # Producer: write a frame, return False if dropped as the ring is full
+    def push_frame(self, uci_hdr, uci_payload, time_ns):
+        frame = (time_ns, bytes(uci_hdr) + bytes(uci_payload))
+        if ((uci_hdr[0] & 0x10) != 0):
+            # Written with the last frame of the notification
+            self.pending.append(frame)
+            return True
+        if (len(self.pending) == 0):
+            frames = (frame,)
+        else:
+            self.pending.append(frame)
+            frames = self.pending
+            self.pending = []
+        self.read += len(frames)
+
+        first = frames[0][1][0]
+        if (((first & 0xE0) != 0x60) or ((first & 0x0F) in KEPT_NTF_GIDS)):
+            # Never dropped: reserve of the ring, or wait for the consumer
+            while (not self.write(frames)):
+                if (self.get(RING_STOP) != 0):
+                    return self.drop(frames)
+                time.sleep(RING_POLL)
+            return True
+
+        if (not self.write(frames, RING_RESERVE)):
+            return self.drop(frames)
+        return True
+
+    def drop(self, frames):
+        self.dropped += len(frames)
+        self.publish()
+        return False
+
+    # Producer: write the bytes of a record (whole USB packet of a command), return False
+    # if the ring is full
+    def push_data(self, data, time_ns=0):
+        self.read += 1
+        return self.write(((time_ns, bytes(data)),))
+
+    # Producer: write records (time in ns, bytes) together, leaving reserve bytes free,
+    # return False if they do not fit
+    def write(self, frames, reserve=0):
+        end = self.write_pos
+        for time_ns, frame in frames:
+            end = self.next_pos(end, len(frame))
+        used = end - self.get(RING_READ_POS)
+        if (used > self.size - reserve):
+            return False
+
+        pos = self.write_pos
+        for time_ns, frame in frames:
+            offset = pos % self.size
+            if (offset + RING_RECORD.size + len(frame) > self.size):
+                if (self.size - offset >= RING_RECORD.size):
+                    RING_RECORD.pack_into(self.buf, RING_HEADER_SIZE + offset, 0, RING_PAD)
+                pos += self.size - offset
+                offset = 0
+            start = RING_HEADER_SIZE + offset
+            RING_RECORD.pack_into(self.buf, start, time_ns, len(frame))
+            start += RING_RECORD.size
+            self.buf[start:start + len(frame)] = frame
+            pos += RING_RECORD.size + len(frame)
+
+        # Frames visible to the consumer once written
+        self.write_pos = pos
+        self.set(RING_WRITE_POS, pos)
+        self.written += len(frames)
+        if (used > self.high_water):
+            self.high_water = used
+        self.publish()
+        return True
+
+    # Statistics of the producer, read by the consumer
+    def publish(self):
+        RING_STATS_FIELDS.pack_into(self.buf, RING_STATS, self.read, self.written, self.dropped, self.high_water)
+
+    # Consumer: next frame (header, payload, time in ns), None if none before the timeout
+    def pop(self, timeout=0.1):
+        record = self.pop_data(timeout)
+        if (record is None):
+            return None
+        time_ns, frame = record
+        return (frame[0:4], frame[4:], time_ns)
+
+    # Consumer: next record (time in ns, bytes), None if none before the timeout
+    def pop_data(self, timeout=0.1):
+        deadline = None
+        while True:
+            if (self.read_pos == self.get(RING_WRITE_POS)):
+                if (deadline is None):
+                    deadline = time.monotonic() + timeout
+                elif (time.monotonic() > deadline):
+                    return None
+                time.sleep(RING_POLL)
+                continue
+
+            offset = self.read_pos % self.size
+            if (self.size - offset >= RING_RECORD.size):
+                time_ns, length = RING_RECORD.unpack_from(self.buf, RING_HEADER_SIZE + offset)
+                if (length != RING_PAD):
+                    start = RING_HEADER_SIZE + offset + RING_RECORD.size
+                    record = (time_ns, bytes(self.buf[start:start + length]))
+                    self.read_pos += RING_RECORD.size + length
+                    self.set(RING_READ_POS, self.read_pos)
+                    return record
+
+            # End of the ring left unused
+            self.read_pos += self.size - offset
+            self.set(RING_READ_POS, self.read_pos)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if (self.owner):
+            self.shm.unlink()
+
+    def report(self):
+        return "Read:%d   Written:%d   Dropped:%d   Ring high-water:%d/%d bytes" \
+               % (RING_STATS_FIELDS.unpack_from(self.buf, RING_STATS) + (self.size,))
+
+
+class AcquisitionProcess():
+    def __init__(self, port, baudrate, size=RING_SIZE):
+        self.port = port
+        self.baudrate = baudrate
+        self.ring = FrameRing(size=size)
+        self.commands = FrameRing(size=COMMAND_RING_SIZE)
+        self.process = None
+
+    # Start the child process, return False if it cannot open the port
+    def start(self, timeout=5.0):
+        child = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uci_shm.py")
+        self.process = subprocess.Popen([sys.executable, child, self.ring.name(), self.port, str(self.baudrate),
+                                         self.commands.name()])
+
+        deadline = time.monotonic() + timeout
+        while (self.ring.get(RING_STATE) == RING_STARTING):
+            if ((self.process.poll() is not None) or (time.monotonic() > deadline)):
+                break
+            time.sleep(0.01)
+        return (self.ring.get(RING_STATE) == RING_RUNNING)
+
+    def stop(self):
+        self.ring.set(RING_STOP, 1)
+        try:
+            self.process.wait(timeout=2.0)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    # Write bytes to the port through the child, wait while the ring of the commands is full
+    def write(self, data):
+        while (not self.commands.push_data(data)):
+            if (self.ring.get(RING_STATE) != RING_RUNNING):
+                return 0
+            time.sleep(RING_POLL)
+        return len(data)
+
+    def is_running(self):
+        return (self.ring.get(RING_STATE) == RING_RUNNING)
+
+    def report(self):
+        return self.ring.report()
+
+    def close(self):
+        self.ring.close()
+        self.commands.close()
+
+
+# Serial port of the script while the child process owns it: only the writes of the
+# commands, the frames read are popped from the ring of the acquisition
+class AcquisitionPort():
+    def __init__(self, acquisition):
+        self.acquisition = acquisition
+        self.baudrate = acquisition.baudrate
+        self.closed = False
+
+    def isOpen(self):
+        return ((not self.closed) and (self.acquisition.is_running()))
+
+    def write(self, data):
+        return self.acquisition.write(data)
+
+    def close(self):
+        self.closed = True
+
+
+# Child process: write the commands of the script to the port until the stop is requested
+def write_commands(port, ring, commands):
+    while (ring.get(RING_STOP) == 0):
+        record = commands.pop_data()
+        if (record is not None):
+            port.write(record[1])
+
+
+# Child process: read the port until the stop is requested or the script is gone
+def main():
+    import serial
+    import threading
+    from uci_reader import UciFrameReader, UCI_HDR_SIZE
+
+    # Ctrl+C is handled by the script, which stops the acquisition
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    ring = FrameRing(sys.argv[1])
+    commands = FrameRing(sys.argv[4])
+    parent = os.getppid()
+    try:
+        port = serial.Serial(sys.argv[2], int(sys.argv[3]), timeout=0.1)
+    except (serial.SerialException, ValueError):
+        ring.set(RING_STATE, RING_FAILED)
+        commands.close()
+        ring.close()
+        sys.exit(1)
+
+    reader = UciFrameReader(port)
+    writer = threading.Thread(target=write_commands, args=(port, ring, commands), daemon=True)
+    writer.start()
+    ring.set(RING_STATE, RING_RUNNING)
+    while (ring.get(RING_STOP) == 0):
+        try:
+            uci_hdr, uci_payload = reader.read_frame()
+        except OSError:
+            # Port closed by the device
+            break
+
+        if (len(uci_hdr) == UCI_HDR_SIZE):
+            ring.push_frame(uci_hdr, uci_payload, reader.time_ns)
+        elif (os.getppid() != parent):
+            break
+
+    ring.set(RING_STOP, 1)
+    writer.join()
+    port.close()
+    ring.set(RING_STATE, RING_EXITED)
+    commands.close()
+    ring.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+# Virtual UWB device on a Linux pseudo-terminal
+#
+# Answers the command sequence queued by Initiator.py and Responder.py and, while the
+# session is active, emits RANGE_DATA_NTF (multicast layout, one measurement per
+# controlee), DBG_RFRAME_LOG_NTF and DBG_CIR0/CIR1_LOG_NTF at configurable rates.
+# Notifications longer than the segment size are segmented with PBF like the device
+# does, and errors can be injected (ranging errors, lost notifications, corrupted
+# payloads, COMMAND_RETRY instead of RSP, lost RSP).
+# Without FIFO, the writes wait for the host to read the pseudo-terminal (rounds late,
+# never lost). With FIFO, the frames are queued to a transmit buffer of this size,
+# written by its own thread: a round not fitting is lost as by the overrun of the UART
+# of the device (seq_cnt still increased), so the host sees gaps in the sequence.
+# The scripts run unmodified against the symbolic link to the pseudo-terminal, named
+# like a COM port and created in the current directory (scripts started in the same
+# directory, without bin_path as it changes the working directory):
+#   python3 uci_simulator.py RATE=1000 &
+#   python3 Initiator.py COMSIM noplot
+#
+# Arguments: uci_simulator.py [LINK=COMSIM] [RATE=5] [CONTROLEES=8] [SEGMENT=255] [RFRAME=0] [CIR=0]
+#                             [ERROR=0] [DROP=0] [CORRUPT=0] [RETRY=0] [SILENT=0] [SEED=x] [DURATION=0]
+#                             [FIFO=0]
+#   Path of the symbolic link to the pseudo-terminal ("LINK=/dev/ttyUSB0" needs the rights on /dev)
+#   Ranging rounds per second (0: as fast as the host reads)
+#   Maximum number of controlees reported (NUMBER_OF_CONTROLEES of the session if lower)
+#   Maximum payload size of a frame before segmentation (above 255, extended length is used)
+#   DBG_RFRAME_LOG_NTF every N ranging rounds (0: never)
+#   DBG_CIR0_LOG_NTF and DBG_CIR1_LOG_NTF every N ranging rounds (0: never)
+#   Probability of a measurement with an error status
+#   Probability of a RANGE_DATA_NTF not sent
+#   Probability of a RANGE_DATA_NTF with a corrupted byte in its measurements
+#   Probability of a command answered by CORE_GENERIC_ERROR_NTF(COMMAND_RETRY) instead of its RSP
+#   Probability of a command without RSP
+#   Seed of the error injection
+#   Duration of the simulation in seconds (0: until Ctrl+C)
+#   Size in bytes of the transmit buffer (0: the writes wait for the host)
+
+import math
+import os
+import pty
+import random
+import signal
+import struct
+import sys
+import threading
+import time
+import tty
+
+from uci_coalesce import parameter_ids
+
+# Bytes written at once from the transmit buffer
+TRANSMIT_CHUNK = 4096
+
+# Session states reported by SESSION_STATUS_NTF
+SESSION_STATE_INIT = 0x00
+SESSION_STATE_DEINIT = 0x01
+SESSION_STATE_ACTIVE = 0x02
+SESSION_STATE_IDLE = 0x03
+
+# Status of a measurement with an injected error (RX timeout)
+RANGING_STATUS_ERROR = 0x21
+
+# RANGE_DATA_NTF header: sequence counter, session ID, RCR indication, current ranging
+# interval, ranging measurement type, RFU, MAC addressing mode, RFU, number of measurements
+RANGE_DATA_HEADER = struct.Struct("<IIBIBBB8sB")
+
+# Measurement with short MAC address: MAC address, status, NLoS, distance, AoA azimuth
+# and FOM, AoA elevation and FOM, destination AoA azimuth and FOM, destination AoA
+# elevation and FOM, slot index, RFU
+RANGE_DATA_MEASUREMENT = struct.Struct("<HBBHhBhBhBhBB12s")
+
+# NXP extended data (NXP_EXTENDED_NTF_CONFIG): length, data type, RX mode, number of RX
+# antennas, RX antenna info, then per measurement RSSI RX1 and RX2, PDoA and PDoA index
+# of both antenna pairs (PDoA at offsets 66 and 70 of a single measurement)
+NXP_EXTENDED_HEADER = struct.Struct("<HBBBB")
+NXP_EXTENDED_MEASUREMENT = struct.Struct("<hhhHhH")
+
+# DBG_RFRAME_LOG_NTF measurement: mapping, RFU, 16 CIR samples (int16 real and imaginary)
+RFRAME_MEASUREMENT_SIZE = 27 + 64
+
+# Samples in a DBG_CIR0/CIR1_LOG_NTF
+CIR_LOG_SAMPLES = 1016
+
+
+class SimulatorStats():
+    def __init__(self):
+        self.start = time.monotonic()
+        self.commands = 0
+        self.rounds = 0
+        self.frames = 0
+        self.bytes = 0
+        self.errors = 0
+        self.dropped = 0
+        self.corrupted = 0
+        self.retries = 0
+        self.silent = 0
+        self.overruns = 0
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        return "Commands:%d   Rounds:%d (%.1f/s)   Frames:%d (%.1f/s)   Bytes:%d (%.1f kB/s)" \
+               % (self.commands, self.rounds, self.rounds / elapsed, self.frames, self.frames / elapsed,
+                  self.bytes, self.bytes / elapsed / 1000) + \
+               "   Injected errors:%d   Dropped:%d   Corrupted:%d   Retry NTF:%d   Lost RSP:%d   Overruns:%d" \
+               % (self.errors, self.dropped, self.corrupted, self.retries, self.silent, self.overruns)
+
+
+# Split the TLVs of a configuration command into a dictionary {parameter ID: TLV}
+def split_tlvs(tlvs):
+    params = {}
+    idx = 0
+    for parameter_id in parameter_ids(tlvs):
+        length = tlvs[idx + len(parameter_id)]
+        params[parameter_id] = bytes(tlvs[idx:idx + len(parameter_id) + 1 + length])
+        idx += len(parameter_id) + 1 + length
+    return params
+
+
+# Read the TLVs of the requested parameters (unknown parameters are ignored)
+def get_tlvs(params, ids):
+    tlvs = [params[parameter_id] for parameter_id in parameter_ids_list(ids) if parameter_id in params]
+    return [0x00, len(tlvs)] + list(b"".join(tlvs))
+
+
+# IDs of a list of parameter IDs without values (IDs 0xE0 to 0xE4 are on two bytes)
+def parameter_ids_list(ids):
+    result = []
+    idx = 0
+    while (idx < len(ids)):
+        size = 2 if (0xE0 <= ids[idx] <= 0xE4) else 1
+        result.append(bytes(ids[idx:idx + size]))
+        idx += size
+    return result
+
+
+class VirtualDevice():
+    def __init__(self, rate=5, controlees=8, segment=255, rframe=0, cir=0,
+                 error=0.0, drop=0.0, corrupt=0.0, retry=0.0, silent=0.0, seed=None, fifo=0):
+        self.rate = rate
+        self.controlees = controlees
+        self.segment = segment
+        self.rframe = rframe
+        self.cir = cir
+        self.error = error
+        self.drop = drop
+        self.corrupt = corrupt
+        self.retry = retry
+        self.silent = silent
+        self.fifo = fifo
+        self.random = random.Random(seed)
+        self.stats = SimulatorStats()
+
+        self.master = None
+        self.write_lock = threading.Lock()
+        self.connected = threading.Event()  # Host reading the port
+        self.ranging = threading.Event()
+        self.stopped = threading.Event()
+        self.pending = bytearray()  # Transmit buffer (FIFO)
+        self.pending_ready = threading.Condition()
+        self.threads = []
+
+        self.reset()
+
+    def reset(self):
+        self.core_config = {}
+        self.app_config = {}
+        self.session_id = None
+        self.session_state = None
+        self.seq_cnt = 0
+        self.ranging.clear()
+
+    # Open the pseudo-terminal, return the name of its slave side
+    # (not kept open, to detect when the host closes the port)
+    def open(self):
+        self.master, slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(slave)
+        name = os.ttyname(slave)
+        os.close(slave)
+        return name
+
+    def start(self):
+        targets = [self.read_commands, self.range_rounds]
+        if (self.fifo > 0):
+            targets.append(self.transmit)
+        for target in targets:
+            thread = threading.Thread(target=target, args=(), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        self.ranging.set()  # Release the ranging thread
+        with self.pending_ready:
+            self.pending_ready.notify_all()
+        os.close(self.master)
+
+    # Write frames, queued to the transmit buffer with FIFO (a round is lost if it does
+    # not fit, other frames are always queued)
+    def write(self, data, is_round=False):
+        if (self.fifo > 0):
+            with self.pending_ready:
+                if ((is_round) and (len(self.pending) + len(data) > self.fifo)):
+                    self.stats.overruns += 1
+                    return
+                self.pending += data
+                self.pending_ready.notify()
+        else:
+            self.write_port(data)
+
+    # Thread writing the transmit buffer to the pseudo-terminal, the bytes are removed
+    # from the buffer once written
+    def transmit(self):
+        while (not self.stopped.is_set()):
+            with self.pending_ready:
+                while ((len(self.pending) == 0) and (not self.stopped.is_set())):
+                    self.pending_ready.wait()
+                data = bytes(self.pending[0:TRANSMIT_CHUNK])
+            if (len(data) > 0):
+                self.write_port(data)
+                with self.pending_ready:
+                    del self.pending[0:len(data)]
+
+    def write_port(self, data):
+        with self.write_lock:
+            if ((not self.connected.is_set()) or (self.stopped.is_set())):
+                # Nobody to read: dropped as by the USB link
+                return
+
+            try:
+                view = memoryview(data)
+                while (len(view) > 0):
+                    written = os.write(self.master, view)
+                    view = view[written:]
+                self.stats.bytes += len(data)
+            except OSError:
+                self.connected.clear()
+
+    # Frames of a message, segmented with PBF if longer than the segment size
+    def frames(self, mt_gid, oid, payload):
+        frames = bytearray()
+        idx = 0
+        while True:
+            chunk = payload[idx:idx + self.segment]
+            idx += len(chunk)
+            pbf = 0x10 if (idx < len(payload)) else 0x00
+            if (len(chunk) > 0xFF):
+                # Extended length
+                frames += bytes([mt_gid | pbf, oid | 0x80, len(chunk) & 0xFF, len(chunk) >> 8])
+            else:
+                frames += bytes([mt_gid | pbf, oid, 0x00, len(chunk)])
+            frames += chunk
+            self.stats.frames += 1
+            if (pbf == 0x00):
+                return frames
+
+    def send(self, mt_gid, oid, payload):
+        self.write(self.frames(mt_gid, oid, bytes(payload)))
+
+    def session_status_ntf(self, state, reason=0x00):
+        self.session_state = state
+        self.send(0x61, 0x02, list(self.session_id) + [state, reason])
+
+    ###########################################################
+    def read_commands(self):
+        buffer = bytearray()
+        while (not self.stopped.is_set()):
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                # Port not opened by the host: wait for the next one
+                self.connected.clear()
+                buffer.clear()
+                time.sleep(0.01)
+                continue
+
+            self.connected.set()
+            buffer += data
+            # USB packet: 0x01, 0x00, length of the UCI command, UCI command
+            while ((len(buffer) >= 3) and (len(buffer) >= 3 + buffer[2])):
+                uci_command = bytes(buffer[3:3 + buffer[2]])
+                del buffer[:3 + buffer[2]]
+                if (len(uci_command) >= 4):
+                    self.handle_command(uci_command)
+
+    def handle_command(self, uci_command):
+        gid = uci_command[0] & 0x0F
+        oid = uci_command[1] & 0x3F
+        payload = uci_command[4:]
+        self.stats.commands += 1
+
+        if (self.random.random() < self.retry):
+            # The host must send the command again
+            self.stats.retries += 1
+            self.send(0x60, 0x07, [0x0A])
+            return
+        if (self.random.random() < self.silent):
+            # The host must repeat the command on timeout
+            self.stats.silent += 1
+            return
+
+        handler = {
+            (0x00, 0x00): self.core_device_reset,
+            (0x00, 0x02): self.core_get_device_info,
+            (0x00, 0x03): self.core_get_caps_info,
+            (0x00, 0x04): self.core_set_config,
+            (0x00, 0x05): self.core_get_config,
+            (0x01, 0x00): self.session_init,
+            (0x01, 0x01): self.session_deinit,
+            (0x01, 0x03): self.session_set_app_config,
+            (0x01, 0x04): self.session_get_app_config,
+            (0x01, 0x06): self.session_get_state,
+            (0x02, 0x00): self.range_start,
+            (0x02, 0x01): self.range_stop,
+            (0x0A, 0x01): self.read_calib_data,
+        }.get((gid, oid))
+
+        if (handler is None):
+            # Vendor commands (board variant, calibrations): accepted
+            self.send(0x40 | gid, oid, [0x00])
+        else:
+            handler(gid, oid, payload)
+
+    def core_device_reset(self, gid, oid, payload):
+        self.reset()
+        self.send(0x40, 0x00, [0x00])
+        self.send(0x60, 0x01, [0x01])  # DEVICE_STATUS_NTF: ready
+
+    def core_get_device_info(self, gid, oid, payload):
+        # UCI, MAC, PHY and test versions, vendor information
+        self.send(0x40, 0x02, [0x00, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x04] + list(b"VSIM"))
+
+    def core_get_caps_info(self, gid, oid, payload):
+        self.send(0x40, 0x03, [0x00, 0x00])
+
+    def core_set_config(self, gid, oid, payload):
+        self.core_config.update(split_tlvs(payload[1:]))
+        self.send(0x40, 0x04, [0x00, 0x00])
+
+    def core_get_config(self, gid, oid, payload):
+        self.send(0x40, 0x05, get_tlvs(self.core_config, payload[1:]))
+
+    def session_init(self, gid, oid, payload):
+        if (self.session_state is not None):
+            self.send(0x41, 0x00, [0x12])  # SESSION_DUPLICATE
+            return
+
+        self.session_id = bytes(payload[0:4])
+        self.send(0x41, 0x00, [0x00])
+        self.session_status_ntf(SESSION_STATE_INIT)
+
+    def session_deinit(self, gid, oid, payload):
+        if (self.session_state is None):
+            self.send(0x41, 0x01, [0x11])  # SESSION_NOT_EXIST
+            return
+
+        self.ranging.clear()
+        self.send(0x41, 0x01, [0x00])
+        self.session_status_ntf(SESSION_STATE_DEINIT)
+        self.session_state = None
+        self.app_config = {}
+
+    def session_set_app_config(self, gid, oid, payload):
+        if (self.session_state is None):
+            self.send(0x41, 0x03, [0x11])
+            return
+
+        self.app_config.update(split_tlvs(payload[5:]))
+        self.send(0x41, 0x03, [0x00, 0x00])
+        if (self.session_state == SESSION_STATE_INIT):
+            self.session_status_ntf(SESSION_STATE_IDLE)
+
+    def session_get_app_config(self, gid, oid, payload):
+        if (self.session_state is None):
+            self.send(0x41, 0x04, [0x11])
+            return
+
+        self.send(0x41, 0x04, get_tlvs(self.app_config, payload[5:]))
+
+    def session_get_state(self, gid, oid, payload):
+        if (self.session_state is None):
+            self.send(0x41, 0x06, [0x11])
+        else:
+            self.send(0x41, 0x06, [0x00, self.session_state])
+
+    def range_start(self, gid, oid, payload):
+        if (self.session_state != SESSION_STATE_IDLE):
+            self.send(0x42, 0x00, [0x15])  # SESSION_NOT_CONFIGURED
+            return
+
+        self.send(0x42, 0x00, [0x00])
+        self.session_status_ntf(SESSION_STATE_ACTIVE)
+        self.ranging.set()
+
+    def range_stop(self, gid, oid, payload):
+        self.ranging.clear()
+        self.send(0x42, 0x01, [0x00])
+        if (self.session_state == SESSION_STATE_ACTIVE):
+            self.session_status_ntf(SESSION_STATE_IDLE)
+
+    def read_calib_data(self, gid, oid, payload):
+        self.send(0x4A, 0x01, [0x00])
+        if (payload[2] == 0x02):
+            # XTAL_CAP
+            self.send(0x6A, 0x01, [0x00, 0x03, 0x11, 0x12, 0x13])
+        else:
+            # TX_POWER
+            self.send(0x6A, 0x01, [0x00, 0x04, 0x20, 0x01, 0x00, 0x00])
+
+    ###########################################################
+    # Configuration of the session used by the notifications
+    def app_value(self, parameter_id, default):
+        tlv = self.app_config.get(bytes([parameter_id]))
+        if (tlv is None):
+            return default
+        return int.from_bytes(tlv[2:], "little")
+
+    # MAC addresses of the peers measured in each round
+    def peers(self):
+        if (self.app_value(0x11, 0x01) == 0x00):
+            # Responder: measures the initiator
+            count = 1
+        else:
+            count = min(self.app_value(0x05, self.controlees), self.controlees)
+
+        tlv = self.app_config.get(bytes([0x07]))
+        addresses = []
+        if (tlv is not None):
+            addresses = [int.from_bytes(tlv[idx:idx + 2], "little") for idx in range(2, len(tlv) - 1, 2)]
+        while (len(addresses) < count):
+            addresses.append(0x1000 + len(addresses))
+        return addresses[0:count]
+
+    def range_data_ntf(self, peers):
+        payload = bytearray(RANGE_DATA_HEADER.pack(self.seq_cnt, int.from_bytes(self.session_id, "little"),
+                                                   0x00, self.app_value(0x09, 200), 0x01, 0x00, 0x00,
+                                                   bytes(8), len(peers)))
+        extended = []
+        for idx, address in enumerate(peers):
+            # Peers moving slowly around the device
+            phase = self.seq_cnt / 50.0 + idx
+            distance = int(100 + 30 * idx + 20 * math.sin(phase))
+            azimuth = int(40 * math.sin(phase) * 128)   # Q9.7
+            elevation = int(10 * math.cos(phase) * 128)  # Q9.7
+            status = 0x00
+            if (self.random.random() < self.error):
+                self.stats.errors += 1
+                status = RANGING_STATUS_ERROR
+            payload += RANGE_DATA_MEASUREMENT.pack(address, status, 0, distance, azimuth, 100, elevation, 90,
+                                                   0, 0, 0, 0, idx, bytes(12))
+            extended.append(NXP_EXTENDED_MEASUREMENT.pack(-60 * 2, -62 * 2, azimuth // 2, idx, elevation // 2, idx))
+
+        if (self.core_config.get(bytes([0xE4, 0x33]), b"\xE4\x33\x01\x00")[3] == 0x01):
+            # NXP_EXTENDED_NTF_CONFIG enabled
+            data = b"".join(extended)
+            payload += NXP_EXTENDED_HEADER.pack(4 + len(data), 0xA0, 0x01, 0x02, 0x00) + data
+
+        if (self.random.random() < self.corrupt):
+            self.stats.corrupted += 1
+            idx = self.random.randrange(RANGE_DATA_HEADER.size, len(payload))
+            payload[idx] ^= 1 << self.random.randrange(8)
+        return self.frames(0x62, 0x00, payload)
+
+    def rframe_log_ntf(self, peers):
+        payload = bytearray(self.session_id) + bytes([len(peers)])
+        for idx in range(0, len(peers)):
+            measurement = bytearray(RFRAME_MEASUREMENT_SIZE)
+            measurement[0] = idx + 1
+            # Peak of the CIR at the 8th sample
+            struct.pack_into("<hh", measurement, 27 + 8 * 4, 1000, -500)
+            payload += measurement
+        return self.frames(0x6E, 0x0B, payload)
+
+    def cir_log_ntf(self, oid):
+        samples = bytearray(CIR_LOG_SAMPLES * 4)
+        struct.pack_into("<hh", samples, 64 * 4, 2000, 1000)
+        return self.frames(0x6E, oid, bytes(self.session_id) + samples)
+
+    def range_rounds(self):
+        next_round = time.perf_counter()
+        while (not self.stopped.is_set()):
+            if (not self.ranging.is_set()):
+                self.ranging.wait()
+                next_round = time.perf_counter()
+            if (self.stopped.is_set()):
+                return
+
+            if (self.rate > 0):
+                # Fixed rate, late rounds are sent without waiting
+                next_round += 1.0 / self.rate
+                delay = next_round - time.perf_counter()
+                if (delay > 0):
+                    time.sleep(delay)
+                if (not self.ranging.is_set()):
+                    continue
+
+            peers = self.peers()
+            frames = bytearray()
+            if (self.random.random() < self.drop):
+                self.stats.dropped += 1
+            else:
+                frames += self.range_data_ntf(peers)
+            if ((self.rframe > 0) and (self.seq_cnt % self.rframe == 0)):
+                frames += self.rframe_log_ntf(peers)
+            if ((self.cir > 0) and (self.seq_cnt % self.cir == 0)):
+                frames += self.cir_log_ntf(0x04)
+                frames += self.cir_log_ntf(0x05)
+
+            self.seq_cnt += 1
+            self.stats.rounds += 1
+
+            # All the frames of a round in a single write
+            self.write(frames, is_round=True)
+
+
+def main():
+    link = "COMSIM"
+    duration = 0
+    options = {}
+
+    for arg in sys.argv[1:]:
+        name, _, value = arg.partition("=")
+        if (name == "LINK"):
+            link = value
+        elif (name == "DURATION"):
+            duration = float(value)
+        elif (name in ["RATE", "ERROR", "DROP", "CORRUPT", "RETRY", "SILENT"]):
+            options[name.lower()] = float(value)
+        elif (name in ["CONTROLEES", "SEGMENT", "RFRAME", "CIR", "SEED", "FIFO"]):
+            options[name.lower()] = int(value)
+        else:
+            print("Unknown argument: " + arg)
+            sys.exit(1)
+
+    device = VirtualDevice(**options)
+    port = device.open()
+
+    if (os.path.lexists(link)):
+        os.remove(link)
+    os.symlink(port, link)
+    print("Virtual UWB device on " + port + " (" + link + ")")
+
+    device.start()
+
+    # Run until Ctrl+C or the end of the duration
+    finished = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: finished.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: finished.set())
+    finished.wait(duration if (duration > 0) else None)
+
+    device.stop()
+    os.remove(link)
+    print("Simulator statistics: " + device.stats.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Startup timeline of the scripts
+#
+# Imported first by the scripts to take the start of the timeline. Heavy modules
+# (plotting, numeric and IPC) are imported through load() only by the modes using
+# them, with their import time recorded. The report gives the time of each step
+# until the first UCI command is sent, in the spirit of "python -X importtime", and
+# the latency from the restart of the script to the first measurement.
+
+import importlib
+import sys
+import time
+
+
+class StartupReport():
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+        self.imports = []
+        self.complete = False
+        self.measured = False
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+
+    # Import a module and record the time spent (nothing recorded if already imported)
+    def load(self, name):
+        if (name in sys.modules):
+            return sys.modules[name]
+
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        self.imports.append((name, time.perf_counter() - start))
+        return module
+
+    # Last step of the timeline, return True the first time only
+    def first_command(self):
+        if (self.complete):
+            return False
+
+        self.mark("first UCI command")
+        self.complete = True
+        return True
+
+    # First measurement received, return True the first time only
+    def first_measurement(self):
+        if (self.measured):
+            return False
+
+        self.mark("first measurement")
+        self.measured = True
+        return True
+
+    # Time since the start of the script to the last step
+    def elapsed(self):
+        return (self.marks[-1][1] - self.start)
+
+    def report(self):
+        lines = ["     step    |     total    | event"]
+        previous = self.start
+        for name, at in self.marks:
+            lines.append("%9.1f ms | %9.1f ms | %s" % ((at - previous) * 1000, (at - self.start) * 1000, name))
+            previous = at
+
+        for name, duration in self.imports:
+            lines.append("%9.1f ms | %9s    | import %s" % (duration * 1000, "", name))
+        if (len(self.imports) == 0):
+            lines.append("%9s    | %9s    | no plotting, numeric or IPC module imported" % ("", ""))
+        return lines
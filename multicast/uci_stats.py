@@ -0,0 +1,303 @@
+# Rolling statistics of the measurements of each controlee
+#
+# The Responder kept the last avg_window_size values of each field in lists, removed
+# the oldest with pop(0) and averaged them with sum() / len() on every measurement
+# (O(window) each), and the Initiator kept no average of its controlees. Here each
+# controlee (MAC address) has a preallocated ring of its last measurements, flat array
+# of doubles (one row of the values of the fields per measurement, numpy.frombuffer()
+# views it as a (size, fields) array without copy), and running sums of the fields
+# updated in O(1) per measurement with one map() over the fields, whatever their number:
+#   - mean from the sums of the values
+#   - variance and standard deviation from the sums of the squares
+#   - minimum and maximum of the window from the minimum and maximum of the values of
+#     the current turn of the ring and of the suffixes of the previous turn (computed
+#     once per turn of the ring, amortized O(1))
+#   - circular mean of the angles (degrees) from the sums of their sine and cosine,
+#     with the mean resultant length (1: all equal, 0: spread around the circle)
+# A controlee only read for its means (Responder) keeps only their sums: the other
+# sums are computed from the ring at the first read of another statistic and updated
+# with each measurement after. The sums are computed again from the ring every
+# RESUM_VALUES values (whole turns of the ring, O(1) amortized) so that the rounding
+# errors of the subtractions do not accumulate. A snapshot is a dict of floats passed
+# as is to the plot, IPC and log sinks.
+
+from array import array
+from operator import add, mul, sub
+
+import math
+
+# Kinds of fields
+LINEAR = "linear"
+CIRCULAR = "circular"  # Angle in degrees
+
+# Default number of values of a window
+WINDOW_SIZE = 10
+
+# Values added between two computations of the sums from the ring
+RESUM_VALUES = 1000
+
+INFINITY = float("inf")
+
+
+# Window of a field of a controlee, view of the ring of its measurements
+class RollingWindow():
+    def __init__(self, controlee, index):
+        self.controlee = controlee
+        self.index = index
+
+    @property
+    def count(self):
+        return self.controlee.count
+
+    # Values of the window, oldest first
+    def ordered(self):
+        return self.controlee.column(self.index, ordered=True)
+
+    def mean(self):
+        controlee = self.controlee
+        if (controlee.count == 0):
+            return 0.0
+        return controlee.sums[self.index] / controlee.count
+
+    def variance(self):
+        controlee = self.controlee
+        if (controlee.count == 0):
+            return 0.0
+        controlee.track()
+        mean = controlee.sums[self.index] / controlee.count
+        return max(controlee.sums_sq[self.index] / controlee.count - mean * mean, 0.0)
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def min(self):
+        controlee = self.controlee
+        if (controlee.count == 0):
+            return 0.0
+        controlee.track()
+        value = controlee.prefix_min[self.index]
+        if (controlee.suffix_min is not None):
+            value = min(value, controlee.suffix_min[controlee.pos][self.index])
+        return value
+
+    def max(self):
+        controlee = self.controlee
+        if (controlee.count == 0):
+            return 0.0
+        controlee.track()
+        value = controlee.prefix_max[self.index]
+        if (controlee.suffix_max is not None):
+            value = max(value, controlee.suffix_max[controlee.pos][self.index])
+        return value
+
+    def snapshot(self):
+        return {"count": self.count, "mean": self.mean(), "std": self.std(), "min": self.min(), "max": self.max()}
+
+    def report(self):
+        return "avg:%.1f std:%.1f min:%.1f max:%.1f" % (self.mean(), self.std(), self.min(), self.max())
+
+
+# Window of angles in degrees
+class CircularWindow(RollingWindow):
+    def __init__(self, controlee, index):
+        RollingWindow.__init__(self, controlee, index)
+        self.slot = controlee.circular.index(index)  # Index in the sums of the angles
+
+    def circular_mean(self):
+        controlee = self.controlee
+        if (controlee.count == 0):
+            return 0.0
+        controlee.track()
+        return math.degrees(math.atan2(controlee.sum_sin[self.slot], controlee.sum_cos[self.slot]))
+
+    # Mean resultant length
+    def resultant(self):
+        controlee = self.controlee
+        if (controlee.count == 0):
+            return 0.0
+        controlee.track()
+        return min(math.hypot(controlee.sum_sin[self.slot], controlee.sum_cos[self.slot]) / controlee.count, 1.0)
+
+    def snapshot(self):
+        snapshot = RollingWindow.snapshot(self)
+        snapshot["circular_mean"] = self.circular_mean()
+        snapshot["resultant"] = self.resultant()
+        return snapshot
+
+    def report(self):
+        return RollingWindow.report(self) + " circ:%.1f" % self.circular_mean()
+
+
+# Ring of the measurements of a controlee, windows of its fields also attributes named
+# as the fields
+class ControleeStats():
+    def __init__(self, address, fields, size=WINDOW_SIZE):
+        if (size < 1):
+            raise ValueError("Window of %d values" % size)
+        self.address = address
+        self.size = size
+        self.names = [name for name, kind in fields]
+        self.fields = len(self.names)
+        self.circular = [index for index, (name, kind) in enumerate(fields) if (kind == CIRCULAR)]
+        self.ring = array("d", bytes(8 * size * self.fields))
+        self.pos = 0       # Row of the next measurement in the ring
+        self.count = 0
+        self.turns = 0     # Turns of the ring before the sums are computed again
+        self.resum_turns = max(RESUM_VALUES // size, 1)
+        self.sums = [0.0] * self.fields
+        self.measurements = 0
+
+        # Sums of the other statistics, from the first read of one of them
+        self.tracking = False
+        self.sums_sq = None
+        self.sum_sin = None   # Per circular field
+        self.sum_cos = None
+        self.prefix_min = None  # Current turn of the ring
+        self.prefix_max = None
+        self.suffix_min = None  # Per row, rows from it to the end of the previous turn
+        self.suffix_max = None
+
+        self.windows = []
+        for index, (name, kind) in enumerate(fields):
+            window = CircularWindow(self, index) if (kind == CIRCULAR) else RollingWindow(self, index)
+            self.windows.append(window)
+            setattr(self, name, window)
+
+    # Values of the fields, in their order
+    def add(self, values):
+        start = self.pos * self.fields
+        end = start + self.fields
+        old = None
+        if (self.count == self.size):
+            old = self.ring[start:end]
+            self.sums = list(map(sub, map(add, self.sums, values), old))
+        else:
+            self.count += 1
+            self.sums = list(map(add, self.sums, values))
+        self.ring[start:end] = array("d", values)
+        self.measurements += 1
+        if (self.tracking):
+            self.update(values, old)
+
+        self.pos += 1
+        if (self.pos == self.size):
+            self.pos = 0
+            self.turns += 1
+            if (self.turns == self.resum_turns):
+                self.turns = 0
+                self.resum()
+            if (self.tracking):
+                self.suffixes()
+
+    # Sums of the squares and of the angles, minimum and maximum of the current turn
+    def update(self, values, old):
+        # Comparisons inline, faster than map(min, ...) for a few fields
+        self.prefix_min = [low if (low < value) else value for low, value in zip(self.prefix_min, values)]
+        self.prefix_max = [high if (high > value) else value for high, value in zip(self.prefix_max, values)]
+        angles = [math.radians(values[index]) for index in self.circular]
+        if (old is None):
+            self.sums_sq = list(map(add, self.sums_sq, map(mul, values, values)))
+            self.sum_sin = list(map(add, self.sum_sin, map(math.sin, angles)))
+            self.sum_cos = list(map(add, self.sum_cos, map(math.cos, angles)))
+        else:
+            self.sums_sq = list(map(sub, map(add, self.sums_sq, map(mul, values, values)), map(mul, old, old)))
+            old_angles = [math.radians(old[index]) for index in self.circular]
+            self.sum_sin = list(map(sub, map(add, self.sum_sin, map(math.sin, angles)), map(math.sin, old_angles)))
+            self.sum_cos = list(map(sub, map(add, self.sum_cos, map(math.cos, angles)), map(math.cos, old_angles)))
+
+    # Minimum and maximum of each row to the end of the turn completed (the oldest rows
+    # of the window during the next turn), new turn started
+    def suffixes(self):
+        fields = self.fields
+        self.suffix_min = [None] * self.size
+        self.suffix_max = [None] * self.size
+        low = [INFINITY] * fields
+        high = [-INFINITY] * fields
+        for row in range(self.size - 1, -1, -1):
+            values = self.ring[row * fields:(row + 1) * fields]
+            low = [current if (current < value) else value for current, value in zip(low, values)]
+            high = [current if (current > value) else value for current, value in zip(high, values)]
+            self.suffix_min[row] = low
+            self.suffix_max[row] = high
+        self.prefix_min = [INFINITY] * fields
+        self.prefix_max = [-INFINITY] * fields
+
+    # Start the sums of the other statistics from the measurements of the ring
+    def track(self):
+        if (self.tracking):
+            return
+        self.tracking = True
+        fields = self.fields
+        self.resum()
+        if (self.count == self.size):
+            # Rows after pos from the previous turn
+            self.suffixes()
+        else:
+            self.suffix_min = None
+            self.suffix_max = None
+        self.prefix_min = [INFINITY] * fields
+        self.prefix_max = [-INFINITY] * fields
+        for row in range(0, self.pos):
+            values = self.ring[row * fields:(row + 1) * fields]
+            self.prefix_min = list(map(min, self.prefix_min, values))
+            self.prefix_max = list(map(max, self.prefix_max, values))
+
+    # Values of a field in the ring, oldest first if ordered
+    def column(self, index, ordered=False):
+        values = self.ring[index:self.count * self.fields:self.fields]
+        if ((ordered) and (self.count == self.size)):
+            return values[self.pos:] + values[0:self.pos]
+        return values
+
+    # Sums computed again from the measurements of the ring
+    def resum(self):
+        columns = [self.column(index) for index in range(0, self.fields)]
+        self.sums = [math.fsum(values) for values in columns]
+        if (self.tracking):
+            self.sums_sq = [math.fsum(value * value for value in values) for values in columns]
+            angles = [[math.radians(value) for value in columns[index]] for index in self.circular]
+            self.sum_sin = [math.fsum(map(math.sin, values)) for values in angles]
+            self.sum_cos = [math.fsum(map(math.cos, values)) for values in angles]
+
+    # Means of the fields, in their order (arithmetic, also for the angles)
+    def means(self):
+        if (self.count == 0):
+            return [0.0] * self.fields
+        count = self.count
+        return [value / count for value in self.sums]
+
+    def snapshot(self):
+        snapshot = {name: window.snapshot() for name, window in zip(self.names, self.windows)}
+        snapshot["measurements"] = self.measurements
+        return snapshot
+
+    def report(self):
+        return "%04x   Measurements:%d   " % (self.address, self.measurements) + \
+               "   ".join("%s %s" % (name.capitalize(), window.report()) for name, window in zip(self.names, self.windows))
+
+
+# Statistics of each controlee, created at its first measurement
+class RollingStats():
+    # fields: (name, LINEAR or CIRCULAR) of the values of a measurement
+    def __init__(self, fields, size=WINDOW_SIZE):
+        self.fields = list(fields)
+        self.size = size
+        self.controlees = {}
+
+    # Add the values of a measurement of a controlee, return its statistics
+    def update(self, address, values):
+        controlee = self.controlees.get(address)
+        if (controlee is None):
+            controlee = ControleeStats(address, self.fields, self.size)
+            self.controlees[address] = controlee
+        controlee.add(values)
+        return controlee
+
+    def get(self, address):
+        return self.controlees.get(address)
+
+    def snapshot(self):
+        return {address: controlee.snapshot() for address, controlee in self.controlees.items()}
+
+    def report(self):
+        return [self.controlees[address].report() for address in sorted(self.controlees)]
@@ -0,0 +1,54 @@
+# Timestamps of the frames, taken at the read and formatted later
+#
+# datetime.now() and its ISO formatting were called for each frame logged and each CSV
+# row, after the payload was read and with a millisecond resolution. Instead, the time
+# of a frame is taken once as time.monotonic_ns() when its bytes are read from the port
+# (UciFrameReader.time_ns) and the sinks keep this raw value. It is converted to
+# wall-clock time with an anchor (wall-clock and monotonic times read together at the
+# start) and formatted only by the sinks writing text, in the log thread. Changes of the
+# system time during a run do not move the timestamps.
+
+from datetime import datetime
+
+import time
+
+
+class TimestampClock():
+    # Anchor read now, or the one stored with a capture
+    def __init__(self, wall_clock_ns=None, monotonic_ns=None):
+        if (wall_clock_ns is None):
+            # Closest pair of readings of the two clocks
+            best = None
+            for idx in range(0, 3):
+                before = time.monotonic_ns()
+                wall_clock = time.time_ns()
+                after = time.monotonic_ns()
+                if ((best is None) or (after - before < best[0])):
+                    best = (after - before, wall_clock, (before + after) // 2)
+            wall_clock_ns, monotonic_ns = best[1:]
+
+        self.wall_clock_ns = wall_clock_ns
+        self.monotonic_ns = monotonic_ns
+        # Last millisecond formatted and its text, one tuple replaced at once as the log
+        # thread and the CSV sink format timestamps concurrently
+        self.last = (None, "")
+
+    def now(self):
+        return time.monotonic_ns()
+
+    # Wall-clock time in ns since the epoch of a monotonic time
+    def wall_clock(self, time_ns):
+        return self.wall_clock_ns + time_ns - self.monotonic_ns
+
+    def datetime(self, time_ns):
+        return datetime.fromtimestamp(self.wall_clock(time_ns) / 1e9)
+
+    # Text as written before the lines of the log ("2021-06-18 10:00:00.123"), the text of
+    # the last millisecond is reused for the frames received in the same millisecond
+    def format(self, time_ns):
+        ms = self.wall_clock(time_ns) // 1000000
+        last_ms, text = self.last
+        if (ms != last_ms):
+            text = datetime.fromtimestamp(ms / 1000).isoformat(sep=" ", timespec="milliseconds")
+            self.last = (ms, text)
+        return text
@@ -0,0 +1,282 @@
+# Compiler of UCI configuration commands
+#
+# The parameters of CORE_SET_CONFIG, SESSION_SET_APP_CONFIG and SET_CALIBRATION are
+# described by a schema (ID, width and encoding of the value). Commands are declared
+# as lists of (name, value) and compiled once into validated bytes images with their
+# length, number of parameters and USB framing computed. Compiled images are kept in
+# a file keyed by the hash of their declaration and of the schema entries of their
+# parameters, so that only new or modified commands, or commands of a parameter whose
+# ID, width or encoding changed, are compiled (and validated) again on next start.
+
+import hashlib
+import json
+
+# Encodings of parameter values
+UINT = "uint"            # Unsigned integer, little endian
+UINT_LIST = "uint_list"  # List of unsigned integers of the width, little endian
+BYTES = "bytes"          # List of bytes, fixed length if width is not None
+
+# Bump when the encoding code changes to invalidate the stored images (changes of the
+# schema entries invalidate the images of their commands)
+SCHEMA_VERSION = 1
+
+
+class Param():
+    def __init__(self, name, param_id, width, encoding=UINT):
+        self.name = name
+        self.id = bytes(param_id)
+        self.width = width
+        self.encoding = encoding
+
+    # Schema entry, part of the key of the stored images
+    def entry(self):
+        return (self.name, self.id.hex(), self.width, self.encoding)
+
+    def encode_uint(self, value):
+        if ((not isinstance(value, int)) or (value < 0) or (value >= (1 << (8 * self.width)))):
+            raise ValueError("%s: %r does not fit in %d byte(s)" % (self.name, value, self.width))
+        return value.to_bytes(self.width, "little")
+
+    # TLV of the parameter
+    def encode(self, value):
+        if (self.encoding == UINT):
+            data = self.encode_uint(value)
+        elif (self.encoding == UINT_LIST):
+            data = b"".join(self.encode_uint(item) for item in value)
+        else:
+            data = bytes(value)
+            if ((self.width is not None) and (len(data) != self.width)):
+                raise ValueError("%s: %d byte(s) instead of %d" % (self.name, len(data), self.width))
+
+        if (len(data) > 0xFF):
+            raise ValueError("%s: value of %d bytes" % (self.name, len(data)))
+        return self.id + bytes([len(data)]) + data
+
+
+def schema(params):
+    return {param.name: param for param in params}
+
+
+# Parameters of CORE_SET_CONFIG
+CORE_CONFIG_PARAMS = schema([
+    Param("DEVICE_STATE", [0x00], 1),
+    Param("LOW_POWER_MODE", [0x01], 1),
+    Param("DPD_WAKEUP_SRC", [0xE4, 0x02], 1),
+    Param("WTX_COUNT_CONFIG", [0xE4, 0x03], 1),
+    Param("DPD_ENTRY_TIMEOUT", [0xE4, 0x04], 2),
+    Param("TX_PULSE_SHAPE_CONFIG", [0xE4, 0x28], 4, BYTES),
+    Param("NXP_EXTENDED_NTF_CONFIG", [0xE4, 0x33], 1),
+    Param("ANTENNA_RX_IDX_DEFINE", [0xE4, 0x60], None, BYTES),
+    Param("ANTENNA_TX_IDX_DEFINE", [0xE4, 0x61], None, BYTES),
+    Param("ANTENNAS_RX_PAIR_DEFINE", [0xE4, 0x62], None, BYTES),
+])
+
+# Parameters of SESSION_SET_APP_CONFIG (FiRa, NXP proprietary and debug)
+APP_CONFIG_PARAMS = schema([
+    Param("DEVICE_TYPE", [0x00], 1),
+    Param("RANGING_ROUND_USAGE", [0x01], 1),
+    Param("STS_CONFIG", [0x02], 1),
+    Param("MULTI_NODE_MODE", [0x03], 1),
+    Param("CHANNEL_NUMBER", [0x04], 1),
+    Param("NUMBER_OF_CONTROLEES", [0x05], 1),
+    Param("DEVICE_MAC_ADDRESS", [0x06], 2),
+    Param("DST_MAC_ADDRESS", [0x07], 2, UINT_LIST),
+    Param("SLOT_DURATION", [0x08], 2),
+    Param("RANGING_DURATION", [0x09], 4),
+    Param("STS_INDEX", [0x0A], 4),
+    Param("MAC_FCS_TYPE", [0x0B], 1),
+    Param("RANGING_ROUND_CONTROL", [0x0C], 1),
+    Param("AOA_RESULT_REQ", [0x0D], 1),
+    Param("RANGE_DATA_NTF_CONFIG", [0x0E], 1),
+    Param("RANGE_DATA_NTF_PROXIMITY_NEAR", [0x0F], 2),
+    Param("RANGE_DATA_NTF_PROXIMITY_FAR", [0x10], 2),
+    Param("DEVICE_ROLE", [0x11], 1),
+    Param("RFRAME_CONFIG", [0x12], 1),
+    Param("RSSI_REPORTING", [0x13], 1),
+    Param("PREAMBLE_CODE_INDEX", [0x14], 1),
+    Param("SFD_ID", [0x15], 1),
+    Param("PSDU_DATA_RATE", [0x16], 1),
+    Param("PREAMBLE_DURATION", [0x17], 1),
+    Param("RANGING_TIME_STRUCT", [0x1A], 1),
+    Param("SLOTS_PER_RR", [0x1B], 1),
+    Param("TX_ADAPTIVE_PAYLOAD_POWER", [0x1C], 1),
+    Param("RESPONDER_SLOT_INDEX", [0x1E], 1),
+    Param("PRF_MODE", [0x1F], 1),
+    Param("SCHEDULED_MODE", [0x22], 1),
+    Param("KEY_ROTATION", [0x23], 1),
+    Param("KEY_ROTATION_RATE", [0x24], 1),
+    Param("SESSION_PRIORITY", [0x25], 1),
+    Param("MAC_ADDRESS_MODE", [0x26], 1),
+    Param("VENDOR_ID", [0x27], 2),
+    Param("STATIC_STS_IV", [0x28], 6, BYTES),
+    Param("NUMBER_OF_STS_SEGMENTS", [0x29], 1),
+    Param("MAX_RR_RETRY", [0x2A], 2),
+    Param("UWB_INITIATION_TIME", [0x2B], 4),
+    Param("HOPPING_MODE", [0x2C], 1),
+    Param("BLOCK_STRIDE_LENGTH", [0x2D], 1),
+    Param("RESULT_REPORT_CONFIG", [0x2E], 1),
+    Param("IN_BAND_TERMINATION_ATTEMPT_COUNT", [0x2F], 1),
+    Param("SUB_SESSION_ID", [0x30], 4),
+    Param("CIR_CAPTURE_MODE", [0xE3, 0x01], 1),
+    Param("MAC_PAYLOAD_ENCRYPTION", [0xE3, 0x02], 1),
+    Param("RX_ANTENNA_POLARIZATION_OPTION", [0xE3, 0x03], 1),
+    Param("SESSION_SYNC_ATTEMPTS", [0xE3, 0x05], 1),
+    Param("SESSION_SHED_ATTEMPTS", [0xE3, 0x06], 1),
+    Param("SCHED_STATUS_NTF", [0xE3, 0x07], 1),
+    Param("TX_POWER_DELTA_FCC", [0xE3, 0x08], 1),
+    Param("TEST_KDF_FEATURE", [0xE3, 0x09], 1),
+    Param("TX_POWER_TEMP_COMPENSATION", [0xE3, 0x0B], 1),
+    Param("WIFI_COEX_MAX_TOLERANCE_COUNT", [0xE3, 0x0C], 1),
+    Param("ADAPTIVE_HOPPING_THRESHOLD", [0xE3, 0x0D], 1),
+    Param("AUTHENTICITY_TAG", [0xE3, 0x13], 1),
+    Param("RX_NBIC_CONFIG", [0xE3, 0x14], 2, BYTES),
+    Param("MAC_CFG", [0xE3, 0x15], 1),
+    Param("SESSION_INBAND_DATA_TX_BLOCKS", [0xE3, 0x16], 1),
+    Param("SESSION_INBAND_DATA_RX_BLOCKS", [0xE3, 0x17], 1),
+    Param("SUSPEND_RANGING", [0xE3, 0x18], 1),
+    Param("RX_ANTENNA_SELECTION_RFM", [0xE3, 0x19], 1),
+    Param("DATA_TRANSFER_MODE", [0xE3, 0x1A], 1),
+    Param("ANTENNAS_CONFIGURATION_TX", [0xE3, 0x1B], None, BYTES),
+    Param("ANTENNAS_CONFIGURATION_RX", [0xE3, 0x1C], None, BYTES),
+    Param("THREAD_SECURE", [0xE4, 0x00], 2),
+    Param("THREAD_SECURE_ISR", [0xE4, 0x01], 2),
+    Param("THREAD_NON_SECURE_ISR", [0xE4, 0x02], 2),
+    Param("THREAD_SHELL", [0xE4, 0x03], 2),
+    Param("THREAD_PHY", [0xE4, 0x04], 2),
+    Param("THREAD_RANGING", [0xE4, 0x05], 2),
+    Param("THREAD_SECURE_ELEMENT", [0xE4, 0x06], 2),
+    Param("DATA_LOGGER_NTF", [0xE4, 0x10], 1),
+    Param("CIR_LOG_NTF", [0xE4, 0x11], 1),
+    Param("PSDU_LOG_NTF", [0xE4, 0x12], 1),
+    Param("RFRAME_LOG_NTF", [0xE4, 0x13], 1),
+    Param("TEST_CONTENTION_RANGING_FEATURE", [0xE4, 0x14], 1),
+])
+
+# Parameters of SET_CALIBRATION (value sent after the channel and the parameter ID)
+CALIBRATION_PARAMS = {
+    "VCO_PLL": 0x00,
+    "TX_POWER": 0x01,
+    "XTAL_CAP": 0x02,
+    "MANUAL_TX_POW_CTRL": 0x06,
+    "AOA_FINE_CALIB_PARAM": 0x08,
+    "TX_TEMPERATURE_COMP": 0x09,
+    "AOA_ANTENNAS_PDOA_CALIB": 0x0C,
+    "AOA_ANTENNAS_MULTIPOINT_CALIB": 0x0D,
+    "RX_ANT_DELAY_CALIB": 0x0F,
+    "PDOA_OFFSET_CALIB": 0x10,
+    "PDOA_MANUFACT_ZERO_OFFSET_CALIB": 0x11,
+    "AOA_THRESHOLD_PDOA": 0x12,
+    "RSSI_CALIB_CONSTANT_HIGH_PWR": 0x13,
+    "RSSI_CALIB_CONSTANT_LOW_PWR": 0x14,
+    "SNR_CALIB_CONSTANT_UNIFIED": 0x15,
+    "TX_POWER_PER_ANTENNA": 0x17,
+}
+
+# Length of the UCI command on one byte in the USB packet
+MAX_COMMAND_SIZE = 0xFF
+
+
+def usb_frame(uci_command):
+    return bytes([0x01, 0x00, len(uci_command)]) + bytes(uci_command)
+
+
+# USB packet of a command, built once for compiled commands
+def wire_frame(uci_command):
+    frame = getattr(uci_command, "frame", None)
+    if (frame is None):
+        frame = usb_frame(uci_command)
+    return frame
+
+
+class UciImage(bytes):
+    def __new__(cls, uci_command):
+        image = bytes.__new__(cls, uci_command)
+        image.frame = usb_frame(image)
+        return image
+
+
+def build_command(gid, oid, payload):
+    if (len(payload) + 4 > MAX_COMMAND_SIZE):
+        raise ValueError("Command %02X %02X: payload of %d bytes" % (0x20 | gid, oid, len(payload)))
+    return bytes([0x20 | gid, oid, 0x00, len(payload)]) + bytes(payload)
+
+
+# Number of parameters followed by their TLVs
+def encode_params(params_schema, params):
+    names = [name for name, value in params]
+    for name in names:
+        if (name not in params_schema):
+            raise ValueError("Unknown parameter %s" % name)
+        if (names.count(name) > 1):
+            raise ValueError("Parameter %s set twice" % name)
+
+    return bytes([len(params)]) + b"".join(params_schema[name].encode(value) for name, value in params)
+
+
+# Schema entries of the parameters of a declaration (None for an unknown parameter, the
+# compilation reports it)
+def schema_entries(params_schema, params):
+    return [params_schema[name].entry() if (name in params_schema) else (name, None) for name, value in params]
+
+
+class UciImageStore():
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.compiled = 0
+        self.loaded = 0
+        self.used = {}
+
+        try:
+            with open(file_name, "r") as store_file:
+                self.images = json.load(store_file)
+        except (OSError, ValueError):
+            self.images = {}
+
+    # entries: schema entries of the parameters of the declaration
+    def image(self, declaration, compile_command, entries=()):
+        key = hashlib.sha1(repr((SCHEMA_VERSION, declaration, list(entries))).encode()).hexdigest()
+
+        if (key in self.images):
+            self.loaded += 1
+            self.used[key] = self.images[key]
+            return UciImage(bytes.fromhex(self.images[key]))
+
+        self.compiled += 1
+        image = UciImage(compile_command())
+        self.used[key] = image.hex()
+        return image
+
+    # Command without parameter list
+    def command(self, gid, oid, payload=()):
+        return self.image(("command", gid, oid, list(payload)),
+                          lambda: build_command(gid, oid, payload))
+
+    def core_set_config(self, params):
+        return self.image(("core_set_config", params),
+                          lambda: build_command(0x00, 0x04, encode_params(CORE_CONFIG_PARAMS, params)),
+                          schema_entries(CORE_CONFIG_PARAMS, params))
+
+    def app_config(self, session_id, params):
+        return self.image(("app_config", list(session_id), params),
+                          lambda: build_command(0x01, 0x03, bytes(session_id) + encode_params(APP_CONFIG_PARAMS, params)),
+                          schema_entries(APP_CONFIG_PARAMS, params))
+
+    def set_calibration(self, channel, name, value):
+        return self.image(("set_calibration", channel, name, list(value)),
+                          lambda: build_command(0x0E, 0x11, bytes([channel, CALIBRATION_PARAMS[name]]) + bytes(value)),
+                          [(name, CALIBRATION_PARAMS.get(name))])
+
+    # Store the images used since start (images of removed or modified commands are dropped)
+    def save(self):
+        if (self.used == self.images):
+            return
+
+        self.images = dict(self.used)
+        try:
+            with open(self.file_name, "w") as store_file:
+                json.dump(self.images, store_file, indent=1)
+        except OSError:
+            pass
+
+    def report(self):
+        return "Compiled:%d   Loaded:%d" % (self.compiled, self.loaded)
@@ -0,0 +1,293 @@
+# UCI command transactions
+#
+# Each command returns a future resolved by the RSP with the same GID/OID.
+# The response timeout of each command adapts to the RTT measured for it
+# (smoothed RTT + 4 x RTT variation, as for TCP retransmissions), retries are
+# bounded and every command keeps an RTT histogram and retry counters.
+# The timeout does not go below MIN_TIMEOUT: the RTT of a command varies with the
+# load of the device and of the host, an estimator fed by a few fast responses would
+# repeat commands only slow to answer. A command repeated after a timeout may still
+# get a RSP for each copy sent: as the RSP only carries the GID/OID, the next command
+# with the same GID/OID is sent once these late RSPs are received (dropped as stray)
+# or after the maximum timeout.
+
+from concurrent.futures import Future
+from threading import Condition, Lock, Timer
+
+import time
+
+UCI_STATUS = {
+    0x00: "OK",
+    0x01: "REJECTED",
+    0x02: "FAILED",
+    0x03: "SYNTAX_ERROR",
+    0x04: "INVALID_PARAM",
+    0x05: "INVALID_RANGE",
+    0x06: "INVALID_MESSAGE_SIZE",
+    0x07: "UNKNOWN_GID",
+    0x08: "UNKNOWN_OID",
+    0x09: "READ_ONLY",
+    0x0A: "COMMAND_RETRY",
+    0x0B: "UNKNOWN",
+    0x11: "SESSION_NOT_EXIST",
+    0x12: "SESSION_DUPLICATE",
+    0x13: "SESSION_ACTIVE",
+    0x14: "MAX_SESSIONS_EXCEEDED",
+    0x15: "SESSION_NOT_CONFIGURED",
+    0x16: "ACTIVE_SESSIONS_ONGOING",
+    0x17: "MULTICAST_LIST_FULL",
+    0x18: "ADDRESS_NOT_FOUND",
+    0x19: "ADDRESS_ALREADY_PRESENT",
+}
+
+# Upper bounds (in ms) of the buckets of the RTT histograms
+RTT_BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+# Bounds of the response timeout in seconds
+MIN_TIMEOUT = 0.1
+MAX_TIMEOUT = 1.0
+
+
+def status_name(status):
+    if (status is None):
+        return "TIMEOUT"
+    return UCI_STATUS.get(status, "0x%02X" % status)
+
+
+class CommandResult():
+    def __init__(self, uci_command, uci_hdr, uci_payload, rtt, attempts):
+        self.command = uci_command
+        self.header = uci_hdr
+        self.payload = uci_payload
+        self.rtt = rtt
+        self.attempts = attempts
+
+        # Status is the first byte of the RSP payload (None if no RSP received)
+        self.status = None
+        if (uci_payload is not None and len(uci_payload) > 0):
+            self.status = uci_payload[0]
+
+    def is_ok(self):
+        return (self.status == 0x00)
+
+    def status_name(self):
+        return status_name(self.status)
+
+
+class CommandStats():
+    def __init__(self, initial_timeout):
+        self.sent = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.retry_requests = 0
+        self.failures = 0
+        self.histogram = [0] * (len(RTT_BUCKETS) + 1)
+        self.rtt_min = None
+        self.rtt_max = None
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = initial_timeout
+
+    def add_rtt(self, rtt, min_timeout, max_timeout):
+        idx = 0
+        while ((idx < len(RTT_BUCKETS)) and (rtt * 1000 > RTT_BUCKETS[idx])):
+            idx += 1
+        self.histogram[idx] += 1
+
+        if ((self.rtt_min is None) or (rtt < self.rtt_min)): self.rtt_min = rtt
+        if ((self.rtt_max is None) or (rtt > self.rtt_max)): self.rtt_max = rtt
+
+        # Smoothed RTT and RTT variation (RFC 6298)
+        if (self.srtt is None):
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+        self.timeout = min(max(self.srtt + 4 * self.rttvar, min_timeout), max_timeout)
+
+    def report(self):
+        string = "Sent:%d   Retries:%d   Timeouts:%d   Retry NTF:%d   Failures:%d" \
+                 % (self.sent, self.retries, self.timeouts, self.retry_requests, self.failures)
+        if (self.srtt is not None):
+            string += "   RTT min/avg/max:%.2f/%.2f/%.2f ms   Timeout:%.2f ms" \
+                      % (self.rtt_min * 1000, self.srtt * 1000, self.rtt_max * 1000, self.timeout * 1000)
+            string += "   Histogram:" + " ".join("%d" % count for count in self.histogram)
+        return string
+
+
+class Transaction():
+    def __init__(self, uci_command):
+        self.command = uci_command
+        self.key = (uci_command[0] & 0x0F, uci_command[1] & 0x3F)
+        self.future = Future()
+        self.attempts = 0
+        self.timeouts = 0  # Copies sent without RSP in time, their RSP may come late
+        self.sent_at = 0
+        self.timer = None
+
+
+class UciTransactions():
+    # transmit(uci_command) writes the command on the serial port
+    def __init__(self, transmit, initial_timeout=0.25, min_timeout=MIN_TIMEOUT, max_timeout=MAX_TIMEOUT, retries=3):
+        self.transmit = transmit
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.retries = retries
+        self.lock = Lock()
+        self.drained = Condition(self.lock)  # Late RSPs received
+        self.pending = None  # UCI allows a single command in flight
+        self.late = {}       # Per GID/OID: (late RSPs expected, time to stop waiting for them)
+        self.stats = {}
+        self.stray = 0
+        self.late_dropped = 0
+        self.late_lost = 0
+
+    def command_stats(self, key):
+        if (key not in self.stats):
+            self.stats[key] = CommandStats(self.initial_timeout)
+        return self.stats[key]
+
+    # Send a UCI command, the future is resolved with a CommandResult
+    def send_command(self, uci_command):
+        transaction = Transaction(uci_command)
+
+        with self.lock:
+            self.wait_late(transaction.key)
+            self.pending = transaction
+            self.prepare(transaction)
+
+        self.send(transaction)
+        return transaction.future
+
+    # Must be called with the lock held, wait for the late RSPs of the previous command
+    # with the same GID/OID so that they do not complete this one
+    def wait_late(self, key):
+        while (key in self.late):
+            count, deadline = self.late[key]
+            remaining = deadline - time.perf_counter()
+            if (remaining <= 0):
+                # Lost or never sent by the device
+                self.late_lost += count
+                del self.late[key]
+                return
+            self.drained.wait(remaining)
+
+    # Must be called with the lock held, the RSPs of the copies timed out may still come
+    def expect_late(self, transaction):
+        if (transaction.timeouts > 0):
+            self.late[transaction.key] = (transaction.timeouts, time.perf_counter() + self.max_timeout)
+
+    # Must be called with the lock held
+    def prepare(self, transaction):
+        stats = self.command_stats(transaction.key)
+
+        transaction.attempts += 1
+        if (transaction.attempts > 1):
+            stats.retries += 1
+        stats.sent += 1
+
+        transaction.timer = Timer(stats.timeout, self.on_timeout, args=(transaction, transaction.attempts))
+        transaction.timer.daemon = True
+
+    # Called without the lock as transmit may wait for the lock of the output
+    def send(self, transaction):
+        transaction.sent_at = time.perf_counter()
+        self.transmit(transaction.command)
+        transaction.timer.start()
+
+    def on_timeout(self, transaction, attempt):
+        with self.lock:
+            if ((self.pending is not transaction) or (transaction.attempts != attempt)):
+                # Response received or command already repeated
+                return
+
+            self.command_stats(transaction.key).timeouts += 1
+            transaction.timeouts += 1
+            repeat = self.retry(transaction)
+
+        if (repeat):
+            self.send(transaction)
+
+    # Must be called with the lock held, return True if the command must be sent again
+    def retry(self, transaction):
+        if (transaction.attempts <= self.retries):
+            self.prepare(transaction)
+            return True
+
+        self.command_stats(transaction.key).failures += 1
+        self.pending = None
+        self.expect_late(transaction)
+        transaction.future.set_result(CommandResult(transaction.command, None, None, None, transaction.attempts))
+        return False
+
+    # RSP received from the device
+    def on_response(self, uci_hdr, uci_payload):
+        received_at = time.perf_counter()
+
+        key = (uci_hdr[0] & 0x0F, uci_hdr[1] & 0x3F)
+        with self.lock:
+            transaction = self.pending
+            if ((transaction is None) or (transaction.key != key)):
+                # Late RSP of a repeated command or RSP without command
+                self.stray += 1
+                if (key in self.late):
+                    self.drop_late(key)
+                return
+
+            transaction.timer.cancel()
+            self.pending = None
+            self.expect_late(transaction)
+
+            rtt = received_at - transaction.sent_at
+            if (transaction.attempts == 1):
+                # Only unambiguous samples feed the estimator (Karn's algorithm)
+                self.command_stats(transaction.key).add_rtt(rtt, self.min_timeout, self.max_timeout)
+
+        transaction.future.set_result(CommandResult(transaction.command, bytes(uci_hdr), bytes(uci_payload),
+                                                    rtt, transaction.attempts))
+
+    # Must be called with the lock held
+    def drop_late(self, key):
+        count, deadline = self.late[key]
+        self.late_dropped += 1
+        if (count > 1):
+            self.late[key] = (count - 1, deadline)
+        else:
+            del self.late[key]
+            self.drained.notify_all()
+
+    # CORE_GENERIC_ERROR_NTF with status COMMAND_RETRY
+    def on_retry_request(self):
+        with self.lock:
+            transaction = self.pending
+            if (transaction is None):
+                return
+
+            transaction.timer.cancel()
+            self.command_stats(transaction.key).retry_requests += 1
+            repeat = self.retry(transaction)
+
+        if (repeat):
+            self.send(transaction)
+
+    # Stop waiting for the command in flight
+    def cancel(self):
+        with self.lock:
+            transaction = self.pending
+            self.pending = None
+            self.late.clear()
+            self.drained.notify_all()
+
+        if (transaction is not None):
+            transaction.timer.cancel()
+            transaction.future.cancel()
+
+    def report(self):
+        lines = []
+        for key in sorted(self.stats):
+            lines.append("GID:0x%X OID:0x%02X   " % key + self.stats[key].report())
+        lines.append("Stray RSP:%d   Late RSP dropped:%d   Late RSP lost:%d" % (self.stray, self.late_dropped, self.late_lost))
+        return lines